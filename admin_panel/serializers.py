@@ -3,10 +3,10 @@ from storage.models import CustomUser, File
 
 
 class AdminUserUpdateSerializer(serializers.ModelSerializer):
-    """Сериализатор для изменения статуса администратора"""
+    """Сериализатор для изменения статуса администратора и квоты"""
     class Meta:
         model = CustomUser
-        fields = ['is_admin']
+        fields = ['is_admin', 'quota_bytes']
 
 
 class AdminFileSerializer(serializers.ModelSerializer):
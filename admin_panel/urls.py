@@ -1,5 +1,8 @@
 from django.urls import path
-from .views import AdminUserListView, AdminUserUpdateView, AdminFileListView, AdminFileDeleteView, AdminUserDeleteView
+from .views import (
+    AdminUserListView, AdminUserUpdateView, AdminFileListView, AdminFileDeleteView, AdminUserDeleteView,
+    AdminFileBulkDeleteView, AdminCacheStatsView
+)
 
 urlpatterns = [
     path('users/', AdminUserListView.as_view(), name='admin-user-list'),
@@ -7,4 +10,6 @@ urlpatterns = [
     path('users/<int:pk>/delete/', AdminUserDeleteView.as_view(), name='admin-user-delete'),
     path('users/<int:user_id>/files/', AdminFileListView.as_view(), name='admin-user-files'),
     path('files/<int:pk>/', AdminFileDeleteView.as_view(), name='admin-file-delete'),
+    path('files/bulk-delete/', AdminFileBulkDeleteView.as_view(), name='admin-file-bulk-delete'),
+    path('cache-stats/', AdminCacheStatsView.as_view(), name='admin-cache-stats'),
 ]
\ No newline at end of file
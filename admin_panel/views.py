@@ -1,8 +1,13 @@
+from django.conf import settings
 from rest_framework import generics, permissions
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from storage import bulk, caching
 from storage.models import CustomUser, File
-from storage.serializers import AdminUserSerializer
+from storage.serializers import AdminUserSerializer, BulkFileIdsSerializer
+from storage.filters import FileFilter, FileOrderingFilter, UserFilter
+from storage.pagination import FileCursorPagination, UserCursorPagination
 from .serializers import AdminUserUpdateSerializer, AdminFileSerializer
-from django.db.models import Count, Sum
 
 
 class IsAdminUser(permissions.BasePermission):
@@ -10,20 +15,21 @@ class IsAdminUser(permissions.BasePermission):
         return request.user.is_authenticated and request.user.is_admin
 
 
-class AdminUserListView(generics.ListAPIView):
+class AdminUserListView(caching.CachedListMixin, generics.ListAPIView):
     """Получение списка пользователей с их файлами"""
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = AdminUserSerializer
+    pagination_class = UserCursorPagination
+    filter_backends = [UserFilter]
+    cache_kind = 'users'
 
     def get_queryset(self):
-        return CustomUser.objects.annotate(
-            file_count=Count('files'),
-            total_file_size=Sum('files__size')
-        )
+        # Количество и объём файлов хранятся в счётчиках пользователя, агрегировать File не нужно
+        return CustomUser.objects.all()
 
 
 class AdminUserUpdateView(generics.UpdateAPIView):
-    """Изменение статуса администратора"""
+    """Изменение статуса администратора и квоты"""
     queryset = CustomUser.objects.all()
     serializer_class = AdminUserUpdateSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -36,15 +42,22 @@ class AdminUserDeleteView(generics.DestroyAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
 
-class AdminFileListView(generics.ListAPIView):
+class AdminFileListView(caching.CachedListMixin, generics.ListAPIView):
     """Админ может видеть все файлы конкретного пользователя"""
     serializer_class = AdminFileSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = FileCursorPagination
+    filter_backends = [FileFilter, FileOrderingFilter]
+    cache_kind = 'files'
+
+    def cache_scope(self):
+        return self.kwargs.get('user_id')
 
     def get_queryset(self):
         """Фильтруем файлы по user_id из URL"""
         user_id = self.kwargs.get('user_id')
-        return File.objects.filter(user_id=user_id) if user_id else File.objects.none()
+        # select_related: имя владельца в сериализаторе без отдельного запроса на каждую строку
+        return File.objects.filter(user_id=user_id).select_related('user') if user_id else File.objects.none()
 
 
 class AdminFileDeleteView(generics.DestroyAPIView):
@@ -52,3 +65,25 @@ class AdminFileDeleteView(generics.DestroyAPIView):
     queryset = File.objects.all()
     serializer_class = AdminFileSerializer
     permission_classes = [permissions.IsAuthenticated]
+
+
+class AdminFileBulkDeleteView(APIView):
+    """Админ может удалить много файлов любых пользователей одним запросом: {"ids": [1, 2, 3]}"""
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        serializer = BulkFileIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        deleted = bulk.delete_files(File.objects.filter(pk__in=serializer.validated_data['ids']))
+        return Response({"message": "Файлы удалены", "deleted": deleted})
+
+
+class AdminCacheStatsView(APIView):
+    """Попадания и промахи кэша в процессе, который обработал запрос"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({
+            "backend": settings.CACHES['default']['BACKEND'],
+            "stats": caching.stats(),
+        })
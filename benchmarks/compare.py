@@ -0,0 +1,81 @@
+"""
+Сравнение двух прогонов benchmarks/scenarios.py: печатает изменения по
+сценариям и завершается с кодом 1, если новый прогон хуже базового больше
+чем на --threshold процентов по p95 или пропускной способности либо делает
+больше запросов к базе.
+
+    python benchmarks/compare.py benchmarks/results/baseline.json benchmarks/results/new.json --threshold 10
+"""
+import argparse
+import json
+
+
+# Метрика -> больше ли значит лучше
+METRICS = {
+    'requests_per_s': True,
+    'p50_ms': False,
+    'p95_ms': False,
+    'p99_ms': False,
+    'queries_mean': False,
+    'server_peak_rss_mb': False,
+}
+# По каким метрикам ухудшение считается регрессией (p50 и p99 шумнее и только показываются)
+CHECKED = ('requests_per_s', 'p95_ms')
+
+
+def change(old, new):
+    if old in (None, 0) or new is None:
+        return None
+    return (new - old) / old * 100
+
+
+def compare(baseline, current, threshold):
+    """Строки отчёта и список регрессий"""
+    lines = []
+    regressions = []
+    for scenario, new in current['scenarios'].items():
+        old = baseline['scenarios'].get(scenario)
+        if old is None:
+            lines.append(f"{scenario}: нет в базовом прогоне")
+            continue
+        lines.append(scenario)
+        for metric, higher_is_better in METRICS.items():
+            percent = change(old.get(metric), new.get(metric))
+            text = f"{percent:+.1f}%" if percent is not None else "-"
+            lines.append(f"  {metric:20} {old.get(metric)!s:>10} -> {new.get(metric)!s:>10}  {text}")
+            if percent is None:
+                continue
+            worse = -percent if higher_is_better else percent
+            if metric in CHECKED and worse > threshold:
+                regressions.append(f"{scenario}: {metric} {text}")
+        if (new.get('queries_max') or 0) > (old.get('queries_max') or 0):
+            regressions.append(f"{scenario}: запросов к базе {old.get('queries_max')} -> {new.get('queries_max')}")
+    return lines, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение результатов benchmarks/scenarios.py")
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=10, help="Допустимое ухудшение, в процентах")
+    args = parser.parse_args()
+
+    with open(args.baseline) as source:
+        baseline = json.load(source)
+    with open(args.current) as source:
+        current = json.load(source)
+
+    print(f"{baseline.get('label') or args.baseline} ({baseline.get('revision')}) -> "
+          f"{current.get('label') or args.current} ({current.get('revision')})")
+    lines, regressions = compare(baseline, current, args.threshold)
+    print('\n'.join(lines))
+    if regressions:
+        print("Регрессии:")
+        for regression in regressions:
+            print(f"  {regression}")
+        raise SystemExit(1)
+    print("Регрессий нет.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Нагрузочный тест: задержка коротких запросов к API (p50/p99).
+
+Несколько потоков без пауз шлют GET на URL, каждый запрос - в новом
+HTTP-соединении (как к синхронным воркерам gunicorn), и измеряется время
+ответа. Подходит, чтобы сравнить настройки сервера, например новое
+соединение с базой на каждый запрос и постоянные соединения или пул:
+
+    # До: новое соединение с PostgreSQL на каждый запрос
+    DATABASE_CONN_MAX_AGE=0 gunicorn config.wsgi:application -w 4 --bind 127.0.0.1:8000
+    python benchmarks/request_latency.py http://127.0.0.1:8000/api/files/ \\
+        --token <JWT> -n 2000 -c 8 --bust-cache --label conn_max_age=0
+
+    # После: постоянные соединения (или DATABASE_POOL=True)
+    DATABASE_CONN_MAX_AGE=60 gunicorn config.wsgi:application -w 4 --bind 127.0.0.1:8000
+    python benchmarks/request_latency.py http://127.0.0.1:8000/api/files/ \\
+        --token <JWT> -n 2000 -c 8 --bust-cache --label conn_max_age=60
+
+--bust-cache добавляет к URL уникальный параметр, чтобы ответ не брался
+из кэша списков и каждый запрос действительно обращался к базе.
+
+Результат печатается в JSON; с --output добавляется строкой в файл.
+"""
+import argparse
+import itertools
+import json
+import statistics
+import threading
+import time
+import urllib.request
+
+
+def fetch(url, token, timeout):
+    """Время ответа в секундах или None, если запрос не удался"""
+    request = urllib.request.Request(url)
+    if token:
+        request.add_header('Authorization', f'Bearer {token}')
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+    except OSError:
+        return None
+    return time.perf_counter() - started
+
+
+def run(args):
+    numbers = itertools.count()
+    lock = threading.Lock()
+    timings = []
+    failed = 0
+
+    def url_for(number):
+        if not args.bust_cache:
+            return args.url
+        return f"{args.url}{'&' if '?' in args.url else '?'}_={number}"
+
+    def worker():
+        nonlocal failed
+        while True:
+            with lock:
+                number = next(numbers)
+            if number >= args.warmup + args.requests:
+                return
+            elapsed = fetch(url_for(number), args.token, args.timeout)
+            if number < args.warmup:
+                continue
+            with lock:
+                if elapsed is None:
+                    failed += 1
+                else:
+                    timings.append(elapsed)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    timings.sort()
+
+    def percentile(p):
+        return round(timings[min(int(len(timings) * p), len(timings) - 1)] * 1000, 2) if timings else None
+
+    return {
+        'label': args.label,
+        'url': args.url,
+        'concurrency': args.concurrency,
+        'requests': len(timings),
+        'failed': failed,
+        'p50_ms': percentile(0.5),
+        'p90_ms': percentile(0.9),
+        'p99_ms': percentile(0.99),
+        'mean_ms': round(statistics.mean(timings) * 1000, 2) if timings else None,
+        'requests_per_s': round((len(timings) + failed) / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Задержка коротких запросов к API")
+    parser.add_argument('url')
+    parser.add_argument('--token', help="JWT access-токен")
+    parser.add_argument('-n', '--requests', type=int, default=1000, help="Сколько запросов измерить")
+    parser.add_argument('-c', '--concurrency', type=int, default=4)
+    parser.add_argument('--warmup', type=int, default=50, help="Сколько первых запросов не учитывать")
+    parser.add_argument('--timeout', type=float, default=10)
+    parser.add_argument('--bust-cache', action='store_true', help="Уникальный параметр в каждом запросе")
+    parser.add_argument('--label', default='')
+    parser.add_argument('--output', help="Файл, в который дописывается результат (JSON lines)")
+    args = parser.parse_args()
+
+    result = run(args)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, 'a') as output:
+            output.write(json.dumps(result, ensure_ascii=False) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+"""
+Набор нагрузочных сценариев API хранилища для сравнения версий между собой.
+
+Данные готовит команда seed_benchmark (N пользователей по M файлов и
+администратор), сценарии выполняются против запущенного локально сервера
+с базой PostgreSQL:
+
+    python manage.py seed_benchmark --users 10 --files 1000 --manifest benchmarks/dataset.json
+    gunicorn config.wsgi:application -w 4 --bind 127.0.0.1:8000 --pid /tmp/gunicorn.pid
+    python benchmarks/scenarios.py http://127.0.0.1:8000 --manifest benchmarks/dataset.json \\
+        --server-pid $(cat /tmp/gunicorn.pid) --label baseline --output benchmarks/results/baseline.json
+
+Сценарии: upload, bulk_upload, list, download, temp_download, admin_list
+(по умолчанию все; выбрать - --scenario list download). Запросы шлются из
+нескольких потоков от имени пользователей набора по кругу. Для каждого
+сценария считаются пропускная способность, p50/p95/p99 времени ответа,
+число запросов к базе (из заголовка Server-Timing, SERVER_TIMING=True) и
+пиковая память процессов сервера (VmHWM из /proc для --server-pid и его
+дочерних процессов, только Linux). Сценарии загрузки добавляют файлы в базу,
+поэтому сравнимы только прогоны на одинаково подготовленных наборах.
+
+Результаты двух прогонов сравнивает benchmarks/compare.py.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+
+SCENARIOS = ('upload', 'bulk_upload', 'list', 'download', 'temp_download', 'admin_list')
+# Число запросов к базе из заголовка Server-Timing: db;dur=1.2;desc="3 queries"
+QUERIES_PATTERN = re.compile(r'desc="(\d+) queries"')
+
+
+def call(base_url, path, token=None, data=None, content_type=None, timeout=30):
+    """(статус, тело, заголовки); статус None - сервер не ответил"""
+    request = urllib.request.Request(base_url + path, data=data)
+    if token:
+        request.add_header('Authorization', f'Bearer {token}')
+    if content_type:
+        request.add_header('Content-Type', content_type)
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, response.read(), response.headers
+    except urllib.error.HTTPError as error:
+        return error.code, error.read(), error.headers
+    except OSError:
+        return None, b'', {}
+
+
+def call_json(base_url, path, token=None, payload=None):
+    data = json.dumps(payload).encode() if payload is not None else None
+    status, body, _ = call(base_url, path, token, data, 'application/json' if data else None)
+    if status is None or status >= 400:
+        raise SystemExit(f"{path}: ответ {status}: {body[:200]!r}")
+    return json.loads(body)
+
+
+def multipart(files):
+    """Тело multipart/form-data из списка (поле, имя файла, байты) и его Content-Type"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for field, name, content in files:
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{name}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'.encode() + content + b'\r\n'
+        )
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def peak_rss(pid):
+    """Пиковая память процесса и его потомков в мегабайтах (VmHWM) или None"""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            status = Path(f'/proc/{current}/status').read_text()
+            children = Path(f'/proc/{current}/task/{current}/children').read_text().split()
+        except OSError:
+            continue
+        for line in status.splitlines():
+            if line.startswith('VmHWM:'):
+                total += int(line.split()[1])
+        pending.extend(int(child) for child in children)
+    return round(total / 1024, 1) if total else None
+
+
+class Fixture:
+    """Токены пользователей набора и id их файлов, полученные через API до замеров"""
+
+    def __init__(self, args):
+        with open(args.manifest) as source:
+            manifest = json.load(source)
+        users = manifest['users'][:args.users] if args.users else manifest['users']
+        self.tokens = [self.login(args.url, username, manifest['password']) for username in users]
+        self.admin_token = self.login(args.url, manifest['admin'], manifest['password'])
+        self.file_ids = []
+        self.links = []
+        for token in self.tokens:
+            page = call_json(args.url, '/api/files/', token)
+            ids = [item['id'] for item in page['results']]
+            self.file_ids.append(ids)
+            links = call_json(args.url, '/api/files/generate-tokens/', token, {'ids': ids})
+            self.links.append([link['token'] for link in links])
+
+    @staticmethod
+    def login(base_url, username, password):
+        return call_json(base_url, '/api/token/', payload={'username': username, 'password': password})['access']
+
+
+def build_request(scenario, number, fixture, args):
+    """(путь, токен, тело, Content-Type) запроса number сценария"""
+    user = number % len(fixture.tokens)
+    token = fixture.tokens[user]
+    bust = f'?_={number}' if args.bust_cache else ''
+    if scenario == 'upload':
+        # Уникальное начало содержимого: каждый запрос пишет новый файл, а не находит готовый блоб
+        body, content_type = multipart([('file', f'upload_{number}.bin', number.to_bytes(9, 'big') + args.payload)])
+        return '/api/files/', token, body, content_type
+    if scenario == 'bulk_upload':
+        body, content_type = multipart([
+            ('files', f'bulk_{number}_{i}.bin', number.to_bytes(8, 'big') + bytes([i]) + args.payload)
+            for i in range(args.bulk_files)
+        ])
+        return '/api/files/bulk-upload/', token, body, content_type
+    if scenario == 'list':
+        return f'/api/files/{bust}', token, None, None
+    if scenario == 'download':
+        ids = fixture.file_ids[user]
+        return f'/api/files/{ids[number // len(fixture.tokens) % len(ids)]}/download/', token, None, None
+    if scenario == 'temp_download':
+        links = fixture.links[user]
+        return f'/api/files/download-temp/{links[number // len(fixture.tokens) % len(links)]}/', None, None, None
+    if scenario == 'admin_list':
+        return f'/api/admin/users/{bust}', fixture.admin_token, None, None
+    raise ValueError(scenario)
+
+
+def run_scenario(scenario, fixture, args):
+    numbers = itertools.count()
+    lock = threading.Lock()
+    timings = []
+    queries = []
+    failed = 0
+
+    def worker():
+        nonlocal failed
+        while True:
+            with lock:
+                number = next(numbers)
+            if number >= args.warmup + args.requests:
+                return
+            path, token, body, content_type = build_request(scenario, number, fixture, args)
+            started = time.perf_counter()
+            status, _, headers = call(args.url, path, token, body, content_type, args.timeout)
+            elapsed = time.perf_counter() - started
+            if number < args.warmup:
+                continue
+            with lock:
+                if status is None or status >= 400:
+                    failed += 1
+                    continue
+                timings.append(elapsed)
+                match = QUERIES_PATTERN.search(headers.get('Server-Timing', ''))
+                if match:
+                    queries.append(int(match.group(1)))
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    timings.sort()
+
+    def percentile(p):
+        return round(timings[min(int(len(timings) * p), len(timings) - 1)] * 1000, 2) if timings else None
+
+    return {
+        'requests': len(timings),
+        'failed': failed,
+        'requests_per_s': round((len(timings) + failed) / elapsed, 1),
+        'p50_ms': percentile(0.5),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'mean_ms': round(statistics.mean(timings) * 1000, 2) if timings else None,
+        'queries_mean': round(statistics.mean(queries), 2) if queries else None,
+        'queries_max': max(queries) if queries else None,
+        'server_peak_rss_mb': peak_rss(args.server_pid) if args.server_pid else None,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=Path(__file__).resolve().parent).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочные сценарии API хранилища")
+    parser.add_argument('url', help="Адрес сервера, например http://127.0.0.1:8000")
+    parser.add_argument('--manifest', default='benchmarks/dataset.json', help="Описание набора из seed_benchmark")
+    parser.add_argument('--scenario', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--users', type=int, default=0, help="Сколько пользователей набора задействовать (0 - всех)")
+    parser.add_argument('-n', '--requests', type=int, default=500, help="Сколько запросов измерить в сценарии")
+    parser.add_argument('-c', '--concurrency', type=int, default=4)
+    parser.add_argument('--warmup', type=int, default=20, help="Сколько первых запросов не учитывать")
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--upload-size', type=int, default=64 * 1024, help="Размер загружаемого файла в байтах")
+    parser.add_argument('--bulk-files', type=int, default=10, help="Файлов в одном запросе bulk_upload")
+    parser.add_argument('--bust-cache', action='store_true', help="Уникальный параметр в запросах списков")
+    parser.add_argument('--server-pid', type=int, help="PID сервера (мастера gunicorn) для замера памяти")
+    parser.add_argument('--label', default='')
+    parser.add_argument('--output', help="Файл, в который записывается результат (JSON)")
+    args = parser.parse_args()
+    args.url = args.url.rstrip('/')
+    args.payload = os.urandom(max(args.upload_size - 9, 0))
+
+    fixture = Fixture(args)
+    result = {
+        'label': args.label,
+        'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'url': args.url,
+        'concurrency': args.concurrency,
+        'users': len(fixture.tokens),
+        'scenarios': {},
+    }
+    for scenario in args.scenario:
+        result['scenarios'][scenario] = run_scenario(scenario, fixture, args)
+        print(scenario, json.dumps(result['scenarios'][scenario], ensure_ascii=False))
+
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, 'w') as output:
+            json.dump(result, output, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Нагрузочный тест: сколько одновременных медленных скачиваний выдерживает сервер.
+
+Открывает N соединений к URL скачивания, каждое читает ответ с ограниченной
+скоростью (как мобильный клиент), и измеряет время до первого байта, долю
+соединений, получивших ответ, и суммарную пропускную способность. Запустите
+его против синхронного пути под WSGI и асинхронного под ASGI и сравните.
+
+Пример:
+    # WSGI: 4 синхронных воркера gunicorn
+    gunicorn config.wsgi:application -w 4 --bind 127.0.0.1:8000
+    python benchmarks/slow_clients.py http://127.0.0.1:8000/api/files/1/download/ \\
+        --token <JWT> -c 500 --rate 64 --label wsgi
+
+    # ASGI: те же 4 процесса, асинхронные представления
+    gunicorn config.asgi:application -w 4 -k uvicorn.workers.UvicornWorker --bind 127.0.0.1:8000
+    python benchmarks/slow_clients.py http://127.0.0.1:8000/api/async/files/1/download/ \\
+        --token <JWT> -c 500 --rate 64 --label asgi
+
+Результат печатается в JSON; с --output добавляется строкой в файл.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from urllib.parse import urlsplit
+
+
+async def slow_download(url, token, rate_kb, duration, timeout):
+    """Одно медленное скачивание: (время до первого байта или None, прочитано байт)"""
+    parts = urlsplit(url)
+    started = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(parts.hostname, parts.port or 80), timeout
+        )
+    except (OSError, asyncio.TimeoutError):
+        return None, 0
+
+    path = parts.path + (f'?{parts.query}' if parts.query else '')
+    headers = [f'GET {path} HTTP/1.1', f'Host: {parts.netloc}', 'Connection: close']
+    if token:
+        headers.append(f'Authorization: Bearer {token}')
+    writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode())
+
+    first_byte = None
+    received = 0
+    block = max(int(rate_kb * 1024 / 10), 1)
+    try:
+        await writer.drain()
+        data = await asyncio.wait_for(reader.read(block), timeout)
+        first_byte = time.perf_counter() - started
+        received += len(data)
+        # Дальше читаем не быстрее rate_kb КБ/с, пока не истечёт duration
+        deadline = started + duration
+        while data and time.perf_counter() < deadline:
+            await asyncio.sleep(0.1)
+            data = await asyncio.wait_for(reader.read(block), timeout)
+            received += len(data)
+    except (OSError, asyncio.TimeoutError):
+        pass
+    finally:
+        writer.close()
+    return first_byte, received
+
+
+async def run(args):
+    started = time.perf_counter()
+    results = await asyncio.gather(*[
+        slow_download(args.url, args.token, args.rate, args.duration, args.timeout)
+        for _ in range(args.concurrency)
+    ])
+    elapsed = time.perf_counter() - started
+
+    ttfb = sorted(r[0] for r in results if r[0] is not None)
+    received = sum(r[1] for r in results)
+
+    def percentile(p):
+        return round(ttfb[min(int(len(ttfb) * p), len(ttfb) - 1)], 4) if ttfb else None
+
+    return {
+        'label': args.label,
+        'url': args.url,
+        'concurrency': args.concurrency,
+        'rate_kb_per_client': args.rate,
+        'served': len(ttfb),
+        'failed': args.concurrency - len(ttfb),
+        'ttfb_p50': percentile(0.5),
+        'ttfb_p99': percentile(0.99),
+        'ttfb_mean': round(statistics.mean(ttfb), 4) if ttfb else None,
+        'throughput_kb_s': round(received / 1024 / elapsed, 1),
+        'elapsed_s': round(elapsed, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Одновременные медленные скачивания")
+    parser.add_argument('url')
+    parser.add_argument('--token', help="JWT access-токен")
+    parser.add_argument('-c', '--concurrency', type=int, default=200)
+    parser.add_argument('--rate', type=float, default=64, help="Скорость чтения одного клиента, КБ/с")
+    parser.add_argument('--duration', type=float, default=20, help="Сколько секунд читает каждый клиент")
+    parser.add_argument('--timeout', type=float, default=10, help="Сколько ждать первого байта")
+    parser.add_argument('--label', default='')
+    parser.add_argument('--output', help="Файл, в который дописывается результат (JSON lines)")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, 'a') as output:
+            output.write(json.dumps(result, ensure_ascii=False) + '\n')
+
+
+if __name__ == '__main__':
+    main()
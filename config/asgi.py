@@ -13,4 +13,10 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Импорт после get_asgi_application: ему нужны загруженные приложения
+from storage.asgi import UploadPrecheck  # noqa: E402
+
+# Загрузку телом запроса, которая не поместится в квоту, отклоняем до приёма тела
+application = UploadPrecheck(django_application)
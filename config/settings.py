@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 from pathlib import Path
 import os
 from dotenv import load_dotenv
+from corsheaders.defaults import default_headers
 
 
 # Загружаем переменные окружения из .env
@@ -43,6 +44,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'rest_framework',
     'corsheaders',
@@ -52,6 +54,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'storage.middleware.PerformanceMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -86,6 +89,16 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# Соединения с базой:
+#   DATABASE_CONN_MAX_AGE - сколько секунд соединение переиспользуется следующими
+#       запросами того же потока (0 - новое соединение на каждый запрос); перед
+#       переиспользованием проверяется, что соединение живо (DATABASE_CONN_HEALTH_CHECKS)
+#   DATABASE_POOL=True - пул соединений psycopg 3 (pip install "psycopg[binary,pool]")
+#       вместо постоянных соединений; подходит и для запуска под ASGI
+#   DATABASE_PGBOUNCER=True - база за pgbouncer в режиме пула транзакций: серверные
+#       курсоры (QuerySet.iterator) не переживают конец транзакции и отключаются
+DATABASE_POOL = os.getenv("DATABASE_POOL", "False") == "True"
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -93,8 +106,21 @@ DATABASES = {
         'USER': os.getenv("DATABASE_USER"),
         'PASSWORD': os.getenv("DATABASE_PASSWORD"),
         'HOST': os.getenv("DATABASE_HOST", "127.0.0.1"),
+        'PORT': os.getenv("DATABASE_PORT", ""),
+        # Пул сам держит соединения открытыми, с ним постоянные соединения Django запрещены
+        'CONN_MAX_AGE': 0 if DATABASE_POOL else int(os.getenv("DATABASE_CONN_MAX_AGE", "60")),
+        'CONN_HEALTH_CHECKS': os.getenv("DATABASE_CONN_HEALTH_CHECKS", "True") == "True",
+        'DISABLE_SERVER_SIDE_CURSORS': os.getenv("DATABASE_PGBOUNCER", "False") == "True",
+        'OPTIONS': {},
     }
 }
+if DATABASE_POOL:
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': int(os.getenv("DATABASE_POOL_MIN_SIZE", "2")),
+        'max_size': int(os.getenv("DATABASE_POOL_MAX_SIZE", "10")),
+        # Сколько секунд запрос ждёт свободного соединения, прежде чем завершиться ошибкой
+        'timeout': float(os.getenv("DATABASE_POOL_TIMEOUT", "10")),
+    }
 
 
 # Password validation
@@ -146,15 +172,146 @@ AUTH_USER_MODEL = 'storage.CustomUser'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'storage.authentication.CachedJWTAuthentication',
     ),
 }
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Где хранится содержимое файлов (storage/backends.py):
+#   local   - каталог MEDIA_ROOT (по умолчанию)
+#   sharded - несколько томов STORAGE_VOLUMES="/mnt/disk1:2,/mnt/disk2:1" (каталог:вес);
+#             файлы распределяются по томам пропорционально весам
+#   s3      - бакет S3-совместимого хранилища (pip install boto3); STORAGE_S3_ENDPOINT_URL -
+#             адрес для MinIO/Ceph, без него - AWS. Ключи берутся из STORAGE_S3_ACCESS_KEY/SECRET_KEY
+#             или из стандартных источников boto3 (переменные AWS_*, роль сервера)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+STORAGE_VOLUMES = os.getenv("STORAGE_VOLUMES", "")
+STORAGE_S3_BUCKET = os.getenv("STORAGE_S3_BUCKET", "")
+STORAGE_S3_PREFIX = os.getenv("STORAGE_S3_PREFIX", "")
+STORAGE_S3_ENDPOINT_URL = os.getenv("STORAGE_S3_ENDPOINT_URL", "")
+STORAGE_S3_REGION = os.getenv("STORAGE_S3_REGION", "")
+STORAGE_S3_ACCESS_KEY = os.getenv("STORAGE_S3_ACCESS_KEY", "")
+STORAGE_S3_SECRET_KEY = os.getenv("STORAGE_S3_SECRET_KEY", "")
+# Локальный каталог временных файлов загрузок для хранилища s3
+STORAGE_TEMP_ROOT = os.getenv("STORAGE_TEMP_ROOT", os.path.join(MEDIA_ROOT, 'blobs', 'tmp'))
+# Сжатие содержимого в хранилище (storage.compression): пусто - выключено, gzip или zstd (нужен пакет zstandard)
+STORAGE_COMPRESSION = os.getenv("STORAGE_COMPRESSION", "")
+
+# Возобновляемая загрузка по частям: временные файлы и время жизни сессии.
+# На том же томе, что и хранилище, готовый файл переносится переименованием, а не копированием
+UPLOAD_STAGING_ROOT = os.getenv("UPLOAD_STAGING_ROOT", os.path.join(MEDIA_ROOT, '.staging'))
+UPLOAD_SESSION_TTL_HOURS = int(os.getenv("UPLOAD_SESSION_TTL_HOURS", "24"))
+
+# Сколько файлов массовой загрузки записывается на диск одновременно
+BULK_UPLOAD_WORKERS = int(os.getenv("BULK_UPLOAD_WORKERS", "4"))
+# Сколько файлов можно передать в одном запросе (по умолчанию в Django - 100)
+DATA_UPLOAD_MAX_NUMBER_FILES = int(os.getenv("DATA_UPLOAD_MAX_NUMBER_FILES", "1000"))
+
+# Квота на объём файлов пользователя по умолчанию, в байтах (0 - без ограничения).
+# Индивидуальная квота задаётся в CustomUser.quota_bytes
+STORAGE_DEFAULT_QUOTA = int(os.getenv("STORAGE_DEFAULT_QUOTA", "0")) or None
+# Сколько живёт резерв места под загрузку одним запросом, если запрос оборвался
+QUOTA_RESERVATION_TTL_HOURS = int(os.getenv("QUOTA_RESERVATION_TTL_HOURS", "6"))
+
+# Фоновые задачи (python manage.py run_jobs)
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+# Задержка перед повтором удваивается с каждой попыткой, начиная с этой, но не больше максимума
+JOB_RETRY_DELAY_SECONDS = int(os.getenv("JOB_RETRY_DELAY_SECONDS", "10"))
+JOB_MAX_RETRY_DELAY_SECONDS = int(os.getenv("JOB_MAX_RETRY_DELAY_SECONDS", "3600"))
+# Сколько задача может выполняться, прежде чем её заберёт другой воркер
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "600"))
+# Сколько дней хранятся выполненные задачи
+JOB_RETENTION_DAYS = int(os.getenv("JOB_RETENTION_DAYS", "7"))
+
+# Сколько места (в мегабайтах) могут занимать миниатюры и превью; сверх этого
+# удаляются те, что дольше всего не запрашивались
+DERIVATIVE_STORE_BUDGET_MB = int(os.getenv("DERIVATIVE_STORE_BUDGET_MB", "1024"))
+
+# Кэш: по умолчанию в памяти каждого процесса; CACHE_URL=redis://127.0.0.1:6379/0 -
+# общий для всех процессов Redis или совместимый с ним сервер (Valkey, KeyDB, Dragonfly)
+CACHE_URL = os.getenv("CACHE_URL", "")
+if CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+# Профили пользователей (для проверки JWT) и списки файлов кэшируются, только если
+# кэш общий для всех процессов: кэш в памяти процесса не узнаёт об изменениях,
+# сделанных другими воркерами, и ещё METADATA_CACHE_SECONDS показывал бы старые
+# списки и пускал бы заблокированного или удалённого пользователя
+METADATA_CACHE = bool(CACHE_URL)
+# Сколько секунд хранятся профили пользователей и списки файлов в кэше; изменения
+# сбрасывают их сразу, срок ограничивает только память под устаревшие записи
+METADATA_CACHE_SECONDS = int(os.getenv("METADATA_CACHE_SECONDS", "300"))
+
+# Какие временные ссылки выдаёт generate-token:
+#   token  - строка FileToken в базе на каждую ссылку (по умолчанию)
+#   signed - подписанная SECRET_KEY ссылка без записи в базу, с возможной
+#            привязкой к IP-адресу и диапазону байтов
+TEMP_LINK_MODE = os.getenv("TEMP_LINK_MODE", "token")
+# Сколько секунд временная ссылка хранится в кэше, чтобы повторные скачивания
+# не обращались к базе (с кэшем в памяти процесса - и сколько она может
+# проработать в других процессах после удаления файла)
+FILE_TOKEN_CACHE_SECONDS = int(os.getenv("FILE_TOKEN_CACHE_SECONDS", "60"))
+
+# Кто отдаёт файлы при скачивании:
+#   django   - сам Django через FileResponse (по умолчанию)
+#   nginx    - nginx по заголовку X-Accel-Redirect из внутренней location FILE_DELIVERY_INTERNAL_URL
+#              (при STORAGE_BACKEND=sharded - FILE_DELIVERY_INTERNAL_URL<номер тома>/ на каждый том)
+#   sendfile - Apache/lighttpd по заголовку X-Sendfile с абсолютным путём к файлу
+# Файлы из S3 фронтовому серверу недоступны - их всегда отдаёт Django
+FILE_DELIVERY_BACKEND = os.getenv("FILE_DELIVERY_BACKEND", "django")
+FILE_DELIVERY_INTERNAL_URL = os.getenv("FILE_DELIVERY_INTERNAL_URL", "/protected-media/")
+
 CORS_ALLOWED_ORIGINS = [
     'http://localhost:5173',  # Адрес фронтенда
 ]
+CORS_ALLOW_HEADERS = (
+    *default_headers,
+    'upload-offset',  # Смещение части при загрузке по частям
+    'x-file-name',  # Имя файла при асинхронной загрузке телом запроса
+    'range',
+    'if-range',
+    'if-none-match',
+    'if-modified-since',
+)
+CORS_EXPOSE_HEADERS = ['Content-Disposition', 'Content-Range', 'Accept-Ranges', 'ETag', 'Last-Modified', 'Repr-Digest', 'Digest']
 #CORS_ALLOW_ALL_ORIGINS = True  # Разрешить запросы с любых источников (не рекомендуется для продакшена)
 
+# Замеры запросов (storage.middleware): запрос к базе дольше SLOW_QUERY_MS
+# миллисекунд и один и тот же запрос, повторённый N_PLUS_ONE_THRESHOLD и более
+# раз за HTTP-запрос, записываются в лог как предупреждения
+SLOW_QUERY_MS = int(os.getenv("SLOW_QUERY_MS", "200"))
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "10"))
+# Заголовок Server-Timing с временем ответа и запросов к базе
+SERVER_TIMING = os.getenv("SERVER_TIMING", "True") == "True"
+# Адреса, с которых доступен GET /metrics (через запятую); адрес клиента определяется с учётом TRUSTED_PROXIES
+METRICS_ALLOWED_IPS = os.getenv("METRICS_ALLOWED_IPS", "127.0.0.1,::1").split(",")
+# Адреса обратных прокси (через запятую), которым можно верить в X-Forwarded-For (storage.network).
+# По умолчанию - локальный nginx из deploy/nginx.conf; пусто - заголовок не читается
+TRUSTED_PROXIES = [ip for ip in os.getenv("TRUSTED_PROXIES", "127.0.0.1,::1").split(",") if ip]
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'default': {'format': '%(asctime)s %(levelname)s %(name)s: %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'default'},
+    },
+    'loggers': {
+        'storage': {'handlers': ['console'], 'level': os.getenv("LOG_LEVEL", "INFO")},
+    },
+}
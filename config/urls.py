@@ -18,11 +18,13 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from storage.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('storage.urls')),
     path('api/admin/', include('admin_panel.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
 
 urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
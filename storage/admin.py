@@ -3,7 +3,8 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.admin import TabularInline
 from django.db.models import Sum, Count
-from .models import CustomUser, File
+from . import bulk, jobs
+from .models import CustomUser, File, Job
 
 
 class FileInline(TabularInline):
@@ -27,9 +28,12 @@ class CustomUserAdmin(UserAdmin):
     # Разделение полей для редактирования
     fieldsets = (
         (None, {'fields': ('username', 'email', 'password', 'full_name')}),
+        ('Хранилище', {'fields': ('quota_bytes', 'file_count', 'total_bytes')}),
         ('Permissions', {'fields': ('is_staff', 'is_superuser', 'is_active', 'groups', 'user_permissions')}),
         ('Important dates', {'fields': ('last_login', 'date_joined')}),
     )
+    # Счётчики меняются только загрузкой и удалением файлов
+    readonly_fields = ('file_count', 'total_bytes')
     # Поля для создания пользователя
     add_fieldsets = (
         (None, {
@@ -38,14 +42,8 @@ class CustomUserAdmin(UserAdmin):
         }),
     )
 
-    def file_count(self, obj):
-        return File.objects.filter(user=obj).count()
-
-    file_count.short_description = 'Количество файлов'
-
     def file_size(self, obj):
-        size = File.objects.filter(user=obj).aggregate(Sum('size'))['size__sum'] or 0
-        return f"{size} байт"
+        return f"{obj.total_bytes} байт"
 
     file_size.short_description = 'Объём файлов'
 
@@ -66,17 +64,20 @@ class FileAdmin(admin.ModelAdmin):
     change_list_template = "admin/dashboard.html"
 
     def delete_selected(self, request, queryset):
-        count = queryset.count()
-        queryset.delete()
+        count = bulk.delete_files(queryset)
         self.message_user(request, f"Удалено {count} файлов.")
 
     delete_selected.short_description = "Удалить выбранные файлы"
 
     def changelist_view(self, request, extra_context=None):
         extra_context = extra_context or {}
-        total_files = File.objects.count()
-        total_size = File.objects.aggregate(Sum('size'))['size__sum'] or 0
-        total_users = CustomUser.objects.count()
+        # Статистика по счётчикам пользователей, а не по всей таблице File
+        stats = CustomUser.objects.aggregate(
+            total_files=Sum('file_count'), total_size=Sum('total_bytes'), total_users=Count('id')
+        )
+        total_files = stats['total_files'] or 0
+        total_size = stats['total_size'] or 0
+        total_users = stats['total_users']
 
         extra_context.update({
             'title': "Статистика хранилища",
@@ -85,3 +86,18 @@ class FileAdmin(admin.ModelAdmin):
             'total_users': total_users,
         })
         return super().changelist_view(request, extra_context=extra_context)
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'file', 'status', 'attempts', 'run_at', 'finished_at')
+    list_filter = ('status', 'kind')
+    readonly_fields = ('created_at', 'finished_at', 'locked_until', 'last_error')
+    raw_id_fields = ('file',)
+    actions = ['retry_selected']
+
+    def retry_selected(self, request, queryset):
+        count = jobs.retry(queryset)
+        self.message_user(request, f"Поставлено в очередь повторно: {count}.")
+
+    retry_selected.short_description = "Повторить выбранные задачи"
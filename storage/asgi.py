@@ -0,0 +1,81 @@
+"""
+Проверка загрузки телом запроса (async_views.upload_file) до приёма тела.
+
+ASGIHandler Django целиком принимает тело запроса во временный файл ещё до
+вызова middleware и представления, поэтому представление может отказать
+в загрузке, которая не помещается в квоту, только когда байты уже пришли.
+UploadPrecheck оборачивает ASGI-приложение (config/asgi.py) и по заголовкам
+Authorization и Content-Length отвечает 401, 411 или 413 сразу, не читая тело.
+Место при этом не резервируется: окончательно его занимает представление
+через quotas.reserve.
+"""
+from asgiref.sync import sync_to_async
+from django.urls import reverse
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken
+import json
+from . import quotas
+from .authentication import CachedJWTAuthentication
+
+
+def header(scope, name):
+    for key, value in scope.get('headers', []):
+        if key == name:
+            return value
+    return None
+
+
+def precheck(raw_authorization, content_length):
+    """Ответ (статус, тело) для загрузки, которую не нужно принимать, или None"""
+    if content_length is None or not content_length.isdigit():
+        return 411, {"error": "Не указан заголовок Content-Length."}
+    authentication = CachedJWTAuthentication()
+    raw_token = authentication.get_raw_token(raw_authorization) if raw_authorization else None
+    if raw_token is None:
+        return 401, {"detail": "Учетные данные не были предоставлены."}
+    try:
+        user = authentication.get_user(authentication.get_validated_token(raw_token))
+    except (InvalidToken, AuthenticationFailed):
+        return 401, {"detail": "Учетные данные не были предоставлены."}
+    try:
+        quotas.check(user, int(content_length))
+    except quotas.QuotaExceeded as exc:
+        return exc.status_code, {"error": exc.detail}
+    return None
+
+
+class UploadPrecheck:
+    """ASGI-обёртка: отклоняет загрузку телом запроса по заголовкам, пока тело не принято"""
+
+    def __init__(self, application):
+        self.application = application
+        self.upload_path = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['method'] == 'POST':
+            if self.upload_path is None:
+                self.upload_path = reverse('async-file-upload')
+            if scope['path'] == self.upload_path:
+                length = header(scope, b'content-length')
+                rejected = await sync_to_async(precheck)(
+                    header(scope, b'authorization'), length.decode('latin1') if length else None
+                )
+                if rejected is not None:
+                    await self.respond(send, *rejected)
+                    return
+        await self.application(scope, receive, send)
+
+    @staticmethod
+    async def respond(send, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode()),
+                # Непрочитанное тело не даёт продолжать соединение
+                (b'connection', b'close'),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': body})
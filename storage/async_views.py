@@ -0,0 +1,145 @@
+"""
+Асинхронные версии скачивания и загрузки файлов для работы под ASGI.
+
+Синхронные представления DRF занимают поток воркера на всё время передачи,
+поэтому медленный клиент держит целый поток. Здесь передача байтов идёт через
+асинхронные итераторы, а блокирующие операции (диск, ORM) выполняются в пуле
+потоков, так что один процесс обслуживает тысячи одновременных медленных
+соединений. Права проверяются так же, как в FileViewSet.
+"""
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.utils.timezone import now
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken
+from urllib.parse import unquote
+import asyncio
+from . import blobs, caching, quotas, tokens, uploads
+from .authentication import CachedJWTAuthentication
+from .downloads import file_download_response
+from .models import File
+from .serializers import FileSerializer
+
+
+# Блок, которым читаем тело запроса при загрузке
+UPLOAD_READ_SIZE = 64 * 1024
+
+
+async def authenticate(request):
+    """Пользователь из JWT в заголовке Authorization или None"""
+    try:
+        result = await sync_to_async(CachedJWTAuthentication().authenticate)(request)
+    except (InvalidToken, AuthenticationFailed):
+        return None
+    return result[0] if result else None
+
+
+def unauthorized():
+    return JsonResponse({"detail": "Учетные данные не были предоставлены."}, status=401)
+
+
+async def serve_file(request, file_instance, token_instance=None):
+    try:
+        response = await asyncio.to_thread(
+            file_download_response, request, file_instance.unique_name, file_instance.original_name, True,
+            file_instance.content_type, token_instance is None or tokens.offloadable(token_instance),
+            file_instance.digest, file_instance.size
+        )
+    except FileNotFoundError:
+        return JsonResponse({"error": "Файл не найден"}, status=404)
+
+    # Обновляем дату последнего скачивания, если файл действительно отдаётся
+    if response.status_code in (200, 206):
+        if token_instance is not None:
+            await sync_to_async(tokens.touch)(file_instance)
+        else:
+            await File.objects.filter(pk=file_instance.pk).aupdate(last_downloaded=now())
+            await sync_to_async(caching.invalidate_files)([file_instance.user_id])
+    return response
+
+
+@require_GET
+async def download_file(request, pk):
+    """Скачивание файла"""
+    user = await authenticate(request)
+    if user is None:
+        return unauthorized()
+
+    file_instance = await File.objects.filter(pk=pk, user=user).afirst()
+    if file_instance is None:
+        return JsonResponse({"detail": "Не найдено."}, status=404)
+    return await serve_file(request, file_instance)
+
+
+@require_GET
+async def download_temp(request, token):
+    """Скачивание файла по временной ссылке без авторизации"""
+    token_instance = await sync_to_async(tokens.resolve)(token)
+    if token_instance is None:
+        return JsonResponse({"error": "Токен недействителен или не существует."}, status=404)
+    if not token_instance.is_valid():
+        return JsonResponse({"error": "Срок действия ссылки истек."}, status=400)
+    if not tokens.apply_scope(token_instance, request):
+        return JsonResponse({"error": "Ссылка выдана для другого адреса."}, status=403)
+    return await serve_file(request, token_instance.file, token_instance)
+
+
+def body_chunks(request, length):
+    """Тело запроса частями, не больше length байт: под ASGI поток тела не ограничен Content-Length"""
+    while length > 0:
+        chunk = request.read(min(UPLOAD_READ_SIZE, length))
+        if not chunk:
+            return
+        length -= len(chunk)
+        yield chunk
+
+
+@csrf_exempt
+@require_POST
+async def upload_file(request):
+    """
+    Загрузка файла телом запроса.
+
+    Тело - сырые байты файла, имя передаётся в заголовке X-File-Name
+    (в кодировке URL), комментарий - в параметре запроса comment, заголовок
+    Content-Length обязателен. Под ASGI тело принимается без занятия потока,
+    но ASGIHandler Django спулит его целиком во временный файл ещё до вызова
+    представления; загрузку сверх квоты отклоняет по Content-Length до приёма
+    тела storage.asgi.UploadPrecheck. Копирование в хранилище выполняется
+    в пуле потоков.
+    """
+    user = await authenticate(request)
+    if user is None:
+        return unauthorized()
+
+    original_name = unquote(request.headers.get('X-File-Name', ''))
+    if not original_name:
+        return JsonResponse({"error": "Не указано имя файла (заголовок X-File-Name)."}, status=400)
+
+    length = request.META.get('CONTENT_LENGTH', '')
+    if not length.isdigit():
+        return JsonResponse({"error": "Не указан заголовок Content-Length."}, status=411)
+    length = int(length)
+
+    # Место в квоте резервируется по Content-Length до копирования в хранилище
+    try:
+        reservation = await sync_to_async(quotas.reserve)(user, length)
+    except quotas.QuotaExceeded as exc:
+        return JsonResponse({"error": exc.detail}, status=exc.status_code)
+
+    try:
+        temp_path, digest, size = await asyncio.to_thread(blobs.write_temp, body_chunks(request, length))
+        try:
+            file_instance = await sync_to_async(uploads.create_file)(
+                user, temp_path, digest, size, original_name, request.GET.get('comment', '')
+            )
+        finally:
+            await asyncio.to_thread(temp_path.unlink, missing_ok=True)
+    finally:
+        await sync_to_async(quotas.release)(reservation)
+
+    # Сериализатор читает задачи обработки файла из базы
+    data = await sync_to_async(lambda: FileSerializer(file_instance).data)()
+    return JsonResponse(data, status=201)
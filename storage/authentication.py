@@ -0,0 +1,33 @@
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+from . import caching
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication, которая берёт пользователя из кэша, а не из базы
+    на каждый запрос. Запись сбрасывается при сохранении пользователя
+    и изменении его счётчиков файлов (см. signals и usage); без общего
+    кэша (METADATA_CACHE) пользователь читается из базы каждый раз.
+    """
+
+    def get_user(self, validated_token):
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            return super().get_user(validated_token)
+        user_id = validated_token[api_settings.USER_ID_CLAIM]
+
+        def load():
+            return self.user_model.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).first()
+
+        user = caching.get_or_set('user', user_id, 'instance', load)
+        if user is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+        return user
@@ -0,0 +1,372 @@
+"""
+Хранилища содержимого файлов.
+
+Всё, что хранится (блобы и миниатюры), адресуется именем вида
+blobs/ab/cd/<sha256>, а где лежат байты с этим именем, решает хранилище
+из настройки STORAGE_BACKEND:
+
+    local   - каталог MEDIA_ROOT (по умолчанию);
+    sharded - несколько томов из STORAGE_VOLUMES. Том для имени выбирается
+              взвешенным рандеву-хэшированием: том с весом 2 получает вдвое
+              больше файлов, чем том с весом 1, а новый том забирает только
+              свою долю новых файлов. Имя ищется сначала на «своём» томе,
+              затем на остальных, поэтому файлы, записанные до изменения
+              списка томов, продолжают находиться;
+    s3      - бакет S3-совместимого хранилища (AWS S3, MinIO, Ceph RGW); нужен boto3.
+
+Файлы старой раскладки (user_<id>/..., до появления блобов) всегда лежат
+в MEDIA_ROOT: для sharded и s3 такие имена читаются оттуда (LegacyFallback),
+пока migrate_legacy_files не перенесёт их в блобы нового хранилища.
+
+Временные файлы загрузок пишутся на локальный диск (temp_dir) и забираются
+хранилищем методом save: на том же томе это переименование, иначе копирование.
+"""
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from pathlib import Path
+from typing import NamedTuple
+from urllib.parse import quote
+import functools
+import hashlib
+import io
+import math
+import os
+import shutil
+import tempfile
+
+
+# Буфер чтения из S3: столько байт запрашивается за раз при последовательном чтении
+S3_READ_BUFFER_SIZE = 1024 * 1024
+
+
+class Stat(NamedTuple):
+    st_size: int
+    st_mtime_ns: int
+
+    @property
+    def st_mtime(self):
+        return self.st_mtime_ns / 1e9
+
+
+class LocalStorage:
+    """Файлы в одном каталоге root"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def path(self, name):
+        """Путь к файлу на диске; None у хранилищ, файлы которых не лежат на этом сервере"""
+        return self.root / name
+
+    def internal_url(self, name):
+        """Путь во внутренней location nginx для X-Accel-Redirect или None, если отдать так нельзя"""
+        return settings.FILE_DELIVERY_INTERNAL_URL + quote(name)
+
+    def temp_dir(self):
+        """Временные файлы лежат на том же томе, что и файлы, чтобы save был переименованием"""
+        path = self.root / 'blobs' / 'tmp'
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def exists(self, name):
+        return self.path(name).exists()
+
+    def stat(self, name):
+        result = self.path(name).stat()
+        return Stat(result.st_size, result.st_mtime_ns)
+
+    def open(self, name):
+        return open(self.path(name), 'rb')
+
+    def save(self, name, temp_path):
+        """Забирает временный файл под имя name"""
+        path = self.path(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.replace(temp_path, path)
+        except OSError:
+            # Другой том: копируем рядом с местом назначения и переименовываем, чтобы
+            # читатели не увидели недописанный файл
+            fd, copy_name = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+            os.close(fd)
+            try:
+                shutil.copyfile(temp_path, copy_name)
+                os.replace(copy_name, path)
+            except BaseException:
+                os.unlink(copy_name)
+                raise
+            os.unlink(temp_path)
+
+    def delete(self, name):
+        self.path(name).unlink(missing_ok=True)
+
+
+class ShardedStorage:
+    """Файлы на нескольких томах: volumes - список пар (каталог, вес)"""
+
+    def __init__(self, volumes):
+        if not volumes:
+            raise ImproperlyConfigured("STORAGE_VOLUMES: не задано ни одного тома.")
+        self.volumes = [(LocalStorage(root), float(weight), index) for index, (root, weight) in enumerate(volumes)]
+
+    def candidates(self, name):
+        """
+        Тома в порядке предпочтения для имени. Оценка тома зависит только от
+        него самого и имени (-weight / ln(u), u - хэш в (0, 1)), поэтому
+        добавление или удаление тома не меняет порядок остальных.
+        """
+        def score(volume):
+            storage, weight, _ = volume
+            digest = hashlib.sha256(f'{storage.root}\0{name}'.encode()).digest()
+            u = (int.from_bytes(digest[:8], 'big') + 1) / (2 ** 64 + 2)
+            return -weight / math.log(u)
+
+        return sorted(self.volumes, key=score, reverse=True)
+
+    def locate(self, name):
+        """(том, его номер в STORAGE_VOLUMES), где лежит файл, или (None, None)"""
+        for storage, _, index in self.candidates(name):
+            if storage.exists(name):
+                return storage, index
+        return None, None
+
+    def path(self, name):
+        storage, _ = self.locate(name)
+        # Отсутствующий файл ищется там, куда он был бы записан
+        return (storage or self.candidates(name)[0][0]).path(name)
+
+    def internal_url(self, name):
+        # Каждому тому - своя внутренняя location: FILE_DELIVERY_INTERNAL_URL + номер тома
+        _, index = self.locate(name)
+        if index is None:
+            return None
+        return f'{settings.FILE_DELIVERY_INTERNAL_URL}{index}/{quote(name)}'
+
+    def temp_dir(self):
+        # Самый большой том получает больше всего файлов - с него чаще всего хватит переименования
+        return max(self.volumes, key=lambda volume: volume[1])[0].temp_dir()
+
+    def exists(self, name):
+        return self.locate(name)[0] is not None
+
+    def stat(self, name):
+        return self.existing(name).stat(name)
+
+    def open(self, name):
+        return self.existing(name).open(name)
+
+    def existing(self, name):
+        storage, _ = self.locate(name)
+        if storage is None:
+            raise FileNotFoundError(name)
+        return storage
+
+    def save(self, name, temp_path):
+        self.candidates(name)[0][0].save(name, temp_path)
+
+    def delete(self, name):
+        # Копии могли остаться на прежних томах после изменения их списка
+        for storage, _, _ in self.volumes:
+            storage.delete(name)
+
+
+class S3Reader(io.RawIOBase):
+    """
+    Объект в S3 как файл для чтения с seek: читает одним потоком с текущей
+    позиции до конца и переоткрывает поток с новой позиции после seek.
+    """
+
+    def __init__(self, client, bucket, key, size):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.size = size
+        self.position = 0
+        self.body = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset != self.position:
+            self.close_body()
+            self.position = max(offset, 0)
+        return self.position
+
+    def readinto(self, buffer):
+        if self.position >= self.size:
+            return 0
+        if self.body is None:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.key, Range=f'bytes={self.position}-')
+            self.body = response['Body']
+        data = self.body.read(len(buffer))
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def close_body(self):
+        if self.body is not None:
+            self.body.close()
+            self.body = None
+
+    def close(self):
+        self.close_body()
+        super().close()
+
+
+class S3Storage:
+    """Файлы в бакете S3-совместимого хранилища; ключ - prefix + имя"""
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None, access_key=None, secret_key=None,
+                 temp_root=None):
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError as exc:
+            raise ImproperlyConfigured("Для STORAGE_BACKEND=s3 нужен пакет boto3 (pip install boto3).") from exc
+        if not bucket:
+            raise ImproperlyConfigured("Для STORAGE_BACKEND=s3 задайте STORAGE_S3_BUCKET.")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.temp_root = Path(temp_root)
+        self.client_error = ClientError
+        # Клиент boto3 потокобезопасен: один на процесс
+        self.client = boto3.client(
+            's3', endpoint_url=endpoint_url or None, region_name=region or None,
+            aws_access_key_id=access_key or None, aws_secret_access_key=secret_key or None,
+        )
+
+    def key(self, name):
+        return self.prefix + name
+
+    def path(self, name):
+        return None
+
+    def internal_url(self, name):
+        return None
+
+    def temp_dir(self):
+        self.temp_root.mkdir(parents=True, exist_ok=True)
+        return self.temp_root
+
+    def head(self, name):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.key(name))
+        except self.client_error as exc:
+            if exc.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                raise FileNotFoundError(name) from exc
+            raise
+
+    def exists(self, name):
+        try:
+            self.head(name)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def stat(self, name):
+        head = self.head(name)
+        return Stat(head['ContentLength'], int(head['LastModified'].timestamp() * 1e9))
+
+    def open(self, name):
+        reader = S3Reader(self.client, self.bucket, self.key(name), self.stat(name).st_size)
+        return io.BufferedReader(reader, buffer_size=S3_READ_BUFFER_SIZE)
+
+    def save(self, name, temp_path):
+        # upload_file сам делит большие файлы на части (multipart upload)
+        self.client.upload_file(str(temp_path), self.bucket, self.key(name))
+        os.unlink(temp_path)
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(name))
+
+
+class LegacyFallback:
+    """
+    Хранилище storage, в котором имена вне blobs/ (файлы старой раскладки)
+    берутся из локального каталога legacy. Новые файлы туда не пишутся.
+    """
+
+    def __init__(self, storage, legacy):
+        self.storage = storage
+        self.legacy = legacy
+
+    def target(self, name):
+        return self.storage if name.startswith('blobs/') else self.legacy
+
+    def path(self, name):
+        return self.target(name).path(name)
+
+    def internal_url(self, name):
+        return self.target(name).internal_url(name)
+
+    def temp_dir(self):
+        return self.storage.temp_dir()
+
+    def exists(self, name):
+        return self.target(name).exists(name)
+
+    def stat(self, name):
+        return self.target(name).stat(name)
+
+    def open(self, name):
+        return self.target(name).open(name)
+
+    def save(self, name, temp_path):
+        self.target(name).save(name, temp_path)
+
+    def delete(self, name):
+        self.target(name).delete(name)
+
+
+def parse_volumes(value):
+    """STORAGE_VOLUMES: "/mnt/disk1:2,/mnt/disk2:1" - каталоги томов и их веса (по умолчанию 1)"""
+    volumes = []
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        root, _, weight = item.rpartition(':')
+        if not root or not weight.replace('.', '', 1).isdigit():
+            root, weight = item, '1'
+        volumes.append((root, float(weight)))
+    return volumes
+
+
+@functools.cache
+def get_storage():
+    """Хранилище из настроек; создаётся один раз на процесс"""
+    if settings.STORAGE_BACKEND == 'local':
+        return LocalStorage(settings.MEDIA_ROOT)
+    return LegacyFallback(configured_storage(), LocalStorage(settings.MEDIA_ROOT))
+
+
+def configured_storage():
+    if settings.STORAGE_BACKEND == 'sharded':
+        return ShardedStorage(parse_volumes(settings.STORAGE_VOLUMES))
+    if settings.STORAGE_BACKEND == 's3':
+        return S3Storage(
+            settings.STORAGE_S3_BUCKET,
+            prefix=settings.STORAGE_S3_PREFIX,
+            endpoint_url=settings.STORAGE_S3_ENDPOINT_URL,
+            region=settings.STORAGE_S3_REGION,
+            access_key=settings.STORAGE_S3_ACCESS_KEY,
+            secret_key=settings.STORAGE_S3_SECRET_KEY,
+            temp_root=settings.STORAGE_TEMP_ROOT,
+        )
+    raise ImproperlyConfigured(f"Неизвестное хранилище STORAGE_BACKEND={settings.STORAGE_BACKEND!r}.")
+
+
+@receiver(setting_changed)
+def reset_storage(setting, **kwargs):
+    if setting.startswith('STORAGE_') or setting == 'MEDIA_ROOT':
+        get_storage.cache_clear()
@@ -0,0 +1,277 @@
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils.timezone import timedelta
+from collections import Counter
+from pathlib import Path
+import hashlib
+import os
+import tempfile
+from . import caching, compression, jobs, tokens
+from .backends import get_storage
+from .models import Blob, File
+
+
+# Блок, которым перечитываем уже лежащий на диске файл для подсчёта хэша
+HASH_READ_SIZE = 1024 * 1024
+# Через сколько после сжатия удаляется несжатая копия (её ещё могут отдавать по старому имени)
+PLAIN_COPY_GRACE = timedelta(hours=1)
+
+
+def temp_dir():
+    """Временные файлы лежат там, откуда хранилищу быстрее всего их забрать (см. backends)"""
+    return get_storage().temp_dir()
+
+
+def write_temp(chunks):
+    """
+    Пишет поток частей во временный файл, считая SHA-256 по ходу записи.
+
+    Возвращает (путь, хэш, размер).
+    """
+    hasher = hashlib.sha256()
+    size = 0
+    fd, name = tempfile.mkstemp(dir=temp_dir(), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as destination:
+            for chunk in chunks:
+                hasher.update(chunk)
+                destination.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        os.unlink(name)
+        raise
+    return Path(name), hasher.hexdigest(), size
+
+
+def hash_file(path):
+    """SHA-256 и размер файла, уже записанного на диск"""
+    hasher = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as source:
+        while data := source.read(HASH_READ_SIZE):
+            hasher.update(data)
+            size += len(data)
+    return hasher.hexdigest(), size
+
+
+def verify(blob, throttle=None):
+    """
+    Перечитывает содержимое блоба из хранилища и сверяет его SHA-256 с digest.
+
+    throttle(n) вызывается после каждого прочитанного блока (ограничение
+    скорости чтения). Если содержимого нет, бросает FileNotFoundError.
+    """
+    hasher = hashlib.sha256()
+    try:
+        with compression.open_content(blob.name) as source:
+            while data := source.read(HASH_READ_SIZE):
+                hasher.update(data)
+                if throttle is not None:
+                    throttle(len(data))
+    except compression.CorruptContent:
+        return False
+    return hasher.hexdigest() == blob.digest
+
+
+def place(storage, blob, temp_path):
+    """
+    Кладёт в хранилище содержимое блоба из временного файла и возвращает
+    занимаемое им место. Содержимое сжатого блоба сжимается тем же способом;
+    тогда temp_path остаётся на месте.
+    """
+    if not blob.encoding:
+        storage.save(blob.name, temp_path)
+        return blob.size
+    with open(temp_path, 'rb') as source:
+        compressed_path, _, stored_size = compression.compress_file(source, blob.encoding)
+    try:
+        storage.save(blob.name, compressed_path)
+    finally:
+        compressed_path.unlink(missing_ok=True)
+    return stored_size
+
+
+def acquire(temp_path, digest, size):
+    """
+    Возвращает блоб для содержимого из temp_path, увеличивая число ссылок на него.
+
+    Если такие байты уже хранятся, временный файл просто удаляется, иначе
+    переносится на место блоба. Вызывается внутри transaction.atomic(), в той же
+    транзакции, что и создание File: строка блоба блокируется до её завершения,
+    поэтому одновременное удаление последней ссылки не заберёт файл из-под нас.
+
+    Возвращает (блоб, имена положенных в хранилище файлов): если транзакция
+    откатится, вызывающий код убирает их (discard_placed) до выхода из неё.
+    """
+    storage = get_storage()
+    while True:
+        blob = Blob.objects.select_for_update().filter(digest=digest).first()
+        if blob is not None:
+            placed = []
+            if not blob.corrupt and storage.exists(blob.name):
+                os.unlink(temp_path)
+            else:
+                # Содержимое пропало из хранилища или испорчено (scrub_blobs) - восстанавливаем из загруженных байт
+                blob.stored_size = place(storage, blob, temp_path)
+                placed.append(blob.name)
+                blob.corrupt = False
+            try:
+                blob.ref_count += 1
+                blob.save(update_fields=['ref_count', 'corrupt', 'stored_size'])
+            except BaseException:
+                discard_placed(placed)
+                raise
+            return blob, placed
+
+        blob = Blob(digest=digest, size=size, stored_size=size, ref_count=1)
+        try:
+            with transaction.atomic():
+                blob.save()
+        except IntegrityError:
+            # Такой же блоб только что создала параллельная загрузка
+            continue
+        storage.save(blob.name, temp_path)
+        return blob, [blob.name]
+
+
+def acquire_many(items):
+    """
+    acquire для нескольких файлов сразу: items - список (temp_path, digest, size).
+
+    Недостающие строки блобов создаются одним INSERT ... ON CONFLICT DO NOTHING,
+    все нужные блокируются одним запросом, счётчики ссылок обновляются одним
+    bulk_update. Возвращает ({digest: blob}, имена положенных в хранилище
+    файлов), чтобы при откате транзакции вызывающий код убрал их.
+    Временные файлы, не понадобившиеся хранилищу, остаются на месте.
+    """
+    counts = Counter(digest for _, digest, _ in items)
+    temps = {}
+    for temp_path, digest, size in items:
+        temps.setdefault(digest, (temp_path, size))
+
+    Blob.objects.bulk_create(
+        [Blob(digest=digest, size=size, stored_size=size, ref_count=0) for digest, (_, size) in temps.items()],
+        ignore_conflicts=True
+    )
+    locked = {
+        blob.digest: blob
+        for blob in Blob.objects.select_for_update().filter(digest__in=counts).order_by('digest')
+    }
+    storage = get_storage()
+    placed = []
+    try:
+        for digest, blob in locked.items():
+            # Новый блоб или содержимое пропало из хранилища либо испорчено - кладём загруженные байты
+            if blob.corrupt or not storage.exists(blob.name):
+                blob.stored_size = place(storage, blob, temps[digest][0])
+                placed.append(blob.name)
+                blob.corrupt = False
+            blob.ref_count += counts[digest]
+        Blob.objects.bulk_update(locked.values(), ['ref_count', 'corrupt', 'stored_size'])
+    except BaseException:
+        discard_placed(placed)
+        raise
+    return locked, placed
+
+
+def discard_placed(names):
+    """Убирает файлы, положенные acquire или acquire_many, если их транзакция откатывается"""
+    storage = get_storage()
+    for name in names:
+        storage.delete(name)
+
+
+def release(blob_id, count=1):
+    """Уменьшает число ссылок на блоб; последний освобождённый блоб удаляет фоновая задача"""
+    release_many({blob_id: count})
+
+
+def release_many(counts):
+    """
+    Уменьшает число ссылок сразу у нескольких блобов: {blob_id: сколько ссылок снять}.
+
+    Строки блокируются одним запросом в порядке id (без взаимных блокировок
+    с параллельными удалениями) и обновляются одним bulk_update.
+    """
+    with transaction.atomic():
+        locked = list(Blob.objects.select_for_update().filter(pk__in=counts).order_by('pk'))
+        for blob in locked:
+            blob.ref_count = max(blob.ref_count - counts[blob.pk], 0)
+        Blob.objects.bulk_update(locked, ['ref_count'])
+        jobs.enqueue_many('blob.collect', [{'blob_id': blob.pk} for blob in locked if blob.ref_count == 0])
+
+
+def collect(blob_id):
+    """Удаляет блоб без ссылок вместе с файлом на диске"""
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(pk=blob_id, ref_count=0).first()
+        if blob is None:
+            return
+        references = File.objects.filter(blob_id=blob_id).count()
+        if references:
+            # Счётчик разошёлся с реальностью - чиним его, а не удаляем используемые байты
+            blob.ref_count = references
+            blob.save(update_fields=['ref_count'])
+            return
+        storage = get_storage()
+        storage.delete(blob.name)
+        if blob.encoding:
+            # Несжатая копия могла ещё не дождаться удаления (см. compress)
+            storage.delete(blob.plain_name)
+        # Миниатюры лежат рядом с блобом; строки Derivative удалятся каскадом
+        for derivative in blob.derivatives.all():
+            storage.delete(derivative.name)
+        blob.delete()
+
+
+def compress(blob_id, grace=PLAIN_COPY_GRACE):
+    """
+    Сжимает содержимое блоба способом STORAGE_COMPRESSION, если это заметно
+    уменьшает его (compression.worth_compressing), и возвращает True.
+
+    Сжатие идёт вне транзакции; строка блокируется только на замену имени:
+    блоб получает имя с расширением кодека, его файлы - новый unique_name.
+    Несжатую копию удаляет фоновая задача через grace: запросы, успевшие
+    прочитать старое имя из базы или кэша, ещё могут её отдать.
+    """
+    encoding = settings.STORAGE_COMPRESSION
+    blob = Blob.objects.filter(pk=blob_id, encoding='', corrupt=False).first()
+    if not encoding or blob is None:
+        return False
+    try:
+        with get_storage().open(blob.name) as source:
+            if not compression.worth_compressing(source, blob.size, encoding):
+                return False
+            source.seek(0)
+            temp_path, digest, stored_size = compression.compress_file(source, encoding)
+    except FileNotFoundError:
+        # Пропавшее содержимое найдёт scrub_blobs
+        return False
+    try:
+        if digest != blob.digest:
+            # Испорченные байты не сжимаем: их восстановит повторная загрузка
+            Blob.objects.filter(pk=blob_id).update(corrupt=True)
+            return False
+        with transaction.atomic():
+            blob = Blob.objects.select_for_update().filter(pk=blob_id, encoding='', corrupt=False).first()
+            if blob is None:
+                return False
+            blob.encoding, blob.stored_size = encoding, stored_size
+            get_storage().save(blob.name, temp_path)
+            blob.save(update_fields=['encoding', 'stored_size'])
+            files = list(File.objects.filter(blob=blob).values_list('pk', 'user_id'))
+            File.objects.filter(blob=blob).update(unique_name=blob.name)
+            jobs.enqueue('blob.drop_plain', delay=grace, blob_id=blob.pk)
+            tokens.forget([file_id for file_id, _ in files])
+            caching.invalidate_files([user_id for _, user_id in files])
+        return True
+    finally:
+        temp_path.unlink(missing_ok=True)
+
+
+def drop_plain(blob_id):
+    """Удаляет несжатую копию сжатого блоба"""
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(pk=blob_id).first()
+        if blob is not None and blob.encoding:
+            get_storage().delete(blob.plain_name)
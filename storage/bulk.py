@@ -0,0 +1,54 @@
+"""
+Пакетные операции над файлами: удаление, переименование и комментарии
+для многих файлов за несколько запросов к базе вместо нескольких на файл.
+"""
+from django.db import transaction
+from django.db.models import Count, Sum
+from . import blobs, caching, tokens
+from .models import File
+from .signals import batch_accounting
+from .usage import add_usage
+
+
+def delete_files(queryset):
+    """
+    Удаляет файлы одной транзакцией и возвращает их число.
+
+    Ссылки на блобы и счётчики пользователей обновляются агрегатами, а не
+    по строке; содержимое, на которое больше никто не ссылается, удаляют
+    с диска фоновые задачи blob.collect.
+    """
+    with transaction.atomic():
+        # Строки блокируются, чтобы параллельное удаление тех же файлов
+        # не сняло ссылки на блобы второй раз
+        ids = list(queryset.order_by('pk').select_for_update().values_list('pk', flat=True))
+        queryset = File.objects.filter(pk__in=ids)
+        blob_counts = dict(
+            queryset.exclude(blob=None).values('blob_id').annotate(n=Count('id')).values_list('blob_id', 'n')
+        )
+        usage = list(queryset.values('user_id').annotate(n=Count('id'), total=Sum('size')))
+        tokens.forget(ids)
+        with batch_accounting():
+            deleted = queryset.delete()[1].get(File._meta.label, 0)
+        blobs.release_many(blob_counts)
+        for row in usage:
+            add_usage(row['user_id'], -row['n'], -row['total'])
+    return deleted
+
+
+def update_files(files, changes):
+    """
+    Применяет изменения {id: {'original_name': ..., 'comment': ...}} к файлам
+    одним bulk_update; меняются только переданные поля.
+    """
+    fields = set()
+    for file_instance in files:
+        for field, value in changes[file_instance.pk].items():
+            setattr(file_instance, field, value)
+            fields.add(field)
+    if fields:
+        File.objects.bulk_update(files, sorted(fields), batch_size=1000)
+    if 'original_name' in fields:
+        tokens.forget([file_instance.pk for file_instance in files])
+    caching.invalidate_files(file_instance.user_id for file_instance in files)
+    return files
@@ -0,0 +1,126 @@
+"""
+Кэш профилей пользователей, списков файлов и списка пользователей для админов.
+
+Записи лежат в пространствах имён ('user:5', 'files:5', 'users') с номером
+версии: запись ищется под текущей версией пространства, а изменение данных
+увеличивает версию (invalidate), и все старые записи разом перестают
+находиться, доживая до истечения срока. Версия увеличивается после коммита,
+поэтому запрос, прочитавший старые данные до коммита, сохранит их под старой
+версией, где их уже никто не найдёт.
+
+Версия увеличивается только в том кэше, который видит изменивший данные
+процесс, поэтому записи кэшируются лишь при общем кэше (CACHE_URL, настройка
+METADATA_CACHE); с кэшем в памяти процесса get_or_set всегда вычисляет
+значение заново. Счётчики попаданий и промахов ведутся в каждом процессе
+отдельно (stats).
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+import hashlib
+import threading
+import time
+from rest_framework.response import Response
+from .models import File
+
+
+# Маркер отсутствующей записи: None тоже бывает закэшированным значением
+MISSING = object()
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def count(kind, hit):
+    with _stats_lock:
+        counters = _stats.setdefault(kind, {'hits': 0, 'misses': 0})
+        counters['hits' if hit else 'misses'] += 1
+
+
+def stats():
+    """Попадания и промахи по видам записей в этом процессе"""
+    with _stats_lock:
+        return {kind: dict(counters) for kind, counters in _stats.items()}
+
+
+def version_key(namespace):
+    return f'version:{namespace}'
+
+
+def version(namespace):
+    """
+    Текущая версия пространства имён. Новая (или вытесненная из кэша) версия
+    начинается с текущего времени в наносекундах - больше любой прежней,
+    поэтому старые записи не всплывут и после вытеснения.
+    """
+    key = version_key(namespace)
+    value = cache.get(key)
+    if value is None:
+        cache.add(key, time.time_ns(), None)
+        value = cache.get(key, time.time_ns())
+    return value
+
+
+def entry_key(namespace, key):
+    # Ключи из адресов запросов бывают длинными и с любыми символами
+    return f'{namespace}:{hashlib.sha256(str(key).encode()).hexdigest()[:32]}'
+
+
+def get_or_set(kind, scope, key, compute):
+    """Значение из кэша или compute(), сохранённое под текущей версией пространства kind:scope"""
+    if not settings.METADATA_CACHE:
+        return compute()
+    namespace = f'{kind}:{scope}' if scope is not None else kind
+    current = version(namespace)
+    full_key = entry_key(namespace, key)
+    value = cache.get(full_key, MISSING, version=current)
+    count(kind, value is not MISSING)
+    if value is MISSING:
+        value = compute()
+        cache.set(full_key, value, settings.METADATA_CACHE_SECONDS, version=current)
+    return value
+
+
+def invalidate(*namespaces):
+    """Устаревает все записи пространств имён после коммита текущей транзакции"""
+    def bump():
+        for namespace in namespaces:
+            try:
+                cache.incr(version_key(namespace))
+            except ValueError:
+                # Версии нет - новая будет старше всех записей
+                pass
+    transaction.on_commit(bump)
+
+
+def invalidate_user(user_id):
+    """Профиль пользователя, его файлы и список пользователей (счётчики файлов)"""
+    invalidate(f'user:{user_id}', f'files:{user_id}', 'users')
+
+
+def invalidate_files(user_ids):
+    invalidate(*(f'files:{user_id}' for user_id in set(user_ids)))
+
+
+def invalidate_files_of(file_ids):
+    """Списки файлов владельцев файлов file_ids, когда известны только id файлов"""
+    invalidate_files(File.objects.filter(pk__in=file_ids).values_list('user_id', flat=True).distinct())
+
+
+class CachedListMixin:
+    """
+    Кэширует ответ list() представления под версией пространства имён
+    cache_kind:cache_scope(); ключ - класс представления и полный адрес запроса
+    (в ответе бывают абсолютные ссылки, а адрес включает фильтры и курсор).
+    """
+    cache_kind = None
+
+    def cache_scope(self):
+        return None
+
+    def list(self, request, *args, **kwargs):
+        def build():
+            return super(CachedListMixin, self).list(request, *args, **kwargs).data
+
+        key = f'{type(self).__name__}:{request.build_absolute_uri()}'
+        return Response(get_or_set(self.cache_kind, self.cache_scope(), key, build))
@@ -0,0 +1,225 @@
+"""
+Прозрачное сжатие содержимого в хранилище.
+
+Если задан STORAGE_COMPRESSION (gzip или zstd), фоновая обработка
+загруженного файла (blobs.compress) решает, стоит ли сжимать его блоб:
+уже сжатые форматы узнаются по первым байтам, остальные пробно сжимаются
+по первым TRIAL_SIZE байт. Сжатое содержимое лежит под именем блоба
+с расширением кодека (blobs/ab/cd/<sha256>.zst, см. Blob.name), поэтому
+как читать файл, понятно по одному File.unique_name.
+
+Размер файла, квоты и счётчики пользователя считаются по исходным байтам
+(Blob.size, File.size), место в хранилище - Blob.stored_size. При
+скачивании содержимое распаковывается на лету, а клиенту, который
+принимает тот же Content-Encoding, отдаётся сжатым как есть.
+
+zstd быстрее и сжимает лучше, но нужен пакет zstandard; gzip есть всегда.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from pathlib import Path
+import gzip
+import hashlib
+import io
+import os
+import tempfile
+import zlib
+from .backends import get_storage
+from .models import Blob
+
+
+# Файлы меньше этого размера не сжимаются: выигрыш меньше блока файловой системы
+MIN_SIZE = 4096
+# Столько первых байт сжимается пробно
+TRIAL_SIZE = 256 * 1024
+# Файл сжимается, только если пробный кусок ужался хотя бы до этой доли
+MAX_RATIO = 0.8
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+# Блок чтения при сжатии и распаковке
+BLOCK_SIZE = 1024 * 1024
+# Начала уже сжатых форматов (изображения, аудио, видео, архивы): повторное сжатие только тратит процессор.
+# ZIP сюда не входит: docx, xlsx и т. п. часто ещё заметно сжимаются, это покажет проба
+COMPRESSED_SIGNATURES = (
+    b'\x89PNG\r\n\x1a\n', b'\xff\xd8\xff', b'GIF87a', b'GIF89a', b'\x1f\x8b', b'\x28\xb5\x2f\xfd', b'BZh',
+    b'\xfd7zXZ\x00', b'7z\xbc\xaf\x27\x1c', b'Rar!\x1a\x07', b'ID3', b'OggS', b'fLaC', b'\x1aE\xdf\xa3',
+)
+
+
+class CorruptContent(Exception):
+    """Сжатое содержимое не распаковывается"""
+
+
+def zstandard():
+    try:
+        import zstandard
+    except ImportError as exc:
+        raise ImproperlyConfigured("Для сжатия zstd нужен пакет zstandard (pip install zstandard).") from exc
+    return zstandard
+
+
+def compressor(encoding):
+    """Потоковый компрессор с методами compress и flush"""
+    if encoding == 'gzip':
+        return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if encoding == 'zstd':
+        return zstandard().ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    raise ImproperlyConfigured(f"Неизвестный способ сжатия STORAGE_COMPRESSION={encoding!r}.")
+
+
+def encoding_of(name):
+    """Способ сжатия содержимого по имени в хранилище; пустая строка - хранится как есть"""
+    if name.startswith('blobs/'):
+        for encoding, suffix in Blob.SUFFIXES.items():
+            if name.endswith(suffix):
+                return encoding
+    return ''
+
+
+def is_compressed_format(head):
+    return head.startswith(COMPRESSED_SIGNATURES) or head[4:8] == b'ftyp' or (
+        head[:4] == b'RIFF' and head[8:12] == b'WEBP'
+    )
+
+
+def worth_compressing(source, size, encoding):
+    """Стоит ли сжимать содержимое: source читается с начала, не больше TRIAL_SIZE байт"""
+    if size < MIN_SIZE:
+        return False
+    sample = source.read(TRIAL_SIZE)
+    if is_compressed_format(sample):
+        return False
+    trial = compressor(encoding)
+    packed = len(trial.compress(sample)) + len(trial.flush())
+    return packed <= len(sample) * MAX_RATIO
+
+
+def compress_file(source, encoding):
+    """
+    Сжимает поток source во временный файл, считая SHA-256 исходных байт.
+
+    Возвращает (путь, хэш, размер сжатого файла).
+    """
+    codec = compressor(encoding)
+    hasher = hashlib.sha256()
+    stored = 0
+    fd, name = tempfile.mkstemp(dir=get_storage().temp_dir(), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as target:
+            while data := source.read(BLOCK_SIZE):
+                hasher.update(data)
+                packed = codec.compress(data)
+                target.write(packed)
+                stored += len(packed)
+            packed = codec.flush()
+            target.write(packed)
+            stored += len(packed)
+    except BaseException:
+        os.unlink(name)
+        raise
+    return Path(name), hasher.hexdigest(), stored
+
+
+class DecodedReader(io.RawIOBase):
+    """
+    Распакованное содержимое сжатого файла из хранилища как файл для чтения.
+    seek вперёд пропускает распакованные байты, назад - распаковывает заново с начала.
+    """
+
+    def __init__(self, name, encoding):
+        self.storage_name = name
+        self.encoding = encoding
+        self.errors = (zstandard().ZstdError,) if encoding == 'zstd' else (EOFError, zlib.error, gzip.BadGzipFile)
+        self.source = self.stream = None
+        self.position = 0
+        self.open_stream()
+
+    def open_stream(self):
+        self.close_stream()
+        # Отсутствующий файл - FileNotFoundError уже при открытии, как у хранилища
+        self.source = get_storage().open(self.storage_name)
+        if self.encoding == 'zstd':
+            # stream_reader отдаёт не больше запрошенного: файл из одних нулей не раздует память
+            self.stream = zstandard().ZstdDecompressor().stream_reader(self.source, read_size=BLOCK_SIZE)
+        else:
+            self.stream = gzip.GzipFile(fileobj=self.source, mode='rb')
+        self.position = 0
+
+    def close_stream(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.source.close()
+            self.source = self.stream = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def readinto(self, buffer):
+        try:
+            data = self.stream.read(len(buffer))
+        except self.errors as exc:
+            raise CorruptContent(self.storage_name) from exc
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def skip(self, count):
+        """Пропускает до count распакованных байт (None - до конца)"""
+        while count is None or count > 0:
+            size = BLOCK_SIZE if count is None else min(BLOCK_SIZE, count)
+            read = self.readinto(bytearray(size))
+            if not read:
+                return
+            if count is not None:
+                count -= read
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            # Размер распакованного содержимого узнаётся только распаковкой до конца
+            self.skip(None)
+            offset += self.position
+        offset = max(offset, 0)
+        if offset < self.position:
+            self.open_stream()
+        self.skip(offset - self.position)
+        return self.position
+
+    def close(self):
+        self.close_stream()
+        super().close()
+
+
+def open_content(name):
+    """Содержимое name из хранилища для чтения; сжатое распаковывается по ходу чтения"""
+    encoding = encoding_of(name)
+    if not encoding:
+        return get_storage().open(name)
+    return io.BufferedReader(DecodedReader(name, encoding), buffer_size=BLOCK_SIZE)
+
+
+def accepts(request, encoding):
+    """Примет ли клиент ответ с Content-Encoding: encoding (по Accept-Encoding, с учётом q=0)"""
+    qualities = {}
+    for item in request.headers.get('Accept-Encoding', '').split(','):
+        coding, _, params = item.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key.lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.strip().lower()] = quality
+    aliases = {'gzip': ('gzip', 'x-gzip')}.get(encoding, (encoding,))
+    for alias in aliases:
+        if alias in qualities:
+            return qualities[alias] > 0
+    return qualities.get('*', 0) > 0
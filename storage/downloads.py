@@ -0,0 +1,309 @@
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.crypto import get_random_string
+from django.utils.http import http_date, parse_http_date_safe
+from urllib.parse import quote
+import asyncio
+import base64
+import mimetypes
+from . import compression
+from .backends import get_storage
+
+
+# Размер блока при отдаче диапазонов файла
+RANGE_BLOCK_SIZE = 64 * 1024
+# Ограничение числа диапазонов в одном запросе, чтобы нельзя было
+# заставить сервер читать один и тот же файл тысячи раз
+MAX_RANGES = 50
+
+
+def file_etag(stat):
+    """ETag по размеру и времени изменения файла: меняется при любой перезаписи"""
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def digest_etag(digest):
+    """Сильный ETag по SHA-256 содержимого: одинаков для одинаковых байт на любом томе и сервере"""
+    return f'"{digest}"'
+
+
+def set_digest_headers(response, digest):
+    """
+    Контрольная сумма всего файла для проверки скачанного клиентом:
+    Repr-Digest (RFC 9530) и устаревший Digest (RFC 3230), который ещё читают многие клиенты.
+    """
+    value = base64.b64encode(bytes.fromhex(digest)).decode()
+    response['Repr-Digest'] = f'sha-256=:{value}:'
+    response['Digest'] = f'SHA-256={value}'
+
+
+def parse_range_header(header, size):
+    """
+    Разбирает заголовок Range вида 'bytes=0-99,200-,-50'.
+
+    Возвращает None, если заголовок отсутствует или некорректен (отдаём файл
+    целиком), пустой список, если ни один диапазон не попадает в файл (416),
+    иначе отсортированный список пар (start, end) с включительным end,
+    в котором пересекающиеся и соседние диапазоны объединены.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not spec:
+        return None
+    if size == 0:
+        # В пустом файле нет ни одного байта: любой диапазон невыполним
+        return []
+
+    ranges = []
+    parts = spec.split(',')
+    if len(parts) > MAX_RANGES:
+        return None
+    for part in parts:
+        first, sep, last = part.strip().partition('-')
+        if not sep:
+            return None
+        if not first:
+            # Суффиксный диапазон: последние N байт
+            if not last.isdigit():
+                return None
+            length = int(last)
+            if length == 0:
+                continue
+            ranges.append((max(size - length, 0), size - 1))
+            continue
+        if not first.isdigit() or (last and not last.isdigit()):
+            return None
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        if start >= size:
+            continue
+        end = int(last) if last else size - 1
+        ranges.append((start, min(end, size - 1)))
+
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def if_range_matches(request, etag, last_modified):
+    """Проверяет If-Range: диапазон применяется, только если файл не изменился"""
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def open_source(name, raw):
+    """Файл name из хранилища: распакованный или, при raw=True, сжатый как есть"""
+    return get_storage().open(name) if raw else compression.open_content(name)
+
+
+def iter_segments(name, segments, raw=False):
+    """
+    Тело ответа из сегментов: готовых байтов (заголовки частей multipart)
+    и пар (start, end) - диапазонов файла name из хранилища, читаемых блоками.
+    Диапазоны сжатого файла относятся к распакованному содержимому.
+    """
+    with open_source(name, raw) as file:
+        for segment in segments:
+            if isinstance(segment, bytes):
+                yield segment
+                continue
+            start, end = segment
+            file.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                data = file.read(min(RANGE_BLOCK_SIZE, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield data
+
+
+async def aiter_segments(name, segments, raw=False):
+    """
+    То же, что iter_segments, но для ASGI: чтение из хранилища выполняется в пуле
+    потоков, и цикл событий не блокируется, пока клиент медленно забирает данные.
+    """
+    file = await asyncio.to_thread(open_source, name, raw)
+    try:
+        for segment in segments:
+            if isinstance(segment, bytes):
+                yield segment
+                continue
+            start, end = segment
+            await asyncio.to_thread(file.seek, start)
+            remaining = end - start + 1
+            while remaining > 0:
+                data = await asyncio.to_thread(file.read, min(RANGE_BLOCK_SIZE, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield data
+    finally:
+        await asyncio.to_thread(file.close)
+
+
+def multipart_segments(ranges, size, content_type, boundary):
+    """Сегменты тела multipart/byteranges"""
+    segments = []
+    for start, end in ranges:
+        segments.append((
+            f'--{boundary}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+        ).encode())
+        segments.append((start, end))
+        segments.append(b'\r\n')
+    segments.append(f'--{boundary}--\r\n'.encode())
+    return segments
+
+
+def segments_length(segments):
+    return sum(len(s) if isinstance(s, bytes) else s[1] - s[0] + 1 for s in segments)
+
+
+def offload_target(name):
+    """Значение заголовка для фронтового сервера или None, если хранилище не даёт ему доступа к файлу"""
+    storage = get_storage()
+    if settings.FILE_DELIVERY_BACKEND == 'nginx':
+        return storage.internal_url(name)
+    path = storage.path(name)
+    # mod_xsendfile и lighttpd раскодируют путь, а заголовок должен оставаться ASCII
+    return quote(str(path)) if path is not None else None
+
+
+def offloaded_response(target, filename, content_type=None, digest=None):
+    """
+    Пустой ответ, по заголовку которого файл отдаёт фронтовой сервер.
+
+    nginx (X-Accel-Redirect) получает путь во внутренней location, Apache или
+    lighttpd (X-Sendfile) - абсолютный путь на диске. Диапазоны и условные
+    запросы в этом случае обрабатывает сам фронтовой сервер.
+    """
+    content_type = content_type or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    response = HttpResponse(content_type=content_type)
+    if settings.FILE_DELIVERY_BACKEND == 'nginx':
+        response['X-Accel-Redirect'] = target
+    else:
+        response['X-Sendfile'] = target
+    response['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(filename)}"
+    response['Cache-Control'] = 'private, no-cache'
+    if digest:
+        set_digest_headers(response, digest)
+    return response
+
+
+def file_download_response(request, name, filename, asynchronous=False, content_type=None, offload=True,
+                           digest=None, size=None):
+    """
+    Ответ со скачиваемым файлом name из хранилища.
+
+    Если FILE_DELIVERY_BACKEND указывает на фронтовой сервер, сам файл
+    не читается: воркер отвечает заголовком и сразу освобождается. Файлы
+    из хранилищ, к которым у фронтового сервера нет доступа (S3), отдаёт Django.
+
+    Поддерживает условные запросы (If-None-Match, If-Modified-Since и др.),
+    отвечая 304 без тела, и запросы диапазонов (Range, If-Range): один диапазон
+    отдаётся как 206 с Content-Range, несколько - как multipart/byteranges.
+
+    asynchronous=True - тело ответа отдаётся асинхронным итератором (для
+    асинхронных представлений под ASGI): синхронный итератор Django под ASGI
+    сначала целиком вычитал бы файл в память.
+
+    content_type - тип, определённый по содержимому; без него тип
+    угадывается по расширению имени файла.
+
+    offload=False - файл отдаёт Django, даже если настроен фронтовой сервер:
+    тот обработал бы Range из исходного запроса клиента, а не из request.META.
+
+    digest - SHA-256 содержимого (File.digest): по нему строится ETag, а ответы
+    получают заголовки Repr-Digest и Digest. Без него (файлы старой раскладки)
+    ETag строится по размеру и времени изменения файла.
+
+    Сжатый в хранилище файл (см. compression) отдаёт Django: распаковывает
+    на лету или, если клиент принимает тот же Content-Encoding и не просит
+    диапазон, отдаёт сжатые байты как есть. size - исходный размер файла
+    (File.size), без него размер распакованного содержимого не известен.
+
+    Если файла нет, бросает FileNotFoundError; при отдаче фронтовым сервером
+    отсутствующий файл обнаружит он сам и ответит 404.
+    """
+    encoding = compression.encoding_of(name)
+    # Сжатый файл фронтовой сервер отдал бы как есть, без Content-Encoding
+    if offload and not encoding and settings.FILE_DELIVERY_BACKEND in ('nginx', 'sendfile'):
+        target = offload_target(name)
+        if target is not None:
+            return offloaded_response(target, filename, content_type, digest)
+
+    storage = get_storage()
+    stat = storage.stat(name)
+    if not encoding:
+        size = stat.st_size
+    # Сжатые байты уходят клиенту без распаковки, если он их примет
+    raw = bool(encoding) and not request.headers.get('Range') and compression.accepts(request, encoding)
+    etag = digest_etag(digest) if digest else file_etag(stat)
+    if raw:
+        # У сжатого представления свой ETag, чтобы кэши не путали его с распакованным
+        etag = f'{etag[:-1]}-{encoding}"'
+    last_modified = int(stat.st_mtime)
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        content_type = content_type or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        ranges = None
+        if if_range_matches(request, etag, last_modified):
+            ranges = parse_range_header(request.headers.get('Range'), size)
+
+        if ranges is None and not asynchronous and (raw or not encoding):
+            response = FileResponse(storage.open(name), as_attachment=True, content_type=content_type)
+        elif ranges == []:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+        else:
+            status = 206
+            if ranges is None:
+                length = stat.st_size if raw else size
+                status, segments = 200, [(0, length - 1)] if length else []
+            elif len(ranges) == 1:
+                segments = ranges
+            else:
+                boundary = get_random_string(32)
+                segments = multipart_segments(ranges, size, content_type, boundary)
+                content_type = f'multipart/byteranges; boundary={boundary}'
+
+            iterator = aiter_segments if asynchronous else iter_segments
+            response = StreamingHttpResponse(
+                iterator(name, segments, raw), status=status, content_type=content_type
+            )
+            response['Content-Length'] = segments_length(segments)
+            if status == 206 and len(ranges) == 1:
+                start, end = ranges[0]
+                response['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+        if response.status_code != 416:
+            # Кодируем имя файла для корректного отображения в браузере
+            response['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(filename)}"
+        if raw:
+            response['Content-Encoding'] = encoding
+
+    if encoding:
+        patch_vary_headers(response, ['Accept-Encoding'])
+    if digest and not raw and response.status_code != 416:
+        # Сумма описывает весь файл, в том числе в ответах 206 и 304; у сжатого представления она была бы другой
+        set_digest_headers(response, digest)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Accept-Ranges'] = 'bytes'
+    response['Cache-Control'] = 'private, no-cache'
+    return response
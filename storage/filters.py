@@ -0,0 +1,76 @@
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.timezone import is_naive, make_aware
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend, OrderingFilter
+from datetime import datetime, time
+
+
+def parse_moment(value, param, end_of_day=False):
+    """Дата или дата-время из параметра запроса"""
+    try:
+        # Сначала дата: parse_datetime приняла бы и её, но как начало дня, и uploaded_before
+        # не включал бы сам этот день
+        day = parse_date(value)
+        moment = parse_datetime(value) if day is None else None
+    except ValueError:
+        # Формат верный, но такой даты нет (2024-13-01)
+        day = moment = None
+    if day is not None:
+        moment = datetime.combine(day, time.max if end_of_day else time.min)
+    if moment is None:
+        raise ValidationError({param: "Ожидается дата в формате ГГГГ-ММ-ДД или ISO 8601."})
+    return make_aware(moment) if is_naive(moment) else moment
+
+
+def parse_size(value, param):
+    if not value.isdigit():
+        raise ValidationError({param: "Ожидается размер в байтах."})
+    return int(value)
+
+
+class FileFilter(BaseFilterBackend):
+    """
+    Фильтры списка файлов:
+        name            - начало имени файла (без учёта регистра)
+        size_min        - минимальный размер в байтах
+        size_max        - максимальный размер в байтах
+        uploaded_after  - загружен не раньше даты
+        uploaded_before - загружен не позже даты
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+        if params.get('name'):
+            queryset = queryset.filter(original_name__istartswith=params['name'])
+        if params.get('size_min'):
+            queryset = queryset.filter(size__gte=parse_size(params['size_min'], 'size_min'))
+        if params.get('size_max'):
+            queryset = queryset.filter(size__lte=parse_size(params['size_max'], 'size_max'))
+        if params.get('uploaded_after'):
+            queryset = queryset.filter(uploaded_at__gte=parse_moment(params['uploaded_after'], 'uploaded_after'))
+        if params.get('uploaded_before'):
+            queryset = queryset.filter(
+                uploaded_at__lte=parse_moment(params['uploaded_before'], 'uploaded_before', end_of_day=True)
+            )
+        return queryset
+
+
+class UserFilter(BaseFilterBackend):
+    """Фильтр списка пользователей: username - начало логина"""
+
+    def filter_queryset(self, request, queryset, view):
+        if request.query_params.get('username'):
+            queryset = queryset.filter(username__istartswith=request.query_params['username'])
+        return queryset
+
+
+class FileOrderingFilter(OrderingFilter):
+    """Сортировка файлов параметром ordering: uploaded_at, size, original_name (с '-' - по убыванию)"""
+    ordering_fields = ['uploaded_at', 'size', 'original_name']
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if ordering:
+            # id делает порядок однозначным при одинаковых размерах и именах
+            ordering = [*ordering, '-id' if ordering[0].startswith('-') else 'id']
+        return ordering
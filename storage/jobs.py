@@ -0,0 +1,125 @@
+"""
+Очередь фоновых задач в той же базе PostgreSQL.
+
+Задача ставится в очередь в транзакции, которая её порождает (например,
+вместе с созданием File), поэтому не теряется и не выполняется раньше,
+чем данные станут видны. Воркеры (python manage.py run_jobs) забирают задачи
+через SELECT ... FOR UPDATE SKIP LOCKED: несколько воркеров не мешают друг
+другу и не получают одну задачу дважды. Упавшая задача повторяется
+с экспоненциально растущей задержкой, после JOB_MAX_ATTEMPTS попыток
+остаётся в статусе failed.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.utils.timezone import now, timedelta
+import traceback
+from . import caching
+from .models import Job
+
+
+# Обработчики по типу задачи: функция получает объект Job
+HANDLERS = {}
+
+
+def handler(kind):
+    """Регистрирует функцию как обработчик задач типа kind"""
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind, file=None, delay=None, **payload):
+    """Ставит задачу в очередь в текущей транзакции"""
+    if file is not None:
+        # Задачи файла видны в списке файлов (processing_status)
+        caching.invalidate_files([file.user_id])
+    return Job.objects.create(
+        kind=kind,
+        file=file,
+        payload=payload,
+        max_attempts=settings.JOB_MAX_ATTEMPTS,
+        run_at=now() + (delay or timedelta())
+    )
+
+
+def enqueue_many(kind, payloads=(), files=()):
+    """Ставит в очередь одним запросом задачи одного типа: по одной на каждый payload и на каждый файл"""
+    caching.invalidate_files(file.user_id for file in files)
+    return Job.objects.bulk_create(
+        [Job(kind=kind, payload=payload, max_attempts=settings.JOB_MAX_ATTEMPTS) for payload in payloads]
+        + [Job(kind=kind, file=file, max_attempts=settings.JOB_MAX_ATTEMPTS) for file in files]
+    )
+
+
+def claim():
+    """Занимает одну готовую к выполнению задачу или возвращает None"""
+    with transaction.atomic():
+        job = (
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status=Job.PENDING, run_at__lte=now())
+            .order_by('run_at')
+            .first()
+        )
+        if job is None:
+            return None
+        job.status = Job.RUNNING
+        job.attempts += 1
+        job.locked_until = now() + timedelta(seconds=settings.JOB_LEASE_SECONDS)
+        job.save(update_fields=['status', 'attempts', 'locked_until'])
+    return job
+
+
+def retry_delay(attempts):
+    """Задержка перед следующей попыткой: удваивается с каждой неудачной"""
+    seconds = settings.JOB_RETRY_DELAY_SECONDS * 2 ** (attempts - 1)
+    return timedelta(seconds=min(seconds, settings.JOB_MAX_RETRY_DELAY_SECONDS))
+
+
+def finish(job, **fields):
+    # Файл задачи могли удалить, пока она выполнялась, - вместе с ним удалилась и она
+    Job.objects.filter(pk=job.pk).update(locked_until=None, **fields)
+    if job.file_id:
+        caching.invalidate_files_of([job.file_id])
+    for name, value in fields.items():
+        setattr(job, name, value)
+
+
+def run(job):
+    """Выполняет занятую задачу; True - успешно"""
+    func = HANDLERS.get(job.kind)
+    try:
+        if func is None:
+            raise LookupError(f"Неизвестный тип задачи: {job.kind}")
+        func(job)
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            finish(job, status=Job.FAILED, last_error=error, finished_at=now())
+        else:
+            finish(job, status=Job.PENDING, last_error=error, run_at=now() + retry_delay(job.attempts))
+        return False
+    finish(job, status=Job.DONE, finished_at=now())
+    return True
+
+
+def requeue_stale():
+    """Возвращает в очередь задачи, воркер которых упал, не успев их завершить"""
+    stale = Job.objects.filter(status=Job.RUNNING, locked_until__lte=now())
+    caching.invalidate_files_of(stale.exclude(file=None).values('file_id'))
+    return stale.update(status=Job.PENDING, locked_until=None, run_at=now())
+
+
+def retry(queryset):
+    """Повторно ставит в очередь задачи (например, завершившиеся ошибкой)"""
+    queryset = queryset.exclude(status=Job.RUNNING)
+    caching.invalidate_files_of(queryset.exclude(file=None).values('file_id'))
+    return queryset.update(
+        status=Job.PENDING, attempts=0, run_at=now(), finished_at=None
+    )
+
+
+def purge_finished():
+    """Удаляет выполненные задачи старше JOB_RETENTION_DAYS"""
+    border = now() - timedelta(days=settings.JOB_RETENTION_DAYS)
+    return Job.objects.filter(status=Job.DONE, finished_at__lt=border).delete()[0]
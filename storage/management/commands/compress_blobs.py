@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import timedelta
+import time
+from storage import blobs
+from storage.models import Blob
+
+
+class Command(BaseCommand):
+    help = (
+        "Сжимает содержимое уже загруженных файлов способом STORAGE_COMPRESSION (новые файлы "
+        "сжимает фоновая обработка после загрузки). Сжимаются только блобы, которые заметно "
+        "уменьшаются; работает на запущенном сервисе порциями, прерванное сжатие продолжается "
+        "повторным запуском."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help="Сколько блобов выбирается за раз")
+        parser.add_argument('--pause', type=float, default=0,
+                            help="Пауза между порциями в секундах, чтобы не занимать диск целиком")
+        parser.add_argument('--grace-minutes', type=int, default=60,
+                            help="Через сколько минут удаляется несжатая копия (её ещё могут скачивать по старому имени)")
+        parser.add_argument('--limit', type=int, default=0, help="Проверить не больше стольких блобов (0 - все)")
+
+    def handle(self, *args, **options):
+        if not settings.STORAGE_COMPRESSION:
+            raise CommandError("Сжатие выключено: задайте STORAGE_COMPRESSION (gzip или zstd).")
+
+        grace = timedelta(minutes=options['grace_minutes'])
+        pending = Blob.objects.filter(encoding='', corrupt=False).order_by('pk')
+        checked = compressed = saved = 0
+        last_pk = 0
+        while not options['limit'] or checked < options['limit']:
+            batch = list(pending.filter(pk__gt=last_pk).values_list('pk', flat=True)[:options['batch_size']])
+            if not batch:
+                break
+            for pk in batch:
+                if options['limit'] and checked >= options['limit']:
+                    break
+                last_pk = pk
+                checked += 1
+                if blobs.compress(pk, grace):
+                    compressed += 1
+                    sizes = Blob.objects.filter(pk=pk).values_list('size', 'stored_size').first()
+                    saved += sizes[0] - sizes[1] if sizes else 0
+            self.stdout.write(f"Проверено: {checked}, сжато: {compressed}, последний id: {last_pk}")
+            if options['pause']:
+                time.sleep(options['pause'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Сжато блобов: {compressed} из {checked}, освобождено {saved / 1024 / 1024:.1f} МБ"
+        ))
@@ -0,0 +1,185 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils.timezone import now, timedelta
+from rest_framework.test import APIRequestFactory, force_authenticate
+from admin_panel.views import AdminFileListView, AdminUserListView
+from storage import jobs
+from storage.models import CustomUser, File, FileToken, Job, UploadSession
+from storage.pagination import FileCursorPagination
+from storage.views import FileViewSet, get_current_user
+import re
+
+
+# Таблицы, для которых последовательное сканирование допустимо в любом запросе:
+# пользователей и незавершённых загрузок на порядки меньше, чем файлов
+SMALL_TABLES = {'CustomUser', 'UploadSession'}
+# Числа и строки в SQL - чтобы узнавать один и тот же запрос с разными параметрами
+LITERALS = re.compile(r"'[^']*'|\b\d+\b")
+
+
+class Command(BaseCommand):
+    help = (
+        "Создаёт синтетический набор данных, выполняет горячие запросы представлений "
+        "storage/views.py и admin_panel/views.py и печатает их планы (EXPLAIN ANALYZE), "
+        "отмечая последовательные сканирования. Данные откатываются после проверки."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20, help="Количество пользователей")
+        parser.add_argument('--files', type=int, default=5000, help="Файлов на пользователя")
+        parser.add_argument('--fail-on-seqscan', action='store_true',
+                            help="Завершиться с ошибкой, если найдено последовательное сканирование или N+1")
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['files'] < 1:
+            raise CommandError("Нужны хотя бы один пользователь и один файл.")
+        with transaction.atomic(), override_settings(ALLOWED_HOSTS=['*']):
+            user, files, token = self.generate(options['users'], options['files'])
+            problems = []
+            for name, sqls in self.capture(user, files, token):
+                # Одинаковые по форме запросы (N+1) показываем один раз
+                shapes = {}
+                for sql in sqls:
+                    shapes.setdefault(LITERALS.sub('?', sql), []).append(sql)
+                for same in shapes.values():
+                    problems += self.explain(name, same[0])
+                    if len(same) > 1:
+                        problems.append((name, f"запрос повторяется {len(same)} раз (N+1)"))
+            # Синтетические данные не должны остаться в базе
+            transaction.set_rollback(True)
+
+        if problems:
+            self.stdout.write(self.style.WARNING("Найденные проблемы:"))
+            for name, table in problems:
+                self.stdout.write(f"  {name}: {table}")
+            if options['fail_on_seqscan']:
+                raise CommandError("Найдены последовательные сканирования больших таблиц или N+1.")
+        else:
+            self.stdout.write(self.style.SUCCESS("Все горячие запросы используют индексы."))
+
+    def generate(self, user_count, files_per_user):
+        """Пользователи с файлами, токенами и задачами обработки; просрочен каждый двадцатый токен, как между запусками очистки"""
+        self.stdout.write(f"Генерация: {user_count} пользователей по {files_per_user} файлов...")
+        stamp = now()
+        users = CustomUser.objects.bulk_create(
+            CustomUser(username=f"explain_{stamp.timestamp()}_{i}", email=f"explain{i}@example.com")
+            for i in range(user_count)
+        )
+        for user in users:
+            File.objects.bulk_create(
+                (File(
+                    user=user,
+                    original_name=f"report_{i}.pdf" if i % 3 else f"photo_{i}.jpg",
+                    unique_name=f"user_{user.id}/explain_{i}",
+                    size=(i * 7919) % 10_000_000,
+                ) for i in range(files_per_user)),
+                batch_size=5000
+            )
+        # Токен на каждый десятый файл
+        FileToken.objects.bulk_create(
+            (FileToken(file_id=file_id, user_id=user_id, expires_at=stamp + timedelta(minutes=10 if i % 20 else -10))
+             for i, (file_id, user_id) in enumerate(
+                 File.objects.filter(user__in=users).values_list('id', 'user_id')[::10]
+            )),
+            batch_size=5000
+        )
+        # Выполненные задачи обработки на каждый второй файл, ожидающие - на последние загрузки
+        file_ids = list(File.objects.filter(user__in=users).values_list('id', flat=True))
+        Job.objects.bulk_create(
+            (Job(kind='file.process', file_id=file_id, status=Job.DONE, finished_at=stamp)
+             for file_id in file_ids[::2]),
+            batch_size=5000
+        )
+        Job.objects.bulk_create(Job(kind='file.process', file_id=file_id) for file_id in file_ids[-100:])
+        user = users[0]
+        files = list(File.objects.filter(user=user).order_by('id')[:FileCursorPagination.page_size + 1])
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                for model in (CustomUser, File, FileToken, Job, UploadSession):
+                    cursor.execute(f'ANALYZE "{model._meta.db_table}"')
+        return user, files, FileToken.objects.filter(user=user, expires_at__gt=stamp).first()
+
+    def capture(self, user, files, token):
+        """Выполняет представления и возвращает SQL, который они выполнили"""
+        factory = APIRequestFactory()
+        file_list = FileViewSet.as_view({'get': 'list'})
+        # Страница меньше числа файлов, чтобы следующая была и на маленьком наборе данных
+        page_size = max(1, min(FileCursorPagination.page_size, len(files) - 1))
+
+        def call(view, path, **kwargs):
+            request = factory.get(path)
+            force_authenticate(request, user=user)
+            with CaptureQueriesContext(connection) as queries:
+                response = view(request, **kwargs)
+                if hasattr(response, 'render'):
+                    response.render()
+            return response, [q['sql'] for q in queries.captured_queries]
+
+        response, sqls = call(file_list, f'/api/files/?page_size={page_size}')
+        yield 'files: список', sqls
+        next_page = response.data.get('next')
+        if next_page:
+            yield 'files: следующая страница', call(file_list, next_page)[1]
+        yield 'files: фильтр по имени', call(file_list, '/api/files/?name=photo_1')[1]
+        yield 'files: фильтр по размеру', call(file_list, '/api/files/?size_min=100&size_max=5000')[1]
+        yield 'files: сортировка по размеру', call(file_list, '/api/files/?ordering=-size')[1]
+        yield 'files: сортировка по имени', call(file_list, '/api/files/?ordering=original_name')[1]
+        yield 'files: карточка файла', call(
+            FileViewSet.as_view({'get': 'retrieve'}), f'/api/files/{files[0].pk}/', pk=files[0].pk
+        )[1]
+        if token is not None:
+            yield 'files: временная ссылка', call(
+                FileViewSet.as_view({'get': 'download_temp'}), '/', token=str(token.token)
+            )[1]
+        yield 'auth: текущий пользователь', call(get_current_user, '/api/auth/me/')[1]
+        yield 'admin: пользователи', call(AdminUserListView.as_view(), '/api/admin/users/')[1]
+        yield 'admin: файлы пользователя', call(
+            AdminFileListView.as_view(), f'/api/admin/users/{user.pk}/files/', user_id=user.pk
+        )[1]
+
+        # Запросы фоновых очисток
+        with CaptureQueriesContext(connection) as queries:
+            list(FileToken.objects.filter(expires_at__lte=now()).values_list('id', flat=True)[:1000])
+            list(UploadSession.objects.filter(expires_at__lte=now()))
+        yield 'очистка: просроченные токены и сессии', [q['sql'] for q in queries.captured_queries]
+
+        # Запросы воркера фоновых задач
+        with CaptureQueriesContext(connection) as queries:
+            jobs.claim()
+            jobs.requeue_stale()
+            jobs.purge_finished()
+        yield 'воркер: выборка задачи', [q['sql'] for q in queries.captured_queries]
+
+    def explain(self, name, sql):
+        """Печатает план запроса и возвращает найденные последовательные сканирования"""
+        if not sql.lstrip().upper().startswith('SELECT'):
+            return []
+        analyze = connection.vendor == 'postgresql'
+        prefix = connection.ops.explain_query_prefix(analyze=analyze) if analyze else 'EXPLAIN QUERY PLAN'
+        with connection.cursor() as cursor:
+            cursor.execute(f"{prefix} {sql}")
+            plan = [' '.join(str(column) for column in row) for row in cursor.fetchall()]
+
+        self.stdout.write(self.style.MIGRATE_HEADING(name))
+        self.stdout.write(f"  {sql}")
+        for line in plan:
+            self.stdout.write(f"    {line}")
+
+        problems = []
+        for line in plan:
+            for table in self.scanned_tables(line):
+                if table not in SMALL_TABLES:
+                    problems.append((name, table))
+        return problems
+
+    def scanned_tables(self, line):
+        """Таблицы, которые строка плана читает целиком"""
+        if connection.vendor == 'postgresql':
+            marker = 'Seq Scan on '
+        else:
+            marker = 'SCAN '
+        if marker not in line:
+            return []
+        table = line.split(marker, 1)[1].split()[0].strip('"')
+        return [table]
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from django.utils.timezone import timedelta
+import time
+from storage.models import File
+from storage.uploads import adopt_legacy_file
+
+
+class Command(BaseCommand):
+    help = (
+        "Переносит файлы из старой раскладки (каталог user_<id> на пользователя) в хранилище "
+        "блобов с двухуровневыми каталогами по хэшу (blobs/ab/cd/<sha256>) и переписывает "
+        "File.unique_name. Работает на запущенном сервисе порциями; прерванный перенос "
+        "продолжается повторным запуском: выбираются только ещё не перенесённые файлы."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help="Сколько файлов выбирается за раз")
+        parser.add_argument('--pause', type=float, default=0,
+                            help="Пауза между порциями в секундах, чтобы не занимать диск целиком")
+        parser.add_argument('--grace-minutes', type=int, default=60,
+                            help="Через сколько минут удаляется старый файл (его ещё могут скачивать по старому пути)")
+        parser.add_argument('--limit', type=int, default=0, help="Перенести не больше стольких файлов (0 - все)")
+        parser.add_argument('--dry-run', action='store_true', help="Только посчитать файлы старой раскладки")
+
+    def handle(self, *args, **options):
+        legacy = File.objects.filter(blob=None).order_by('pk')
+        if options['dry_run']:
+            self.stdout.write(f"Файлов в старой раскладке: {legacy.count()}")
+            return
+
+        grace = timedelta(minutes=options['grace_minutes'])
+        moved = missing = 0
+        last_pk = 0
+        while not options['limit'] or moved < options['limit']:
+            batch = list(legacy.filter(pk__gt=last_pk).values_list('pk', 'unique_name')[:options['batch_size']])
+            if not batch:
+                break
+            for pk, name in batch:
+                last_pk = pk
+                if options['limit'] and moved >= options['limit']:
+                    break
+                try:
+                    moved += adopt_legacy_file(pk, name, grace)
+                except FileNotFoundError:
+                    missing += 1
+                    self.stderr.write(f"Файл {pk}: нет содержимого {name}")
+            self.stdout.write(f"Перенесено: {moved}, последний id: {last_pk}")
+            if options['pause']:
+                time.sleep(options['pause'])
+
+        style = self.style.WARNING if missing else self.style.SUCCESS
+        self.stdout.write(style(f"Перенесено файлов: {moved}, без содержимого: {missing}"))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from storage import tokens
+
+
+class Command(BaseCommand):
+    help = (
+        "Удаляет просроченные временные ссылки (FileToken) порциями. "
+        "Воркер фоновых задач (run_jobs) делает это сам; команда - для запуска по расписанию без воркера."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=tokens.PURGE_BATCH_SIZE,
+                            help="Сколько токенов удалять одним запросом")
+
+    def handle(self, *args, **options):
+        count = tokens.purge_expired(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Удалено просроченных токенов: {count}"))
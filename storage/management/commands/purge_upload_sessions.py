@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+from storage.models import UploadSession
+from storage.uploads import discard_session
+
+
+class Command(BaseCommand):
+    help = "Удаляет просроченные сессии загрузки по частям вместе с временными файлами"
+
+    def handle(self, *args, **options):
+        count = 0
+        for session in UploadSession.objects.filter(expires_at__lte=now()).iterator():
+            discard_session(session)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"Удалено сессий загрузки: {count}"))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from storage.models import CustomUser
+from storage.usage import actual_usage, reconcile_user
+
+
+class Command(BaseCommand):
+    help = "Сверяет счётчики file_count/total_bytes пользователей с таблицей File и исправляет расхождения"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Только показать расхождения")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        fixed = 0
+        users = CustomUser.objects.order_by('pk').values_list('pk', 'username', 'file_count', 'total_bytes')
+        last_pk = 0
+        while True:
+            batch = list(users.filter(pk__gt=last_pk)[:options['batch_size']])
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+            actual = actual_usage([row[0] for row in batch])
+            for pk, username, file_count, total_bytes in batch:
+                if actual.get(pk, (0, 0)) == (file_count, total_bytes):
+                    continue
+                if options['dry_run']:
+                    self.stdout.write(f"{username}: {(file_count, total_bytes)} -> {actual.get(pk, (0, 0))}")
+                    fixed += 1
+                    continue
+                # Перепроверяем под блокировкой: за это время могли загрузить или удалить файл
+                change = reconcile_user(pk)
+                if change:
+                    self.stdout.write(f"{username}: {change[0]} -> {change[1]}")
+                    fixed += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Расхождений: {fixed}"))
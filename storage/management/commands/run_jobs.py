@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+import signal
+import time
+from storage import jobs, tokens
+
+
+# Как часто (в секундах) возвращать в очередь задачи упавших воркеров, удалять старые выполненные
+# задачи и просроченные временные ссылки
+MAINTENANCE_INTERVAL = 60
+
+
+class Command(BaseCommand):
+    help = (
+        "Воркер фоновых задач: забирает задачи из таблицы Job (SELECT ... FOR UPDATE SKIP LOCKED) "
+        "и выполняет их. Можно запускать несколько воркеров одновременно."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Выполнить все готовые задачи и завершиться")
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help="Пауза (в секундах), когда очередь пуста")
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        done = failed = 0
+        last_maintenance = 0
+        while not self.stopping:
+            if time.monotonic() - last_maintenance > MAINTENANCE_INTERVAL:
+                jobs.requeue_stale()
+                jobs.purge_finished()
+                tokens.purge_expired()
+                last_maintenance = time.monotonic()
+
+            close_old_connections()
+            job = jobs.claim()
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+
+            if jobs.run(job):
+                done += 1
+            else:
+                failed += 1
+                self.stderr.write(f"Задача {job.kind} #{job.pk} завершилась ошибкой "
+                                  f"(попытка {job.attempts} из {job.max_attempts})")
+
+        self.stdout.write(self.style.SUCCESS(f"Выполнено задач: {done}, с ошибкой: {failed}"))
+
+    def stop(self, signum, frame):
+        # Текущая задача доделывается, новые не берутся
+        self.stopping = True
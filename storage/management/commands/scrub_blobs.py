@@ -0,0 +1,97 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.timezone import timedelta
+import logging
+import threading
+import time
+from storage.blobs import verify
+from storage.models import Blob
+
+
+logger = logging.getLogger('storage')
+
+
+class Throttle:
+    """Общее для всех потоков ограничение скорости чтения: bytes_per_second байт в секунду"""
+
+    def __init__(self, bytes_per_second):
+        self.bytes_per_second = bytes_per_second
+        self.lock = threading.Lock()
+        self.next_time = time.monotonic()
+
+    def __call__(self, size):
+        # Каждый прочитанный блок сдвигает момент, раньше которого читать дальше нельзя
+        with self.lock:
+            now = time.monotonic()
+            self.next_time = max(self.next_time, now) + size / self.bytes_per_second
+            delay = self.next_time - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Command(BaseCommand):
+    help = (
+        "Перечитывает содержимое блобов и сверяет его SHA-256 с digest, чтобы вовремя "
+        "заметить испорченные (bit rot) и пропавшие файлы. Результат записывается в "
+        "Blob.verified_at и Blob.corrupt после каждой порции, поэтому прерванная проверка "
+        "продолжается повторным запуском. Повреждённый блоб восстанавливается, когда "
+        "кто-нибудь снова загрузит те же байты."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help="Сколько блобов проверяется параллельно")
+        parser.add_argument('--rate-mb', type=float, default=20,
+                            help="Ограничение скорости чтения на все потоки, МБ/с (0 - без ограничения)")
+        parser.add_argument('--interval-days', type=float, default=30,
+                            help="Проверять блобы, которые не проверялись дольше стольких дней")
+        parser.add_argument('--batch-size', type=int, default=100, help="Сколько блобов выбирается за раз")
+        parser.add_argument('--max-minutes', type=float, default=0,
+                            help="Остановиться после стольких минут работы (0 - без ограничения)")
+
+    def handle(self, *args, **options):
+        throttle = Throttle(options['rate_mb'] * 1024 * 1024) if options['rate_mb'] > 0 else None
+        deadline = time.monotonic() + options['max_minutes'] * 60 if options['max_minutes'] else None
+        cutoff = timezone.now() - timedelta(days=options['interval_days'])
+        pending = Blob.objects.filter(Q(verified_at=None) | Q(verified_at__lt=cutoff)).order_by('pk')
+
+        def check(blob):
+            try:
+                return 'ok' if verify(blob, throttle) else 'corrupt'
+            except FileNotFoundError:
+                return 'missing'
+
+        checked = size = 0
+        bad = []
+        last_pk = 0
+        # В потоках только чтение из хранилища; с базой работает основной поток
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            while deadline is None or time.monotonic() < deadline:
+                # encoding нужен для Blob.name: без него каждый поток догружал бы поле запросом к базе
+                batch = list(
+                    pending.filter(pk__gt=last_pk).only('pk', 'digest', 'size', 'encoding')[:options['batch_size']]
+                )
+                if not batch:
+                    break
+                last_pk = batch[-1].pk
+                results = list(pool.map(check, batch))
+
+                now = timezone.now()
+                for blob, result in zip(batch, results):
+                    blob.verified_at = now
+                    blob.corrupt = result != 'ok'
+                    if blob.corrupt:
+                        bad.append(blob)
+                        message = f"Блоб {blob.pk} ({blob.name}): {'повреждён' if result == 'corrupt' else 'нет содержимого'}"
+                        logger.error(message)
+                        self.stderr.write(message)
+                Blob.objects.bulk_update(batch, ['verified_at', 'corrupt'])
+                checked += len(batch)
+                size += sum(blob.size for blob in batch)
+                self.stdout.write(f"Проверено: {checked} ({size / 1024 / 1024:.1f} МБ), последний id: {last_pk}")
+
+        if bad:
+            # Ненулевой код завершения, чтобы cron или мониторинг заметили проблему
+            raise CommandError(f"Проверено блобов: {checked}, повреждённых или потерянных: {len(bad)}")
+        self.stdout.write(self.style.SUCCESS(f"Проверено блобов: {checked}, повреждений нет"))
@@ -0,0 +1,101 @@
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from collections import Counter
+import hashlib
+import json
+import os
+import tempfile
+from storage.backends import get_storage
+from storage.models import Blob, CustomUser, File
+
+
+class Command(BaseCommand):
+    help = (
+        "Создаёт набор данных для нагрузочных тестов (benchmarks/scenarios.py): "
+        "пользователей с файлами на диске и администратора. Параметры входа "
+        "записываются в файл описания набора (--manifest)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help="Количество пользователей")
+        parser.add_argument('--files', type=int, default=1000, help="Файлов на пользователя")
+        parser.add_argument('--size', type=int, default=64 * 1024, help="Размер файла в байтах")
+        parser.add_argument('--distinct', type=int, default=100,
+                            help="Сколько разных содержимых лежит на диске (файлы ссылаются на них по кругу)")
+        parser.add_argument('--prefix', default='bench', help="Начало имён пользователей набора")
+        parser.add_argument('--password', default='bench-password')
+        parser.add_argument('--manifest', default='benchmarks/dataset.json', help="Куда записать описание набора")
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if CustomUser.objects.filter(username__startswith=f'{prefix}_').exists():
+            raise CommandError(f"Пользователи {prefix}_* уже есть: укажите другой --prefix или пустую базу.")
+        user_count, files_per_user = options['users'], options['files']
+        self.stdout.write(f"Генерация: {user_count} пользователей по {files_per_user} файлов...")
+
+        with transaction.atomic():
+            blobs = self.create_blobs(prefix, options['distinct'], options['size'])
+            password = make_password(options['password'])
+            users = CustomUser.objects.bulk_create(
+                [CustomUser(username=f'{prefix}_{i}', email=f'{prefix}{i}@example.com', password=password)
+                 for i in range(user_count)]
+                + [CustomUser(username=f'{prefix}_admin', email=f'{prefix}-admin@example.com', password=password,
+                              is_admin=True)]
+            )
+            references = Counter()
+            for user in users[:user_count]:
+                files = []
+                for i in range(files_per_user):
+                    blob = blobs[(user.pk + i) % len(blobs)]
+                    references[blob.pk] += 1
+                    files.append(File(
+                        user=user,
+                        original_name=f"report_{i}.pdf" if i % 3 else f"photo_{i}.jpg",
+                        unique_name=blob.name,
+                        blob=blob,
+                        size=blob.size,
+                    ))
+                File.objects.bulk_create(files, batch_size=5000)
+                # Счётчики пользователя ведёт загрузка, здесь файлы создаются в обход неё
+                user.file_count = len(files)
+                user.total_bytes = sum(file_instance.size for file_instance in files)
+            CustomUser.objects.bulk_update(users, ['file_count', 'total_bytes'])
+            for blob in blobs:
+                blob.ref_count = references[blob.pk]
+            Blob.objects.bulk_update(blobs, ['ref_count'])
+
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                for model in (CustomUser, File, Blob):
+                    cursor.execute(f'ANALYZE "{model._meta.db_table}"')
+
+        manifest = {
+            'users': [user.username for user in users[:user_count]],
+            'admin': users[-1].username,
+            'password': options['password'],
+            'files_per_user': files_per_user,
+            'file_size': options['size'],
+        }
+        with open(options['manifest'], 'w') as output:
+            json.dump(manifest, output, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS(
+            f"Создано {user_count * files_per_user} файлов; описание набора: {options['manifest']}"
+        ))
+
+    def create_blobs(self, prefix, count, size):
+        """Блобы со случайным содержимым, уже лежащие в хранилище"""
+        storage = get_storage()
+        blobs = []
+        for i in range(count):
+            # Начало содержимого делает хэши разными у наборов с разными префиксами
+            content = f'{prefix}:{i}:'.encode() + os.urandom(max(size - 32, 0))
+            content = content[:size]
+            blob = Blob(digest=hashlib.sha256(content).hexdigest(), size=len(content), stored_size=len(content),
+                        ref_count=0)
+            fd, temp_name = tempfile.mkstemp(dir=storage.temp_dir(), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as temp:
+                temp.write(content)
+            storage.save(blob.name, temp_name)
+            blobs.append(blob)
+        return Blob.objects.bulk_create(blobs)
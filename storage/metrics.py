@@ -0,0 +1,114 @@
+"""
+Метрики запросов в формате Prometheus (GET /metrics).
+
+Значения накапливаются в памяти процесса: при нескольких воркерах gunicorn
+каждый отдаёт свои, поэтому Prometheus должен опрашивать каждый процесс
+(или один воркер на порт). Заполняет их PerformanceMiddleware.
+"""
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+import threading
+from . import caching
+from .network import client_ip
+
+
+# Границы корзин гистограммы времени ответа, в секундах
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Границы корзин гистограммы числа запросов к базе за один HTTP-запрос
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+_lock = threading.Lock()
+REGISTRY = []
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def label_text(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+class Counter:
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.values = {}
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount=1):
+        with _lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} counter'
+        with _lock:
+            items = sorted(self.values.items())
+        for labels, value in items:
+            yield f'{self.name}{label_text(self.labels, labels)} {value}'
+
+
+class Histogram:
+    def __init__(self, name, documentation, buckets, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.labels = labels
+        # labels -> [количества по корзинам..., сумма, число наблюдений]
+        self.values = {}
+        REGISTRY.append(self)
+
+    def observe(self, value, *labels):
+        with _lock:
+            series = self.values.setdefault(labels, [0] * len(self.buckets) + [0, 0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        with _lock:
+            items = sorted((labels, list(series)) for labels, series in self.values.items())
+        for labels, series in items:
+            for bound, count in zip(self.buckets, series):
+                yield f'{self.name}_bucket{label_text(self.labels + ("le",), labels + (bound,))} {count}'
+            yield f'{self.name}_bucket{label_text(self.labels + ("le",), labels + ("+Inf",))} {series[-1]}'
+            yield f'{self.name}_sum{label_text(self.labels, labels)} {series[-2]}'
+            yield f'{self.name}_count{label_text(self.labels, labels)} {series[-1]}'
+
+
+REQUESTS = Counter('http_requests_total', "HTTP-запросы", ('view', 'method', 'status'))
+LATENCY = Histogram('http_request_duration_seconds', "Время ответа (до заголовков)", LATENCY_BUCKETS, ('view',))
+QUERIES = Histogram('http_request_db_queries', "Запросы к базе за один HTTP-запрос", QUERY_COUNT_BUCKETS, ('view',))
+DB_TIME = Counter('db_query_duration_seconds_total', "Время запросов к базе", ('view',))
+BYTES_IN = Counter('http_request_bytes_total', "Принято байт в телах запросов", ('view',))
+BYTES_OUT = Counter('http_response_bytes_total', "Отдано байт в телах ответов", ('view',))
+SLOW_QUERIES = Counter('db_slow_queries_total', "Запросы к базе дольше SLOW_QUERY_MS", ('view',))
+N_PLUS_ONE = Counter('db_repeated_queries_total', "Запросы, повторённые N_PLUS_ONE_THRESHOLD и более раз", ('view',))
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    # Счётчики кэша ведёт caching
+    lines.append('# HELP cache_requests_total Обращения к кэшу метаданных')
+    lines.append('# TYPE cache_requests_total counter')
+    for kind, counters in sorted(caching.stats().items()):
+        for result in ('hits', 'misses'):
+            lines.append(f'cache_requests_total{label_text(("kind", "result"), (kind, result))} {counters[result]}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """Метрики для Prometheus; доступны только с адресов METRICS_ALLOWED_IPS"""
+    if client_ip(request) not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden()
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
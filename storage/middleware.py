@@ -0,0 +1,147 @@
+"""
+Замеры запросов: время ответа, число и время запросов к базе, принятые и
+отданные байты по представлениям (storage.metrics, GET /metrics), заголовок
+Server-Timing и предупреждения в лог о медленных запросах к базе и об одном
+и том же запросе, повторённом много раз (N+1).
+"""
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+import collections
+import contextvars
+import logging
+import time
+from . import metrics
+
+
+logger = logging.getLogger(__name__)
+
+# Замер текущего HTTP-запроса; в async-представлениях переходит в sync_to_async вместе с контекстом
+_tracker = contextvars.ContextVar('storage_query_tracker', default=None)
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else 'unmatched'
+
+
+class QueryTracker:
+    """Запросы к базе одного HTTP-запроса"""
+
+    def __init__(self, request):
+        self.request = request
+        self.count = 0
+        self.duration = 0.0
+        self.statements = collections.Counter()
+
+    def record(self, sql, duration):
+        self.count += 1
+        self.duration += duration
+        self.statements[sql] += 1
+        if duration * 1000 >= settings.SLOW_QUERY_MS:
+            view = view_name(self.request)
+            metrics.SLOW_QUERIES.inc(view)
+            logger.warning("Медленный запрос к базе (%.1f мс) в %s: %s", duration * 1000, view, sql)
+
+    def report_repeated(self):
+        view = view_name(self.request)
+        for sql, repeats in self.statements.items():
+            if repeats >= settings.N_PLUS_ONE_THRESHOLD:
+                metrics.N_PLUS_ONE.inc(view)
+                logger.warning("Запрос к базе повторён %d раз в %s (N+1?): %s", repeats, view, sql)
+
+
+def track_query(execute, sql, params, many, context):
+    tracker = _tracker.get()
+    if tracker is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        tracker.record(sql, time.perf_counter() - started)
+
+
+def install_tracker(sender, connection, **kwargs):
+    # Объект соединения переживает переподключения (CONN_MAX_AGE=0, пул) - обёртка ставится один раз
+    if track_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(track_query)
+
+
+connection_created.connect(install_tracker)
+
+
+def count_chunks(chunks, view):
+    for chunk in chunks:
+        metrics.BYTES_OUT.inc(view, amount=len(chunk))
+        yield chunk
+
+
+async def acount_chunks(chunks, view):
+    async for chunk in chunks:
+        metrics.BYTES_OUT.inc(view, amount=len(chunk))
+        yield chunk
+
+
+class PerformanceMiddleware:
+    """
+    Стоит первым в MIDDLEWARE, чтобы замер включал остальные middleware.
+    Время считается до готовности заголовков: отдача тела потокового ответа
+    в него не входит, а его байты считаются по мере отправки.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        tracker = QueryTracker(request)
+        reset = _tracker.set(tracker)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _tracker.reset(reset)
+        return self.finish(request, response, tracker, started)
+
+    async def __acall__(self, request):
+        tracker = QueryTracker(request)
+        reset = _tracker.set(tracker)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _tracker.reset(reset)
+        return self.finish(request, response, tracker, started)
+
+    def finish(self, request, response, tracker, started):
+        elapsed = time.perf_counter() - started
+        view = view_name(request)
+        metrics.REQUESTS.inc(view, request.method, response.status_code)
+        metrics.LATENCY.observe(elapsed, view)
+        metrics.QUERIES.observe(tracker.count, view)
+        metrics.DB_TIME.inc(view, amount=tracker.duration)
+        metrics.BYTES_IN.inc(view, amount=int(request.META.get('CONTENT_LENGTH') or 0))
+        tracker.report_repeated()
+
+        if response.has_header('Content-Length'):
+            # В том числе FileResponse: его не оборачиваем, чтобы сервер мог отдать файл через sendfile
+            metrics.BYTES_OUT.inc(view, amount=int(response['Content-Length']))
+        elif not response.streaming:
+            metrics.BYTES_OUT.inc(view, amount=len(response.content))
+        elif response.is_async:
+            response.streaming_content = acount_chunks(response.streaming_content, view)
+        else:
+            response.streaming_content = count_chunks(response.streaming_content, view)
+
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = (
+                f'app;dur={elapsed * 1000:.1f}, '
+                f'db;dur={tracker.duration * 1000:.1f};desc="{tracker.count} queries"'
+            )
+        return response
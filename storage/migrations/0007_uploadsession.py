@@ -0,0 +1,35 @@
+# Generated by Django 5.1.4 on 2026-10-18 11:27
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0006_alter_customuser_options_alter_file_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('original_name', models.CharField(max_length=350, verbose_name='Оригинальное имя файла')),
+                ('size', models.PositiveBigIntegerField(verbose_name='Полный размер файла (в байтах)')),
+                ('offset', models.PositiveBigIntegerField(default=0, verbose_name='Принято байт')),
+                ('comment', models.TextField(blank=True, verbose_name='Комментарий')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField()),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Сессия загрузки',
+                'verbose_name_plural': 'Сессии загрузки',
+                'db_table': 'UploadSession',
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.4 on 2026-10-18 11:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0007_uploadsession'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True, verbose_name='SHA-256')),
+                ('size', models.PositiveBigIntegerField(verbose_name='Размер (в байтах)')),
+                ('ref_count', models.PositiveIntegerField(default=0, verbose_name='Количество ссылок')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Блоб',
+                'verbose_name_plural': 'Блобы',
+                'db_table': 'Blob',
+            },
+        ),
+        migrations.AlterField(
+            model_name='file',
+            name='unique_name',
+            field=models.CharField(db_index=True, max_length=350, verbose_name='Уникальное имя файла'),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='files', to='storage.blob', verbose_name='Содержимое'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.4 on 2026-10-18 11:34
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Индексы строятся CONCURRENTLY, чтобы не блокировать запись в большие таблицы
+    atomic = False
+
+    dependencies = [
+        ('storage', '0008_blob'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='file',
+            index=models.Index(fields=['user', '-uploaded_at', '-id'], name='file_user_uploaded_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='file',
+            index=models.Index(fields=['user', 'original_name'], name='file_user_name_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='file',
+            index=models.Index(fields=['user', 'size'], name='file_user_size_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='file',
+            index=models.Index(models.F('user'), django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('original_name'), name='text_pattern_ops'), name='file_user_name_prefix_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='filetoken',
+            index=models.Index(fields=['expires_at'], name='filetoken_expires_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='uploadsession',
+            index=models.Index(fields=['expires_at'], name='uploadsession_expires_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.4 on 2026-10-18 11:36
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_usage_counters(apps, schema_editor):
+    """Заполняет счётчики по уже загруженным файлам"""
+    CustomUser = apps.get_model('storage', 'CustomUser')
+    File = apps.get_model('storage', 'File')
+    files = File.objects.filter(user=OuterRef('pk')).order_by().values('user')
+    CustomUser.objects.update(
+        file_count=Coalesce(Subquery(files.annotate(c=Count('id')).values('c')), 0),
+        total_bytes=Coalesce(Subquery(files.annotate(s=Sum('size')).values('s')), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0009_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='file_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Количество файлов'),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='total_bytes',
+            field=models.PositiveBigIntegerField(default=0, verbose_name='Объём файлов (в байтах)'),
+        ),
+        migrations.RunPython(fill_usage_counters, migrations.RunPython.noop),
+    ]
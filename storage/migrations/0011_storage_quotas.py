@@ -0,0 +1,36 @@
+# Generated by Django 5.1.4 on 2026-10-18 11:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0010_customuser_usage_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='quota_bytes',
+            field=models.PositiveBigIntegerField(blank=True, null=True, verbose_name='Квота (в байтах)'),
+        ),
+        migrations.CreateModel(
+            name='StorageReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('size', models.PositiveBigIntegerField(verbose_name='Размер (в байтах)')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='storage_reservations', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Резерв места',
+                'verbose_name_plural': 'Резервы места',
+                'db_table': 'StorageReservation',
+                'indexes': [models.Index(fields=['user', 'expires_at'], name='reservation_user_expires_idx')],
+            },
+        ),
+    ]
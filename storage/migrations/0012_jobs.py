@@ -0,0 +1,43 @@
+# Generated by Django 5.1.4 on 2026-10-18 11:42
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0011_storage_quotas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='content_type',
+            field=models.CharField(blank=True, max_length=100, verbose_name='Тип содержимого'),
+        ),
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=50, verbose_name='Тип задачи')),
+                ('payload', models.JSONField(blank=True, default=dict, verbose_name='Параметры')),
+                ('status', models.CharField(choices=[('pending', 'Ожидает'), ('running', 'Выполняется'), ('done', 'Выполнена'), ('failed', 'Ошибка')], default='pending', max_length=10, verbose_name='Статус')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Попыток')),
+                ('max_attempts', models.PositiveSmallIntegerField(default=5, verbose_name='Максимум попыток')),
+                ('run_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Выполнить не раньше')),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, verbose_name='Последняя ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('file', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='storage.file', verbose_name='Файл')),
+            ],
+            options={
+                'verbose_name': 'Фоновая задача',
+                'verbose_name_plural': 'Фоновые задачи',
+                'db_table': 'Job',
+                'indexes': [models.Index(condition=models.Q(('status', 'pending')), fields=['run_at'], name='job_pending_idx'), models.Index(condition=models.Q(('status', 'running')), fields=['locked_until'], name='job_running_idx'), models.Index(condition=models.Q(('status', 'done')), fields=['finished_at'], name='job_done_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.4 on 2026-10-18 11:43
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0012_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Derivative',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20, verbose_name='Вид')),
+                ('size', models.PositiveIntegerField(verbose_name='Размер (в байтах)')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_accessed', models.DateTimeField(default=django.utils.timezone.now)),
+                ('blob', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='derivatives', to='storage.blob', verbose_name='Содержимое')),
+            ],
+            options={
+                'verbose_name': 'Миниатюра',
+                'verbose_name_plural': 'Миниатюры',
+                'db_table': 'Derivative',
+                'indexes': [models.Index(fields=['last_accessed'], name='derivative_accessed_idx')],
+                'constraints': [models.UniqueConstraint(fields=('blob', 'kind'), name='derivative_blob_kind_uniq')],
+            },
+        ),
+    ]
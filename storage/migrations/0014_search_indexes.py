@@ -0,0 +1,29 @@
+# Generated by Django 5.1.4 on 2026-10-18 11:48
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import AddIndexConcurrently, BtreeGinExtension, TrigramExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Индексы строятся CONCURRENTLY, чтобы не блокировать запись в большие таблицы
+    atomic = False
+
+    dependencies = [
+        ('storage', '0013_derivatives'),
+    ]
+
+    operations = [
+        # btree_gin - чтобы user_id входил в GIN-индексы вместе с текстом
+        BtreeGinExtension(),
+        TrigramExtension(),
+        AddIndexConcurrently(
+            model_name='file',
+            index=django.contrib.postgres.indexes.GinIndex(models.F('user'), django.contrib.postgres.search.CombinedSearchVector(django.contrib.postgres.search.SearchVector(models.Func(models.F('original_name'), models.Value('[._-]+'), models.Value(' '), models.Value('g'), function='regexp_replace'), config='russian', weight='A'), '||', django.contrib.postgres.search.SearchVector('comment', config='russian', weight='B'), django.contrib.postgres.search.SearchConfig('russian')), name='file_user_search_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='file',
+            index=django.contrib.postgres.indexes.GinIndex(models.F('user'), django.contrib.postgres.indexes.OpClass(models.F('original_name'), name='gin_trgm_ops'), name='file_user_name_trgm_idx'),
+        ),
+    ]
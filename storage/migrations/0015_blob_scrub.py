@@ -0,0 +1,23 @@
+# Generated by Django 5.1.4 on 2026-10-18 12:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0014_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='corrupt',
+            field=models.BooleanField(default=False, verbose_name='Повреждён или потерян'),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='verified_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Проверен'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.4 on 2026-10-18 12:27
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_stored_size(apps, schema_editor):
+    """Всё, что уже лежит в хранилище, хранится без сжатия"""
+    Blob = apps.get_model('storage', 'Blob')
+    Blob.objects.update(stored_size=F('size'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0015_blob_scrub'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='encoding',
+            field=models.CharField(blank=True, default='', max_length=10, verbose_name='Сжатие'),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='stored_size',
+            field=models.PositiveBigIntegerField(default=0, verbose_name='Размер в хранилище (в байтах)'),
+        ),
+        migrations.RunPython(fill_stored_size, migrations.RunPython.noop),
+    ]
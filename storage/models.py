@@ -1,5 +1,9 @@
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVector
 from django.db import models
+from django.db.models import F, Func, Q, Value
+from django.db.models.functions import Upper
 from django.conf import settings
 from django.utils.timezone import now
 import uuid
@@ -8,21 +12,99 @@ import uuid
 class CustomUser(AbstractUser):
     full_name = models.CharField(max_length=350, blank=True, null=True, verbose_name="Полное имя")
     is_admin = models.BooleanField(default=False, verbose_name="Администратор")
+    # Счётчики файлов пользователя: обновляются сигналами при загрузке и удалении File,
+    # сверяются командой reconcile_usage
+    file_count = models.PositiveIntegerField(default=0, verbose_name="Количество файлов")
+    total_bytes = models.PositiveBigIntegerField(default=0, verbose_name="Объём файлов (в байтах)")
+    # Пусто - действует STORAGE_DEFAULT_QUOTA из настроек
+    quota_bytes = models.PositiveBigIntegerField(null=True, blank=True, verbose_name="Квота (в байтах)")
+
+    # Поля, которые меняются только атомарным UPDATE (usage.add_usage) или явным update_fields
+    COUNTER_FIELDS = ('file_count', 'total_bytes')
 
     class Meta:
         db_table = 'CustomUser'
         verbose_name = "Пользователь"
         verbose_name_plural = "Пользователи"
 
+    @property
+    def quota(self):
+        """Действующая квота в байтах или None, если ограничения нет"""
+        if self.quota_bytes is not None:
+            return self.quota_bytes
+        return settings.STORAGE_DEFAULT_QUOTA
+
     def save(self, *args, **kwargs):
         if self.is_superuser:
             self.is_admin = True
+        if not self._state.adding and kwargs.get('update_fields') is None and not args:
+            # Обычное сохранение (смена пароля, форма администратора) не должно записывать
+            # счётчики, загруженные вместе с объектом: их уже могли изменить загрузки
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS and field.attname not in deferred
+            ]
         super().save(*args, **kwargs)
 
     def __str__(self):
         return self.username
 
 
+class Blob(models.Model):
+    """Физическое содержимое файла: одно на каждый уникальный SHA-256, общее для всех File с такими байтами"""
+    digest = models.CharField(max_length=64, unique=True, verbose_name="SHA-256")
+    size = models.PositiveBigIntegerField(verbose_name="Размер (в байтах)")
+    ref_count = models.PositiveIntegerField(default=0, verbose_name="Количество ссылок")
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Результат последней проверки содержимого по digest (python manage.py scrub_blobs)
+    verified_at = models.DateTimeField(null=True, blank=True, verbose_name="Проверен")
+    corrupt = models.BooleanField(default=False, verbose_name="Повреждён или потерян")
+    # Сжатие в хранилище (см. compression): size - исходный размер, stored_size - занимаемое место
+    encoding = models.CharField(max_length=10, blank=True, default='', verbose_name="Сжатие")
+    stored_size = models.PositiveBigIntegerField(default=0, verbose_name="Размер в хранилище (в байтах)")
+
+    # Расширение имени сжатого содержимого по способу сжатия
+    SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+
+    class Meta:
+        db_table = 'Blob'
+        verbose_name = "Блоб"
+        verbose_name_plural = "Блобы"
+
+    @property
+    def plain_name(self):
+        """Имя несжатого содержимого: blobs/ab/cd/abcd..."""
+        return f"blobs/{self.digest[:2]}/{self.digest[2:4]}/{self.digest}"
+
+    @property
+    def name(self):
+        """Имя в хранилище (см. backends); у сжатого содержимого - с расширением кодека"""
+        return self.plain_name + self.SUFFIXES.get(self.encoding, '')
+
+    def __str__(self):
+        return self.digest
+
+
+# Конфигурация полнотекстового поиска: русская морфология, латиница - английская
+SEARCH_CONFIG = 'russian'
+
+
+def file_search_vector():
+    """
+    tsvector по имени файла (вес A) и комментарию (вес B).
+
+    В имени точки, подчёркивания и дефисы считаются разделителями слов,
+    иначе 'отчёт_2024.pdf' стало бы одной лексемой. Поиск должен строить
+    ровно это выражение, чтобы использовался индекс file_user_search_idx.
+    """
+    name = Func(F('original_name'), Value(r'[._-]+'), Value(' '), Value('g'), function='regexp_replace')
+    return (
+        SearchVector(name, weight='A', config=SEARCH_CONFIG)
+        + SearchVector('comment', weight='B', config=SEARCH_CONFIG)
+    )
+
+
 class File(models.Model):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -31,16 +113,53 @@ class File(models.Model):
         verbose_name="Пользователь"
     )
     original_name = models.CharField(max_length=350, verbose_name="Оригинальное имя файла")
-    unique_name = models.CharField(max_length=350, unique=True, verbose_name="Уникальное имя файла")
+    # Имя содержимого в хранилище (см. backends). У файлов с одинаковыми байтами оно общее (см. Blob)
+    unique_name = models.CharField(max_length=350, db_index=True, verbose_name="Уникальное имя файла")
+    blob = models.ForeignKey(
+        'Blob',
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='files',
+        verbose_name="Содержимое"
+    )
     size = models.PositiveBigIntegerField(verbose_name="Размер файла (в байтах)")
     uploaded_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата загрузки")
     last_downloaded = models.DateTimeField(null=True, blank=True, verbose_name="Дата последнего скачивания")
     comment = models.TextField(blank=True, verbose_name="Комментарий")
+    # Определяется фоновой обработкой по содержимому; пусто - ещё не определён
+    content_type = models.CharField(max_length=100, blank=True, verbose_name="Тип содержимого")
 
     class Meta:
         db_table = 'File'
         verbose_name = "Файл"
         verbose_name_plural = "Файлы"
+        indexes = [
+            # Список файлов пользователя по дате загрузки (курсорная пагинация)
+            models.Index(fields=['user', '-uploaded_at', '-id'], name='file_user_uploaded_idx'),
+            # Сортировка по имени и размеру внутри пользователя
+            models.Index(fields=['user', 'original_name'], name='file_user_name_idx'),
+            models.Index(fields=['user', 'size'], name='file_user_size_idx'),
+            # Фильтр по началу имени без учёта регистра: UPPER(original_name) LIKE 'ABC%'
+            models.Index(
+                F('user'), OpClass(Upper('original_name'), name='text_pattern_ops'),
+                name='file_user_name_prefix_idx'
+            ),
+            # Полнотекстовый поиск и нечёткий поиск по имени внутри пользователя (btree_gin + pg_trgm).
+            # Триграммный индекс заодно ускоряет icontains по имени в админке
+            GinIndex(F('user'), file_search_vector(), name='file_user_search_idx'),
+            GinIndex(F('user'), OpClass(F('original_name'), name='gin_trgm_ops'), name='file_user_name_trgm_idx'),
+        ]
+
+    @property
+    def digest(self):
+        """
+        SHA-256 содержимого или None у файлов старой раскладки. Берётся из имени
+        блоба (Blob.name), а не из строки Blob: для этого не нужен лишний запрос.
+        """
+        if self.unique_name.startswith('blobs/'):
+            return self.unique_name.rsplit('/', 1)[1].split('.', 1)[0]
+        return None
 
     def __str__(self):
         return self.original_name
@@ -57,9 +176,148 @@ class FileToken(models.Model):
         db_table = 'FileToken'
         verbose_name = "Токен файла"
         verbose_name_plural = "Токены файлов"
+        indexes = [
+            # Очистка просроченных токенов
+            models.Index(fields=['expires_at'], name='filetoken_expires_idx'),
+        ]
 
     def is_valid(self):
         return now() < self.expires_at
 
     def __str__(self):
         return f"Токен для {self.file.original_name} (истекает в {self.expires_at})"
+
+
+class UploadSession(models.Model):
+    """Сессия возобновляемой загрузки файла по частям"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='upload_sessions',
+        verbose_name="Пользователь"
+    )
+    original_name = models.CharField(max_length=350, verbose_name="Оригинальное имя файла")
+    size = models.PositiveBigIntegerField(verbose_name="Полный размер файла (в байтах)")
+    offset = models.PositiveBigIntegerField(default=0, verbose_name="Принято байт")
+    comment = models.TextField(blank=True, verbose_name="Комментарий")
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+    locked_until = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'UploadSession'
+        verbose_name = "Сессия загрузки"
+        verbose_name_plural = "Сессии загрузки"
+        indexes = [
+            models.Index(fields=['expires_at'], name='uploadsession_expires_idx'),
+        ]
+
+    def is_valid(self):
+        return now() < self.expires_at
+
+    def __str__(self):
+        return f"Загрузка {self.original_name} ({self.offset}/{self.size})"
+
+
+class StorageReservation(models.Model):
+    """Место, зарезервированное под байты, которые загружаются прямо сейчас"""
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='storage_reservations',
+        verbose_name="Пользователь"
+    )
+    size = models.PositiveBigIntegerField(verbose_name="Размер (в байтах)")
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'StorageReservation'
+        verbose_name = "Резерв места"
+        verbose_name_plural = "Резервы места"
+        indexes = [
+            models.Index(fields=['user', 'expires_at'], name='reservation_user_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.size} байт для {self.user_id} (до {self.expires_at})"
+
+
+class Job(models.Model):
+    """Фоновая задача; очередь хранится в этой же базе и разбирается командой run_jobs"""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, "Ожидает"),
+        (RUNNING, "Выполняется"),
+        (DONE, "Выполнена"),
+        (FAILED, "Ошибка"),
+    ]
+
+    kind = models.CharField(max_length=50, verbose_name="Тип задачи")
+    file = models.ForeignKey(
+        File,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='jobs',
+        verbose_name="Файл"
+    )
+    payload = models.JSONField(default=dict, blank=True, verbose_name="Параметры")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING, verbose_name="Статус")
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name="Попыток")
+    max_attempts = models.PositiveSmallIntegerField(default=5, verbose_name="Максимум попыток")
+    run_at = models.DateTimeField(default=now, verbose_name="Выполнить не раньше")
+    # Пока срок не истёк, задачу выполняет воркер; после - воркер считается упавшим
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, verbose_name="Последняя ошибка")
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'Job'
+        verbose_name = "Фоновая задача"
+        verbose_name_plural = "Фоновые задачи"
+        indexes = [
+            # Выборка следующей задачи воркером
+            models.Index(fields=['run_at'], condition=Q(status='pending'), name='job_pending_idx'),
+            # Поиск задач упавших воркеров
+            models.Index(fields=['locked_until'], condition=Q(status='running'), name='job_running_idx'),
+            # Очистка завершённых задач
+            models.Index(fields=['finished_at'], condition=Q(status='done'), name='job_done_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+
+class Derivative(models.Model):
+    """Производный файл (миниатюра, превью), построенный по содержимому блоба"""
+    blob = models.ForeignKey(Blob, on_delete=models.CASCADE, related_name='derivatives', verbose_name="Содержимое")
+    kind = models.CharField(max_length=20, verbose_name="Вид")
+    size = models.PositiveIntegerField(verbose_name="Размер (в байтах)")
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Обновляется не чаще раза в час; по нему вытесняются давно не запрашивавшиеся
+    last_accessed = models.DateTimeField(default=now)
+
+    class Meta:
+        db_table = 'Derivative'
+        verbose_name = "Миниатюра"
+        verbose_name_plural = "Миниатюры"
+        constraints = [
+            models.UniqueConstraint(fields=['blob', 'kind'], name='derivative_blob_kind_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['last_accessed'], name='derivative_accessed_idx'),
+        ]
+
+    @property
+    def name(self):
+        """Имя в хранилище: рядом с файлом блоба (не зависит от того, сжат ли он)"""
+        return f"{self.blob.plain_name}.{self.kind}.webp"
+
+    def __str__(self):
+        return f"{self.kind} для {self.blob_id}"
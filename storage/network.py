@@ -0,0 +1,25 @@
+"""
+Адрес клиента за обратным прокси.
+
+За nginx из deploy/nginx.conf REMOTE_ADDR у всех запросов - адрес самого
+nginx, а настоящий адрес клиента приходит в X-Forwarded-For. Заголовку
+можно верить, только если запрос пришёл от прокси из TRUSTED_PROXIES:
+иначе клиент подставил бы в него любой адрес.
+"""
+from django.conf import settings
+
+
+def client_ip(request):
+    """
+    Адрес клиента: X-Forwarded-For читается справа налево, пока адреса
+    принадлежат доверенным прокси; первый чужой адрес - клиент.
+    """
+    address = request.META.get('REMOTE_ADDR')
+    if address not in settings.TRUSTED_PROXIES:
+        return address
+    forwarded = [part.strip() for part in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if part.strip()]
+    for hop in reversed(forwarded):
+        address = hop
+        if hop not in settings.TRUSTED_PROXIES:
+            break
+    return address
@@ -0,0 +1,65 @@
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class FileCursorPagination(CursorPagination):
+    """
+    Постраничный вывод файлов по курсору (keyset): следующая страница
+    выбирается условием по uploaded_at, а не OFFSET, поэтому время ответа
+    не растёт с количеством файлов. Порядок можно сменить параметром ordering.
+    """
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    ordering = ('-uploaded_at', '-id')
+
+
+class UserCursorPagination(CursorPagination):
+    """Постраничный вывод пользователей по курсору"""
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    ordering = ('id',)
+
+
+class SearchPagination(LimitOffsetPagination):
+    """
+    Постраничный вывод результатов поиска (limit/offset) без COUNT(*):
+    у частого слова совпадений могут быть миллионы, а пользователю нужны
+    первые страницы по релевантности. Наличие следующей страницы
+    определяется по лишней строке в выборке.
+    """
+    default_limit = 50
+    max_limit = 200
+    # Дальше этого результаты по релевантности листать незачем, а OFFSET дорожает
+    max_offset = 10000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.offset = min(self.get_offset(request), self.max_offset)
+        rows = list(queryset[self.offset:self.offset + self.limit + 1])
+        self.has_next = len(rows) > self.limit
+        return rows[:self.limit]
+
+    def get_next_link(self):
+        if not self.has_next or self.offset + self.limit > self.max_offset:
+            return None
+        url = replace_query_param(self.request.build_absolute_uri(), self.limit_query_param, self.limit)
+        return replace_query_param(url, self.offset_query_param, self.offset + self.limit)
+
+    def get_previous_link(self):
+        if self.offset <= 0:
+            return None
+        url = replace_query_param(self.request.build_absolute_uri(), self.limit_query_param, self.limit)
+        if self.offset - self.limit <= 0:
+            return remove_query_param(url, self.offset_query_param)
+        return replace_query_param(url, self.offset_query_param, self.offset - self.limit)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
@@ -0,0 +1,122 @@
+"""
+Квоты на объём хранилища.
+
+Перед тем как байты загрузки попадут на диск, под них резервируется место:
+резерв создаётся под блокировкой строки пользователя, поэтому две
+одновременные загрузки не могут вместе превысить квоту. Занятым считается
+объём уже сохранённых файлов (CustomUser.total_bytes), живые резервы
+и заявленные размеры незавершённых сессий возобновляемой загрузки.
+"""
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler
+from django.db import transaction
+from django.db.models import Sum
+from django.utils.timezone import now, timedelta
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from .models import CustomUser, StorageReservation, UploadSession
+
+
+class QuotaExceeded(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = "Превышена квота хранилища."
+    default_code = 'quota_exceeded'
+
+    def __init__(self, quota, used, requested):
+        super().__init__(
+            f"Превышена квота хранилища: занято {used} из {quota} байт, "
+            f"для загрузки нужно ещё {requested}."
+        )
+        self.quota = quota
+        self.used = used
+        self.requested = requested
+
+
+def reserved_bytes(user_id):
+    """Место, занятое живыми резервами и незавершёнными сессиями загрузки"""
+    moment = now()
+    reservations = StorageReservation.objects.filter(user_id=user_id, expires_at__gt=moment)
+    sessions = UploadSession.objects.filter(user_id=user_id, expires_at__gt=moment)
+    return (
+        (reservations.aggregate(total=Sum('size'))['total'] or 0)
+        + (sessions.aggregate(total=Sum('size'))['total'] or 0)
+    )
+
+
+def lock_and_check(user, size):
+    """
+    Блокирует строку пользователя и проверяет, что ещё size байт помещаются в квоту.
+
+    Вызывается внутри transaction.atomic(); блокировка держится до конца
+    транзакции, в которой создаётся резерв или сессия загрузки. Без квоты
+    строка не блокируется: одновременные загрузки пользователя не ждут друг друга.
+    """
+    if user.quota is None:
+        return
+    locked = CustomUser.objects.select_for_update().only('quota_bytes', 'total_bytes').get(pk=user.pk)
+    quota = locked.quota
+    if quota is None:
+        return
+    used = locked.total_bytes + reserved_bytes(user.pk)
+    if used + size > quota:
+        raise QuotaExceeded(quota, used, size)
+
+
+def check(user, size):
+    """Бросает QuotaExceeded, если size байт сейчас не помещаются в квоту; место не резервируется"""
+    with transaction.atomic():
+        lock_and_check(user, size)
+
+
+def reserve(user, size):
+    """
+    Резервирует size байт под загрузку одним запросом или бросает QuotaExceeded.
+    Без квоты резервировать нечего - возвращает None.
+    """
+    if user.quota is None:
+        return None
+    with transaction.atomic():
+        lock_and_check(user, size)
+        # Резервы оборвавшихся запросов больше не нужны
+        StorageReservation.objects.filter(user=user, expires_at__lte=now()).delete()
+        return StorageReservation.objects.create(
+            user=user,
+            size=size,
+            expires_at=now() + timedelta(hours=settings.QUOTA_RESERVATION_TTL_HOURS)
+        )
+
+
+def release(reservation):
+    """Снимает резерв, когда загрузка закончилась (успешно или нет)"""
+    if reservation is not None:
+        StorageReservation.objects.filter(pk=reservation.pk).delete()
+
+
+class QuotaUploadHandler(FileUploadHandler):
+    """
+    Обработчик загрузки Django, который резервирует место до разбора тела запроса.
+
+    Размер тела известен из Content-Length ещё до чтения первого байта,
+    поэтому запрос, не помещающийся в квоту, отклоняется с 413 сразу,
+    а не после записи всех файлов на диск. Файлы внутри multipart-тела
+    в сумме не больше самого тела, так что резерва хватает на все.
+    """
+
+    def __init__(self, user, request=None):
+        super().__init__(request)
+        self.user = user
+        self.reservation = None
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        self.reservation = reserve(self.user, content_length)
+
+    def receive_data_chunk(self, raw_data, start):
+        # Байты передаются следующим обработчикам без изменений
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+    def release(self):
+        release(self.reservation)
+        self.reservation = None
@@ -0,0 +1,59 @@
+"""
+Поиск файлов по имени и комментарию.
+
+Полнотекстовый поиск (tsvector, индекс file_user_search_idx) находит слова
+в любом месте имени и комментария с учётом словоформ и начала слова,
+триграммный (pg_trgm, индекс file_user_name_trgm_idx) - имена с опечатками.
+Оба условия проверяются по GIN-индексам вместе с user_id. Полным рангом
+(по tsvector имени и комментария) упорядочиваются не больше SEARCH_CANDIDATES
+совпадений, отобранных по похожести имени на запрос - она считается по
+одному короткому полю и намного дешевле. Поэтому файл, имя которого
+совпадает с запросом, попадает в выдачу и при тысячах совпадений, а время
+поиска не зависит от размера таблицы.
+"""
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db.models import F, Q
+import re
+from .models import SEARCH_CONFIG, file_search_vector
+
+
+# Слова запроса; остальные символы (в том числе операторы tsquery) отбрасываются
+WORD = re.compile(r'[^\W_]+')
+# Максимум слов в запросе
+MAX_WORDS = 10
+# Сколько совпадений ранжируется: ранг считается по tsvector каждой строки,
+# и у частого слова ранжирование всех совпадений заняло бы сотни миллисекунд
+SEARCH_CANDIDATES = 1000
+
+
+def search_query(text):
+    """tsquery, в котором каждое слово может быть началом слова: 'отч 202' -> 'отч:* & 202:*'"""
+    words = WORD.findall(text)[:MAX_WORDS]
+    if not words:
+        return None
+    return SearchQuery(' & '.join(f"{word}:*" for word in words), search_type='raw', config=SEARCH_CONFIG)
+
+
+def search_files(queryset, text):
+    """Файлы, подходящие под запрос, отсортированные по релевантности"""
+    text = text.strip()
+    query = search_query(text)
+    if query is None:
+        return queryset.none()
+    vector = file_search_vector()
+    candidates = (
+        queryset
+        .annotate(search=vector)
+        .filter(Q(search=query) | Q(original_name__trigram_word_similar=text))
+        # Сортировка по выражению, а не по первичному ключу: совпадения по-прежнему
+        # ищутся по GIN-индексам, а из них берутся SEARCH_CANDIDATES с самыми похожими именами
+        .order_by(TrigramWordSimilarity(text, 'original_name').desc(), '-pk')
+        .values('pk')[:SEARCH_CANDIDATES]
+    )
+    return (
+        queryset
+        .filter(pk__in=candidates)
+        # Полнотекстовое совпадение весит больше, похожесть имени поднимает опечатки
+        .annotate(rank=SearchRank(vector, query) + TrigramWordSimilarity(text, 'original_name'))
+        .order_by(F('rank').desc(), '-id')
+    )
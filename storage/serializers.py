@@ -1,8 +1,7 @@
 from rest_framework import serializers
-from .models import CustomUser, File, FileToken
-from django.utils.timezone import now
-from django.conf import settings
-from pathlib import Path
+from .models import CustomUser, File, FileToken, Job, UploadSession
+from .thumbnails import can_preview
+from .uploads import store_file
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 
 
@@ -20,14 +19,24 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ['id', 'username', 'email', 'full_name', 'is_admin']
 
 
+class CurrentUserSerializer(UserSerializer):
+    """Текущий пользователь (/api/auth/me/): объём его файлов и действующая квота (null - без ограничения)"""
+    total_bytes = serializers.IntegerField(read_only=True)
+    quota = serializers.IntegerField(read_only=True)
+
+    class Meta(UserSerializer.Meta):
+        fields = UserSerializer.Meta.fields + ['total_bytes', 'quota']
+
+
 class AdminUserSerializer(serializers.ModelSerializer):
     """Сериализатор пользователя для админов с информацией о файлах"""
-    file_count = serializers.IntegerField()
-    total_file_size = serializers.IntegerField()
+    total_file_size = serializers.IntegerField(source='total_bytes', read_only=True)
+    quota = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = CustomUser
-        fields = ['id', 'username', 'email', 'full_name', 'is_admin', 'file_count', 'total_file_size']
+        fields = ['id', 'username', 'email', 'full_name', 'is_admin', 'file_count', 'total_file_size',
+                  'quota_bytes', 'quota']
 
 
 class RegisterSerializer(serializers.ModelSerializer):
@@ -50,13 +59,42 @@ class RegisterSerializer(serializers.ModelSerializer):
         return user
 
 
+class JobSerializer(serializers.ModelSerializer):
+    """Состояние фоновой обработки файла"""
+
+    class Meta:
+        model = Job
+        fields = ['id', 'kind', 'status', 'attempts', 'max_attempts', 'run_at', 'finished_at', 'last_error']
+
+
 class FileSerializer(serializers.ModelSerializer):
     file = serializers.FileField(write_only=True, required=True)
+    jobs = JobSerializer(many=True, read_only=True)
+    processing_status = serializers.SerializerMethodField()
+    thumbnail_url = serializers.SerializerMethodField()
+    # SHA-256 содержимого, посчитанный при загрузке (null у файлов старой раскладки)
+    sha256 = serializers.CharField(source='digest', read_only=True)
 
     class Meta:
         model = File
-        fields = ['id', 'file', 'original_name', 'unique_name', 'size', 'uploaded_at', 'last_downloaded', 'comment']
-        read_only_fields = ['original_name', 'unique_name', 'size', 'uploaded_at', 'last_downloaded']
+        fields = ['id', 'file', 'original_name', 'unique_name', 'size', 'uploaded_at', 'last_downloaded', 'comment',
+                  'content_type', 'processing_status', 'jobs', 'thumbnail_url', 'sha256']
+        read_only_fields = ['original_name', 'unique_name', 'size', 'uploaded_at', 'last_downloaded', 'content_type']
+
+    def get_processing_status(self, obj):
+        """Сводный статус обработки: failed, если хоть одна задача упала, pending/running - пока не закончены"""
+        statuses = {job.status for job in obj.jobs.all()}
+        for status in (Job.FAILED, Job.RUNNING, Job.PENDING):
+            if status in statuses:
+                return status
+        return Job.DONE
+
+    def get_thumbnail_url(self, obj):
+        """Адрес миниатюры или None, если для файла её не бывает (размер превью - ?size=preview)"""
+        request = self.context.get('request')
+        if request is None or not can_preview(obj):
+            return None
+        return request.build_absolute_uri(f"/api/files/{obj.pk}/thumbnail/")
 
     def create(self, validated_data):
         # Получаем загружаемый файл
@@ -67,27 +105,36 @@ class FileSerializer(serializers.ModelSerializer):
         if not request or not request.user or not request.user.is_authenticated:
             raise serializers.ValidationError("Необходимо указать пользователя.")
 
-        # Генерация пути пользователя
-        user_folder = Path(f"user_{request.user.id}")
-        unique_name = user_folder / f"{now().timestamp()}_{uploaded_file.name}"
-        file_path = Path(settings.MEDIA_ROOT) / unique_name
-
-        # Сохраняем файл на сервере
-        file_path.parent.mkdir(parents=True, exist_ok=True)  # Создаем папку, если её нет
-        with open(file_path, 'wb') as destination:
-            for chunk in uploaded_file.chunks():
-                destination.write(chunk)
-
-        # Заполняет поля модели
-        return File.objects.create(
-            user=request.user,
-            original_name=uploaded_file.name,
-            unique_name=str(unique_name).replace("\\", "/"),  # Преобразуем путь
-            size=uploaded_file.size,
+        # Сохраняем содержимое в хранилище блобов (одинаковые байты хранятся один раз)
+        return store_file(
+            request.user,
+            uploaded_file.chunks(),
+            uploaded_file.name,
             **validated_data
         )
 
 
+class BulkFileIdsSerializer(serializers.Serializer):
+    """Список id файлов для пакетной операции"""
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=10000)
+
+
+class BulkFileChangeSerializer(serializers.Serializer):
+    """Изменение одного файла в пакете: новое имя и/или комментарий"""
+    id = serializers.IntegerField(min_value=1)
+    original_name = serializers.CharField(max_length=350, required=False)
+    comment = serializers.CharField(required=False, allow_blank=True)
+
+    def validate(self, attrs):
+        if 'original_name' not in attrs and 'comment' not in attrs:
+            raise serializers.ValidationError("Укажите original_name или comment.")
+        return attrs
+
+
+class BulkFileUpdateSerializer(serializers.Serializer):
+    files = serializers.ListField(child=BulkFileChangeSerializer(), allow_empty=False, max_length=10000)
+
+
 class FileTokenSerializer(serializers.ModelSerializer):
     download_url = serializers.SerializerMethodField()
 
@@ -102,3 +149,10 @@ class FileTokenSerializer(serializers.ModelSerializer):
         return None
 
 
+class UploadSessionSerializer(serializers.ModelSerializer):
+    """Сессия возобновляемой загрузки: клиент передаёт имя, полный размер и комментарий"""
+
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'original_name', 'size', 'offset', 'comment', 'expires_at']
+        read_only_fields = ['id', 'offset', 'expires_at']
@@ -0,0 +1,74 @@
+from contextlib import contextmanager
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+import threading
+from . import blobs, caching, tokens
+from .models import CustomUser, File
+from .usage import add_usage
+
+
+# Флаг пакетного удаления для текущего потока (см. batch_accounting)
+_batch = threading.local()
+
+
+@contextmanager
+def batch_accounting():
+    """
+    Внутри блока удаление File не трогает блобы, счётчики и кэш временных
+    ссылок по одной строке: вызывающий код (bulk.delete_files) обновляет
+    их разом.
+    """
+    _batch.active = True
+    try:
+        yield
+    finally:
+        _batch.active = False
+
+
+def deleted_with_owner(instance, origin):
+    """Файл удаляется каскадом вместе с владельцем - его счётчики обновлять незачем"""
+    if isinstance(origin, CustomUser):
+        return origin.pk == instance.user_id
+    return isinstance(origin, QuerySet) and origin.model is CustomUser
+
+
+@receiver(post_save, sender=File)
+def count_uploaded_file(sender, instance, created, **kwargs):
+    """Учитывает новый файл в счётчиках пользователя в той же транзакции, что и вставку"""
+    if created:
+        add_usage(instance.user_id, 1, instance.size)
+    else:
+        caching.invalidate_files([instance.user_id])
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def forget_cached_user(sender, instance, **kwargs):
+    """Профиль из кэша не должен пережить смену пароля, блокировку или удаление"""
+    caching.invalidate_user(instance.pk)
+
+
+@receiver(post_save, sender=File)
+def forget_renamed_file_tokens(sender, instance, created, update_fields=None, **kwargs):
+    """Временные ссылки на переименованный или перенесённый файл должны отдавать его под новым именем и путём"""
+    if not created and (update_fields is None or {'original_name', 'unique_name'} & set(update_fields)):
+        tokens.forget([instance.pk])
+
+
+@receiver(pre_delete, sender=File)
+def forget_deleted_file_tokens(sender, instance, **kwargs):
+    """Убирает из кэша временные ссылки на файл, пока токены ещё не удалены каскадом"""
+    if not getattr(_batch, 'active', False):
+        tokens.forget([instance.pk])
+
+
+@receiver(post_delete, sender=File)
+def release_deleted_file(sender, instance, origin=None, **kwargs):
+    """Освобождает содержимое удалённого файла (в том числе при каскадном удалении) и уменьшает счётчики"""
+    if getattr(_batch, 'active', False):
+        return
+    if instance.blob_id:
+        blobs.release(instance.blob_id)
+    if not deleted_with_owner(instance, origin):
+        add_usage(instance.user_id, -1, -instance.size)
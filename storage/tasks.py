@@ -0,0 +1,127 @@
+"""
+Обработчики фоновых задач (см. jobs.py).
+
+Всё, что не нужно клиенту в ответе на загрузку, выполняется здесь,
+вне запроса: ответ на загрузку зависит только от передачи байтов.
+"""
+from django.conf import settings
+import mimetypes
+from . import blobs, caching, compression, jobs, thumbnails, tokens
+from .backends import get_storage
+from .models import File
+
+
+# Обработчики, которые задача file.process выполняет для каждого загруженного файла.
+# Каждый получает File и сам сохраняет то, что вычислил
+FILE_PROCESSORS = []
+
+# Сигнатуры в начале файла, по которым определяется тип содержимого
+SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'%PDF-', 'application/pdf'),
+    (b'PK\x03\x04', 'application/zip'),
+    (b'\x1f\x8b', 'application/gzip'),
+    (b'7z\xbc\xaf\x27\x1c', 'application/x-7z-compressed'),
+    (b'ID3', 'audio/mpeg'),
+    (b'OggS', 'audio/ogg'),
+    (b'fLaC', 'audio/flac'),
+    (b'\x1aE\xdf\xa3', 'video/webm'),
+]
+SNIFF_SIZE = 16
+
+
+def file_processor(func):
+    FILE_PROCESSORS.append(func)
+    return func
+
+
+def enqueue_processing(file_instance):
+    """Ставит загруженный файл в очередь на обработку (в транзакции создания File)"""
+    if FILE_PROCESSORS:
+        jobs.enqueue('file.process', file=file_instance)
+
+
+def enqueue_processing_many(files):
+    """То же для файлов, созданных одним bulk_create"""
+    if FILE_PROCESSORS:
+        jobs.enqueue_many('file.process', files=files)
+
+
+@jobs.handler('file.process')
+def process_file(job):
+    for processor in FILE_PROCESSORS:
+        processor(job.file)
+
+
+@jobs.handler('blob.collect')
+def collect_blob(job):
+    blobs.collect(job.payload['blob_id'])
+
+
+@jobs.handler('blob.drop_plain')
+def drop_plain_blob(job):
+    blobs.drop_plain(job.payload['blob_id'])
+
+
+@jobs.handler('legacy.remove')
+def remove_legacy_file(job):
+    """Удаляет файл старой раскладки после переноса в блоб (uploads.adopt_legacy_file)"""
+    name = job.payload['name']
+    if not File.objects.filter(unique_name=name).exists():
+        get_storage().delete(name)
+
+
+@jobs.handler('derivatives.evict')
+def evict_derivatives(job):
+    thumbnails.evict()
+
+
+def sniff_content_type(head):
+    """Тип по первым байтам файла или None"""
+    for signature, content_type in SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head[4:8] == b'ftyp':
+        return 'video/mp4'
+    return None
+
+
+@file_processor
+def detect_content_type(file_instance):
+    """Определяет тип по содержимому, а не только по расширению, которое задал клиент"""
+    with compression.open_content(file_instance.unique_name) as source:
+        sniffed = sniff_content_type(source.read(SNIFF_SIZE))
+    guessed = mimetypes.guess_type(file_instance.original_name)[0]
+    # docx, xlsx, odt и т. п. - это zip-архивы; для них расширение точнее
+    if sniffed is None or (sniffed == 'application/zip' and guessed):
+        content_type = guessed or 'application/octet-stream'
+    else:
+        content_type = sniffed
+    file_instance.content_type = content_type
+    File.objects.filter(pk=file_instance.pk).update(content_type=content_type)
+    tokens.forget([file_instance.pk])
+    caching.invalidate_files([file_instance.user_id])
+
+
+@file_processor
+def pregenerate_thumbnail(file_instance):
+    """Строит миниатюру заранее, чтобы список файлов открывался без ожидания"""
+    if not thumbnails.can_preview(file_instance):
+        return
+    try:
+        thumbnails.get_or_create(file_instance, 'thumb')
+    except thumbnails.PreviewUnavailable:
+        # Повреждённое или неподдерживаемое изображение - повтор не поможет
+        pass
+
+
+@file_processor
+def compress_content(file_instance):
+    """Сжимает содержимое в хранилище, если включено STORAGE_COMPRESSION и это того стоит"""
+    if settings.STORAGE_COMPRESSION and file_instance.blob_id is not None:
+        blobs.compress(file_instance.blob_id)
@@ -1,3 +1,1526 @@
-from django.test import TestCase
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.db.utils import ConnectionHandler
+from django.http import FileResponse
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.timezone import timedelta
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from pathlib import Path
+import gzip
+import io
+import itertools
+import json
+import os
+import runpy
+import shutil
+import tempfile
+import threading
+import zipfile
+from unittest import mock, skipUnless
+from uuid import uuid4
+from . import archives, async_views, blobs, compression, jobs, quotas, search, thumbnails, tokens, uploads
+from .asgi import UploadPrecheck
+from .backends import S3Storage, get_storage
+from .downloads import MAX_RANGES, parse_range_header
+from .management.commands import scrub_blobs
+from .models import Blob, CustomUser, Derivative, File, FileToken, Job, StorageReservation, UploadSession
+from .usage import actual_usage
 
-# Create your tests here.
+
+# S3 проверяется на moto; boto3 и moto - необязательные зависимости
+try:
+    import boto3
+    from moto import mock_aws
+except ImportError:
+    boto3 = mock_aws = None
+
+# Встроенный пул соединений Django работает только с psycopg 3 и psycopg_pool
+try:
+    import psycopg_pool
+except ImportError:
+    psycopg_pool = None
+
+
+class StorageTestCase(TestCase):
+    """Файлы тестов пишутся во временный каталог, который удаляется после класса"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_settings = override_settings(
+            MEDIA_ROOT=cls.media_root,
+            UPLOAD_STAGING_ROOT=f'{cls.media_root}/.staging',
+            STORAGE_TEMP_ROOT=f'{cls.media_root}/blobs/tmp',
+        )
+        cls.media_settings.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.media_settings.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='owner', email='owner@example.com', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, content, name='file.bin'):
+        response = self.client.post('/api/files/', {'file': SimpleUploadedFile(name, content)}, format='multipart')
+        self.assertEqual(response.status_code, 201, response.content)
+        return File.objects.get(pk=response.data['id'])
+
+    def counters(self):
+        return CustomUser.objects.values_list('file_count', 'total_bytes').get(pk=self.user.pk)
+
+
+class UsageCounterTests(StorageTestCase):
+    def test_password_reset_after_upload_keeps_counters(self):
+        stale = CustomUser.objects.get(pk=self.user.pk)
+        self.upload(b'x' * 100)
+        self.upload(b'y' * 3)
+
+        stale.set_password('another')
+        stale.save()
+        response = APIClient().post('/api/auth/reset-password/', {'username': 'owner', 'new_password': 'new-secret'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.counters(), (2, 103))
+
+    def test_delete_after_drift_does_not_fail(self):
+        file_instance = self.upload(b'x' * 100)
+        CustomUser.objects.filter(pk=self.user.pk).update(file_count=0, total_bytes=0)
+
+        response = self.client.delete(f'/api/files/{file_instance.pk}/')
+
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.counters(), (0, 0))
+
+
+class QuotaTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user.quota_bytes = 1000
+        self.user.save()
+
+    def post_file(self, size):
+        return self.client.post('/api/files/', {'file': SimpleUploadedFile('file.bin', b'x' * size)},
+                                format='multipart')
+
+    def test_upload_within_quota_releases_reservation(self):
+        self.assertEqual(self.post_file(500).status_code, 201)
+        self.assertFalse(StorageReservation.objects.exists())
+        self.assertEqual(self.counters(), (1, 500))
+
+    def test_upload_over_quota_rejected(self):
+        self.upload(b'x' * 500)
+        response = self.post_file(600)
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(File.objects.count(), 1)
+        self.assertFalse(StorageReservation.objects.exists())
+
+    def test_live_reservation_occupies_quota(self):
+        reservation = quotas.reserve(self.user, 800)
+        self.assertEqual(self.post_file(100).status_code, 413)
+        quotas.release(reservation)
+        self.assertEqual(self.post_file(100).status_code, 201)
+
+    def test_upload_session_occupies_quota_until_aborted(self):
+        response = self.client.post('/api/files/uploads/', {'original_name': 'big.bin', 'size': 900}, format='json')
+        self.assertEqual(response.status_code, 201)
+        second = self.client.post('/api/files/uploads/', {'original_name': 'more.bin', 'size': 200}, format='json')
+        self.assertEqual(second.status_code, 413)
+
+        self.client.delete(f"/api/files/uploads/{response.data['id']}/")
+        self.assertEqual(self.post_file(500).status_code, 201)
+
+    def test_no_lock_or_reservation_without_quota(self):
+        self.user.quota_bytes = None
+        self.user.save()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.post_file(5000).status_code, 201)
+        sql = [query['sql'] for query in queries.captured_queries]
+        self.assertFalse([line for line in sql if '"CustomUser"' in line and 'FOR UPDATE' in line])
+        self.assertFalse([line for line in sql if 'storagereservation' in line.lower()])
+        self.assertIsNone(quotas.reserve(self.user, 10 ** 12))
+
+
+class BlobRefCountTests(StorageTestCase):
+    def test_same_bytes_share_one_blob(self):
+        first = self.upload(b'same bytes', 'a.txt')
+        second = self.upload(b'same bytes', 'b.txt')
+        self.assertEqual(first.blob_id, second.blob_id)
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+
+    def test_duplicates_in_one_request_counted(self):
+        files = [SimpleUploadedFile(name, b'same bytes') for name in ('a.txt', 'b.txt', 'c.txt')]
+        response = self.client.post('/api/files/bulk-upload/', {'files': files}, format='multipart')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(Blob.objects.get().ref_count, 3)
+        self.assertEqual(self.counters(), (3, 30))
+
+    def test_last_delete_collects_blob(self):
+        first = self.upload(b'same bytes', 'a.txt')
+        second = self.upload(b'same bytes', 'b.txt')
+        name = first.unique_name
+
+        self.client.delete(f'/api/files/{first.pk}/')
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+        self.assertFalse(Job.objects.filter(kind='blob.collect').exists())
+
+        self.client.delete(f'/api/files/{second.pk}/')
+        job = Job.objects.get(kind='blob.collect')
+        jobs.run(job)
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(get_storage().exists(name))
+
+    def test_collect_repairs_drifted_counter(self):
+        file_instance = self.upload(b'same bytes')
+        Blob.objects.update(ref_count=0)
+        blobs.collect(file_instance.blob_id)
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+        self.assertTrue(get_storage().exists(file_instance.unique_name))
+
+    def test_rollback_after_acquire_removes_new_blob_file(self):
+        temp_path, digest, size = blobs.write_temp([b'new bytes'])
+        name = Blob(digest=digest).name
+        with mock.patch.object(uploads.tasks, 'enqueue_processing', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                uploads.create_file(self.user, temp_path, digest, size, 'new.txt')
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(get_storage().exists(name))
+
+    def test_rollback_keeps_existing_blob_file(self):
+        existing = self.upload(b'same bytes')
+        temp_path, digest, size = blobs.write_temp([b'same bytes'])
+        with mock.patch.object(uploads.tasks, 'enqueue_processing', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                uploads.create_file(self.user, temp_path, digest, size, 'copy.txt')
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+        self.assertTrue(get_storage().exists(existing.unique_name))
+
+
+class ChunkedUploadTests(StorageTestCase):
+    def start(self, size):
+        response = self.client.post('/api/files/uploads/', {'original_name': 'big.bin', 'size': size}, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return UploadSession.objects.get(pk=response.data['id'])
+
+    def put_chunk(self, session, offset, data):
+        return self.client.put(f'/api/files/uploads/{session.pk}/', data, content_type='application/octet-stream',
+                               HTTP_UPLOAD_OFFSET=str(offset))
+
+    def test_file_assembled_from_chunks(self):
+        session = self.start(10)
+        self.assertEqual(self.put_chunk(session, 0, b'hello').data['offset'], 5)
+        self.assertEqual(self.put_chunk(session, 0, b'hello').status_code, 409)
+        self.assertEqual(self.put_chunk(session, 5, b'world').data['offset'], 10)
+
+        response = self.client.post(f'/api/files/uploads/{session.pk}/complete/')
+
+        self.assertEqual(response.status_code, 201, response.content)
+        file_instance = File.objects.get(pk=response.data['id'])
+        self.assertEqual(b''.join(compression.open_content(file_instance.unique_name)), b'helloworld')
+
+    def test_session_deleted_during_write(self):
+        session = self.start(10)
+
+        class Stream(io.BytesIO):
+            def read(self, size=-1):
+                uploads.discard_session(UploadSession.objects.get(pk=session.pk))
+                return super().read(size)
+
+        with self.assertRaises(uploads.SessionGone):
+            uploads.append_chunk(session, Stream(b'hello'), 0, 5)
+
+    def test_chunk_for_discarded_staging_file_is_not_found(self):
+        session = self.start(10)
+        uploads.staging_path(session).unlink()
+        self.assertEqual(self.put_chunk(session, 0, b'hello').status_code, 404)
+
+    def test_complete_without_staging_file_is_not_found(self):
+        session = self.start(5)
+        self.put_chunk(session, 0, b'hello')
+        uploads.staging_path(session).unlink()
+        response = self.client.post(f'/api/files/uploads/{session.pk}/complete/')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_failed_complete_releases_session(self):
+        session = self.start(5)
+        self.put_chunk(session, 0, b'hello')
+        with mock.patch.object(uploads.blobs, 'acquire', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.post(f'/api/files/uploads/{session.pk}/complete/')
+        self.assertIsNone(UploadSession.objects.get(pk=session.pk).locked_until)
+
+        # Повтор не ждёт CHUNK_LOCK_TIMEOUT
+        response = self.client.post(f'/api/files/uploads/{session.pk}/complete/')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertFalse(UploadSession.objects.exists())
+
+
+class UploadPrecheckTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user.quota_bytes = 1000
+        self.user.save()
+        self.passed = False
+
+    async def application(self, scope, receive, send):
+        self.passed = True
+
+    async def post(self, content_length, token=True):
+        headers = [(b'content-length', content_length)] if content_length is not None else []
+        if token:
+            headers.append((b'authorization', f'Bearer {AccessToken.for_user(self.user)}'.encode()))
+        scope = {'type': 'http', 'method': 'POST', 'path': '/api/async/files/', 'headers': headers}
+        sent = []
+
+        async def receive():
+            raise AssertionError("Тело запроса не должно читаться")
+
+        async def send(message):
+            sent.append(message)
+
+        await UploadPrecheck(self.application)(scope, receive, send)
+        return sent[0]['status'] if sent else None
+
+    async def test_upload_over_quota_rejected_before_body(self):
+        self.assertEqual(await self.post(b'1001'), 413)
+        self.assertFalse(self.passed)
+
+    async def test_upload_without_length_or_token_rejected(self):
+        self.assertEqual(await self.post(None), 411)
+        self.assertEqual(await self.post(b'10', token=False), 401)
+        self.assertFalse(self.passed)
+
+    async def test_upload_within_quota_passed_to_application(self):
+        self.assertIsNone(await self.post(b'1000'))
+        self.assertTrue(self.passed)
+
+    def test_body_read_up_to_content_length(self):
+        # Под ASGI поток тела не обрезается по Content-Length, как LimitedStream под WSGI
+        self.assertEqual(b''.join(async_views.body_chunks(io.BytesIO(b'hello'), 4)), b'hell')
+
+
+class MetricsAccessTests(TestCase):
+    def test_local_request_is_allowed(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    def test_client_behind_local_proxy_is_forbidden(self):
+        response = self.client.get('/metrics', HTTP_X_FORWARDED_FOR='203.0.113.7')
+        self.assertEqual(response.status_code, 403)
+
+    def test_forged_forwarded_header_is_ignored(self):
+        # Клиент сам дописал 127.0.0.1; nginx добавил справа его настоящий адрес
+        response = self.client.get('/metrics', HTTP_X_FORWARDED_FOR='127.0.0.1, 203.0.113.7')
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(TRUSTED_PROXIES=[])
+    def test_forwarded_header_without_trusted_proxy_is_ignored(self):
+        response = self.client.get('/metrics', REMOTE_ADDR='203.0.113.7', HTTP_X_FORWARDED_FOR='127.0.0.1')
+        self.assertEqual(response.status_code, 403)
+
+
+class DeliveryTests(StorageTestCase):
+    def download(self, file_instance):
+        response = self.client.get(f'/api/files/{file_instance.pk}/download/')
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_django_streams_file(self):
+        response = self.download(self.upload(b'hello world'))
+        self.assertIsInstance(response, FileResponse)
+        self.assertNotIn('X-Accel-Redirect', response)
+        self.assertEqual(b''.join(response.streaming_content), b'hello world')
+
+    @override_settings(FILE_DELIVERY_BACKEND='nginx')
+    def test_nginx_gets_internal_location(self):
+        file_instance = self.upload(b'hello world')
+        response = self.download(file_instance)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{file_instance.unique_name}')
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['Repr-Digest'].split('=', 1)[0], 'sha-256')
+
+    @override_settings(FILE_DELIVERY_BACKEND='sendfile')
+    def test_sendfile_gets_absolute_path(self):
+        file_instance = self.upload(b'hello world')
+        response = self.download(file_instance)
+        self.assertEqual(response['X-Sendfile'], f'{self.media_root}/{file_instance.unique_name}')
+        self.assertEqual(response.content, b'')
+
+    @override_settings(FILE_DELIVERY_BACKEND='nginx', TEMP_LINK_MODE='signed')
+    def test_range_through_token_is_served_by_django(self):
+        # Диапазон из ссылки nginx не увидел бы в запросе клиента
+        file_instance = self.upload(b'hello world')
+        token = self.client.post(f'/api/files/{file_instance.pk}/generate-token/', {'range': '0-4'},
+                                 format='json').data['token']
+        response = APIClient().get(f'/api/files/download-temp/{token}/')
+        self.assertNotIn('X-Accel-Redirect', response)
+        self.assertEqual(b''.join(response.streaming_content), b'hello')
+
+    def test_sharded_internal_url_names_volume(self):
+        with override_settings(STORAGE_BACKEND='sharded',
+                               STORAGE_VOLUMES=f'{self.media_root}/disk0:1,{self.media_root}/disk1:1'):
+            storage = get_storage()
+            name = 'blobs/00/00/sample'
+            target = storage.storage.candidates(name)[0]
+            source = Path(storage.temp_dir()) / 'sample.tmp'
+            source.write_bytes(b'hello')
+            storage.save(name, source)
+
+            self.assertEqual(storage.internal_url(name), f'/protected-media/{target[2]}/{name}')
+            self.assertEqual(storage.path(name), Path(f'{self.media_root}/disk{target[2]}/{name}'))
+            self.assertIsNone(storage.internal_url('blobs/00/00/missing'))
+
+
+@override_settings(TEMP_LINK_MODE='signed')
+class SignedLinkTests(StorageTestCase):
+    def link(self, file_instance, forwarded_for, **scope):
+        response = self.client.post(f'/api/files/{file_instance.pk}/generate-token/', scope, format='json',
+                                    HTTP_X_FORWARDED_FOR=forwarded_for)
+        self.assertEqual(response.status_code, 201, response.content)
+        return f"/api/files/download-temp/{response.data['token']}/"
+
+    def test_link_downloads_file_without_authentication(self):
+        url = self.link(self.upload(b'hello world'), '198.51.100.1')
+        response = APIClient().get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'hello world')
+
+    def test_link_bound_to_client_behind_proxy(self):
+        url = self.link(self.upload(b'hello world'), '198.51.100.1', bind_ip=True)
+        self.assertEqual(APIClient().get(url, HTTP_X_FORWARDED_FOR='198.51.100.1').status_code, 200)
+        self.assertEqual(APIClient().get(url, HTTP_X_FORWARDED_FOR='198.51.100.2').status_code, 403)
+
+    def test_link_limited_to_byte_range(self):
+        url = self.link(self.upload(b'hello world'), '198.51.100.1', range='0-4')
+        response = APIClient().get(url)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'hello')
+
+    def test_tampered_link_is_rejected(self):
+        url = self.link(self.upload(b'hello world'), '198.51.100.1')
+        self.assertEqual(APIClient().get(url[:-3] + ('A/' if url[-3] != 'A' else 'B/')).status_code, 404)
+
+
+@override_settings(STORAGE_COMPRESSION='gzip')
+class CompressionTests(StorageTestCase):
+    text = b''.join(b'%d;report line;status=ok\n' % i for i in range(20000))
+
+    def compressed_upload(self):
+        file_instance = self.upload(self.text, 'export.csv')
+        self.assertTrue(blobs.compress(file_instance.blob_id))
+        file_instance.refresh_from_db()
+        return file_instance
+
+    def test_compressible_file_is_stored_compressed(self):
+        file_instance = self.compressed_upload()
+        blob = file_instance.blob
+        self.assertEqual(blob.encoding, 'gzip')
+        self.assertTrue(file_instance.unique_name.endswith('.gz'))
+        self.assertLess(blob.stored_size, blob.size // 5)
+        # Квоты и счётчики - по исходному размеру
+        self.assertEqual(blob.size, len(self.text))
+        self.assertEqual(self.counters(), (1, len(self.text)))
+
+    def test_incompressible_file_is_left_as_is(self):
+        file_instance = self.upload(os.urandom(64 * 1024))
+        self.assertFalse(blobs.compress(file_instance.blob_id))
+        file_instance.blob.refresh_from_db()
+        self.assertEqual(file_instance.blob.encoding, '')
+
+    def test_download_is_decompressed(self):
+        file_instance = self.compressed_upload()
+        response = self.client.get(f'/api/files/{file_instance.pk}/download/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(int(response['Content-Length']), len(self.text))
+        self.assertEqual(b''.join(response.streaming_content), self.text)
+
+    def test_range_applies_to_decompressed_content(self):
+        file_instance = self.compressed_upload()
+        response = self.client.get(f'/api/files/{file_instance.pk}/download/', HTTP_RANGE='bytes=100000-100099',
+                                   HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.text[100000:100100])
+
+    def test_client_accepting_gzip_gets_stored_bytes(self):
+        file_instance = self.compressed_upload()
+        response = self.client.get(f'/api/files/{file_instance.pk}/download/', HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), self.text)
+
+    def test_scrubber_reads_compressed_blob(self):
+        self.compressed_upload()
+        call_command('scrub_blobs', stdout=io.StringIO())
+        self.assertFalse(Blob.objects.get().corrupt)
+
+
+class SearchTests(StorageTestCase):
+    def add_files(self, names):
+        File.objects.bulk_create(
+            [File(user=self.user, original_name=name, unique_name=f'user_{self.user.pk}/{name}', size=1)
+             for name in names]
+        )
+
+    def search(self, text):
+        response = self.client.get('/api/files/search/', {'q': text})
+        self.assertEqual(response.status_code, 200, response.content)
+        return [item['original_name'] for item in response.data['results']]
+
+    def test_finds_word_forms_and_typos(self):
+        self.add_files(['Годовой отчёт.pdf', 'photo.jpg', 'invoice_2024.xlsx'])
+        self.assertEqual(self.search('отчёты'), ['Годовой отчёт.pdf'])
+        self.assertEqual(self.search('invoise'), ['invoice_2024.xlsx'])
+
+    def test_exact_name_ranks_first_among_many_matches(self):
+        self.add_files([f'quarterly report draft {i}.docx' for i in range(search.SEARCH_CANDIDATES + 50)])
+        self.add_files(['report'])
+        self.assertEqual(self.search('report')[0], 'report')
+
+
+class RangeHeaderTests(TestCase):
+    def test_single_suffix_and_open_ranges(self):
+        self.assertEqual(parse_range_header('bytes=0-99', 1000), [(0, 99)])
+        self.assertEqual(parse_range_header('bytes=-50', 1000), [(950, 999)])
+        self.assertEqual(parse_range_header('bytes=900-', 1000), [(900, 999)])
+        self.assertEqual(parse_range_header('bytes=990-2000', 1000), [(990, 999)])
+
+    def test_overlapping_ranges_are_merged(self):
+        self.assertEqual(parse_range_header('bytes=500-599,0-99,50-150,151-160', 1000), [(0, 160), (500, 599)])
+
+    def test_invalid_header_means_whole_file(self):
+        for header in (None, '', 'items=0-1', 'bytes=5-1', 'bytes=abc', 'bytes=' + ',0-1' * (MAX_RANGES + 1)):
+            self.assertIsNone(parse_range_header(header, 1000), header)
+
+    def test_unsatisfiable_ranges(self):
+        self.assertEqual(parse_range_header('bytes=1000-', 1000), [])
+        self.assertEqual(parse_range_header('bytes=-0', 1000), [])
+        for header in ('bytes=0-0', 'bytes=-10', 'bytes=0-'):
+            self.assertEqual(parse_range_header(header, 0), [], header)
+
+
+class RangeDownloadTests(StorageTestCase):
+    def test_single_range(self):
+        file_instance = self.upload(b'0123456789')
+        response = self.client.get(f'/api/files/{file_instance.pk}/download/', HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(b''.join(response.streaming_content), b'2345')
+
+    def test_multiple_ranges(self):
+        file_instance = self.upload(b'0123456789')
+        response = self.client.get(f'/api/files/{file_instance.pk}/download/', HTTP_RANGE='bytes=0-1,8-9')
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response['Content-Type'].startswith('multipart/byteranges; boundary='))
+        body = b''.join(response.streaming_content)
+        self.assertIn(b'Content-Range: bytes 0-1/10\r\n\r\n01', body)
+        self.assertIn(b'Content-Range: bytes 8-9/10\r\n\r\n89', body)
+
+    def test_stale_if_range_returns_whole_file(self):
+        file_instance = self.upload(b'0123456789')
+        response = self.client.get(f'/api/files/{file_instance.pk}/download/', HTTP_RANGE='bytes=2-5',
+                                   HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_suffix_range_of_empty_file_is_unsatisfiable(self):
+        # Пустой файл через API не загрузить, кладём его в хранилище напрямую
+        name = f'user_{self.user.pk}/empty.txt'
+        os.makedirs(os.path.join(self.media_root, f'user_{self.user.pk}'))
+        open(os.path.join(self.media_root, name), 'wb').close()
+        file_instance = File.objects.create(user=self.user, original_name='empty.txt', unique_name=name, size=0)
+        response = self.client.get(f'/api/files/{file_instance.pk}/download/', HTTP_RANGE='bytes=-10')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */0')
+
+    def test_if_none_match_returns_not_modified(self):
+        file_instance = self.upload(b'0123456789')
+        etag = self.client.get(f'/api/files/{file_instance.pk}/download/')['ETag']
+        response = self.client.get(f'/api/files/{file_instance.pk}/download/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+
+@override_settings(METADATA_CACHE=True)
+class MetadataCacheTests(StorageTestCase):
+    """Кэш в памяти процесса тестов играет роль общего кэша"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def names(self):
+        response = self.client.get('/api/files/')
+        self.assertEqual(response.status_code, 200)
+        return [item['original_name'] for item in response.data['results']]
+
+    def change(self, method, *args, **kwargs):
+        # Версия пространства имён увеличивается после коммита
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)(*args, **kwargs)
+        self.assertLess(response.status_code, 300, response.content)
+        return response
+
+    def test_list_served_from_cache(self):
+        self.upload(b'hello', 'a.txt')
+        self.names()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names(), ['a.txt'])
+
+    def test_list_invalidated_by_upload_rename_and_delete(self):
+        self.assertEqual(self.names(), [])
+        file_id = self.change('post', '/api/files/', {'file': SimpleUploadedFile('a.txt', b'hello')},
+                              format='multipart').data['id']
+        self.assertEqual(self.names(), ['a.txt'])
+        self.change('patch', f'/api/files/{file_id}/rename/', {'original_name': 'b.txt'}, format='json')
+        self.assertEqual(self.names(), ['b.txt'])
+        self.change('delete', f'/api/files/{file_id}/')
+        self.assertEqual(self.names(), [])
+
+    def test_deactivated_user_not_authenticated_from_cache(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+        self.assertEqual(client.get('/api/auth/me/').status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(client.get('/api/auth/me/').status_code, 401)
+
+    @override_settings(METADATA_CACHE=False)
+    def test_nothing_cached_without_shared_cache(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+        self.assertEqual(client.get('/api/auth/me/').status_code, 200)
+        # Изменение мимо сигналов, как в другом процессе со своим кэшем
+        CustomUser.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(client.get('/api/auth/me/').status_code, 401)
+
+
+def png_bytes(size=(64, 48), color='red'):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class JobQueueTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.calls = []
+        jobs.HANDLERS['test.ok'] = self.calls.append
+        jobs.HANDLERS['test.fail'] = self.fail_job
+
+    def tearDown(self):
+        jobs.HANDLERS.pop('test.ok')
+        jobs.HANDLERS.pop('test.fail')
+        super().tearDown()
+
+    @staticmethod
+    def fail_job(job):
+        raise RuntimeError("сбой обработчика")
+
+    def test_claim_takes_earliest_ready_job(self):
+        later = jobs.enqueue('test.ok')
+        earlier = jobs.enqueue('test.ok')
+        Job.objects.filter(pk=earlier.pk).update(run_at=timezone.now() - timedelta(minutes=1))
+        jobs.enqueue('test.ok', delay=timedelta(hours=1))
+
+        first = jobs.claim()
+        self.assertEqual(first.pk, earlier.pk)
+        self.assertEqual((first.status, first.attempts), (Job.RUNNING, 1))
+        self.assertEqual(jobs.claim().pk, later.pk)
+        # Отложенная задача ещё не готова
+        self.assertIsNone(jobs.claim())
+
+    def test_successful_job_done(self):
+        job = jobs.enqueue('test.ok', value=1)
+        self.assertTrue(jobs.run(jobs.claim()))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.DONE)
+        self.assertIsNone(job.locked_until)
+        self.assertEqual(self.calls[0].payload, {'value': 1})
+
+    @override_settings(JOB_RETRY_DELAY_SECONDS=10, JOB_MAX_RETRY_DELAY_SECONDS=25)
+    def test_backoff_then_failed_after_max_attempts(self):
+        self.assertEqual([jobs.retry_delay(n).seconds for n in (1, 2, 3, 4)], [10, 20, 25, 25])
+
+        job = jobs.enqueue('test.fail')
+        Job.objects.filter(pk=job.pk).update(max_attempts=2)
+        started = timezone.now()
+        self.assertFalse(jobs.run(jobs.claim()))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.PENDING, 1))
+        self.assertIn("сбой обработчика", job.last_error)
+        self.assertGreaterEqual(job.run_at, started + timedelta(seconds=10))
+        self.assertIsNone(jobs.claim())
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        self.assertFalse(jobs.run(jobs.claim()))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        self.assertIsNotNone(job.finished_at)
+        self.assertIsNone(jobs.claim())
+
+    def test_requeue_stale_recovers_abandoned_job(self):
+        job = jobs.enqueue('test.ok')
+        jobs.claim()
+        self.assertEqual(jobs.requeue_stale(), 0)
+        # Воркер упал, аренда истекла
+        Job.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(jobs.requeue_stale(), 1)
+        claimed = jobs.claim()
+        self.assertEqual((claimed.pk, claimed.attempts), (job.pk, 2))
+
+    def test_purge_finished_keeps_recent_jobs(self):
+        old = jobs.enqueue('test.ok')
+        recent = jobs.enqueue('test.ok')
+        Job.objects.filter(pk=old.pk).update(status=Job.DONE, finished_at=timezone.now() - timedelta(days=30))
+        Job.objects.filter(pk=recent.pk).update(status=Job.DONE, finished_at=timezone.now())
+        self.assertEqual(jobs.purge_finished(), 1)
+        self.assertEqual(list(Job.objects.values_list('pk', flat=True)), [recent.pk])
+
+    def test_processing_enqueued_in_upload_transaction(self):
+        file_instance = self.upload(png_bytes(), 'picture.bin')
+        self.assertEqual(list(file_instance.jobs.values_list('kind', flat=True)), ['file.process'])
+
+        # Откат создания файла забирает с собой и задачу
+        temp_path, digest, size = blobs.write_temp([b'other bytes'])
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            uploads.create_file(self.user, temp_path, digest, size, 'other.txt')
+            raise RuntimeError()
+        temp_path.unlink(missing_ok=True)
+        self.assertEqual(Job.objects.filter(kind='file.process').count(), 1)
+
+    @override_settings(STORAGE_COMPRESSION='gzip')
+    def test_processors_detect_type_thumbnail_and_compress(self):
+        picture = self.upload(png_bytes(), 'picture.bin')
+        text = self.upload(b'line of text\n' * 1000, 'notes.log')
+        # Как run_jobs --once, но без close_old_connections, которое закрыло бы транзакцию теста
+        while (job := jobs.claim()) is not None:
+            self.assertTrue(jobs.run(job), job.last_error)
+
+        picture.refresh_from_db()
+        text.refresh_from_db()
+        self.assertEqual(picture.content_type, 'image/png')
+        self.assertTrue(Derivative.objects.filter(blob=picture.blob, kind='thumb').exists())
+        self.assertEqual(text.blob.encoding, 'gzip')
+
+
+class JobClaimLockingTests(TransactionTestCase):
+    def test_locked_job_skipped(self):
+        first = jobs.enqueue('test.locked')
+        second = jobs.enqueue('test.locked')
+        locked = threading.Event()
+        release = threading.Event()
+
+        def hold():
+            # Другой воркер держит блокировку строки первой задачи
+            try:
+                with transaction.atomic():
+                    Job.objects.select_for_update().get(pk=first.pk)
+                    locked.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        try:
+            self.assertTrue(locked.wait(10))
+            self.assertEqual(jobs.claim().pk, second.pk)
+            self.assertIsNone(jobs.claim())
+        finally:
+            release.set()
+            thread.join()
+        self.assertEqual(jobs.claim().pk, first.pk)
+
+
+class UserPrivacyTests(StorageTestCase):
+    def test_usage_visible_only_to_owner(self):
+        other = CustomUser.objects.create_user(username='other', email='other@example.com', password='secret')
+        self.upload(b'x' * 100)
+        # Клиент аутентифицирован этим же объектом, а счётчики обновлены в базе
+        self.user.refresh_from_db()
+
+        me = self.client.get('/api/auth/me/').data
+        self.assertEqual((me['total_bytes'], me['quota']), (100, None))
+
+        client = APIClient()
+        client.force_authenticate(other)
+        listed = client.get('/api/users/').data['results']
+        self.assertEqual({user['username'] for user in listed}, {'owner', 'other'})
+        for user in listed:
+            self.assertNotIn('total_bytes', user)
+            self.assertNotIn('quota', user)
+        self.assertNotIn('total_bytes', client.get(f'/api/users/{self.user.pk}/').data)
+
+
+@skipUnless(mock_aws, "нужны boto3 и moto")
+class S3StorageTests(TestCase):
+    def setUp(self):
+        self.enterContext(mock_aws())
+        self.temp_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_root, ignore_errors=True)
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket='mycloud')
+        self.storage = S3Storage('mycloud', prefix='files/', region='us-east-1', access_key='test',
+                                 secret_key='test', temp_root=self.temp_root)
+
+    def save(self, name, content):
+        source = Path(self.storage.temp_dir()) / 'upload.tmp'
+        source.write_bytes(content)
+        self.storage.save(name, source)
+        self.assertFalse(source.exists())
+
+    def test_round_trip(self):
+        content = os.urandom(3000)
+        self.save('blobs/ab/cd/sample', content)
+
+        self.assertTrue(self.storage.exists('blobs/ab/cd/sample'))
+        self.assertEqual(self.storage.stat('blobs/ab/cd/sample').st_size, 3000)
+        with self.storage.open('blobs/ab/cd/sample') as source:
+            self.assertEqual(source.read(), content)
+        self.assertIsNone(self.storage.path('blobs/ab/cd/sample'))
+        self.assertIsNone(self.storage.internal_url('blobs/ab/cd/sample'))
+
+        self.storage.delete('blobs/ab/cd/sample')
+        self.assertFalse(self.storage.exists('blobs/ab/cd/sample'))
+        with self.assertRaises(FileNotFoundError):
+            self.storage.stat('blobs/ab/cd/sample')
+        with self.assertRaises(FileNotFoundError):
+            self.storage.open('blobs/ab/cd/sample')
+
+    def test_key_has_prefix(self):
+        self.save('blobs/ab/cd/sample', b'hello')
+        keys = [item['Key'] for item in self.storage.client.list_objects_v2(Bucket='mycloud')['Contents']]
+        self.assertEqual(keys, ['files/blobs/ab/cd/sample'])
+
+    def test_ranged_reads(self):
+        content = bytes(range(256)) * 40
+        self.save('blobs/ab/cd/sample', content)
+        with self.storage.open('blobs/ab/cd/sample') as source:
+            source.seek(1000)
+            self.assertEqual(source.read(10), content[1000:1010])
+            source.seek(-5, io.SEEK_END)
+            self.assertEqual(source.read(), content[-5:])
+            source.seek(3)
+            self.assertEqual(source.read(4), content[3:7])
+            self.assertEqual(source.tell(), 7)
+            source.seek(len(content) + 10)
+            self.assertEqual(source.read(), b'')
+
+
+class LegacyFallbackTests(StorageTestCase):
+    def test_legacy_names_read_from_media_root(self):
+        legacy = Path(self.media_root) / f'user_{self.user.pk}' / 'old.txt'
+        legacy.parent.mkdir(parents=True)
+        legacy.write_bytes(b'old content')
+        volumes = f'{self.media_root}/disk0:1,{self.media_root}/disk1:1'
+        with override_settings(STORAGE_BACKEND='sharded', STORAGE_VOLUMES=volumes):
+            storage = get_storage()
+            name = f'user_{self.user.pk}/old.txt'
+            self.assertEqual(storage.stat(name).st_size, 11)
+            with storage.open(name) as source:
+                self.assertEqual(source.read(), b'old content')
+            self.assertEqual(storage.path(name), legacy)
+
+            # Новые файлы пишутся на тома
+            source = Path(storage.temp_dir()) / 'new.tmp'
+            source.write_bytes(b'new')
+            storage.save('blobs/00/00/new', source)
+            self.assertFalse((Path(self.media_root) / 'blobs/00/00/new').exists())
+            self.assertTrue(storage.exists('blobs/00/00/new'))
+
+
+class ThumbnailTests(StorageTestCase):
+    def process(self):
+        while (job := jobs.claim()) is not None:
+            self.assertTrue(jobs.run(job), job.last_error)
+
+    def thumbnail(self, file_instance, size='thumb', **headers):
+        return self.client.get(f'/api/files/{file_instance.pk}/thumbnail/', {'size': size}, **headers)
+
+    def test_job_builds_thumbnail(self):
+        file_instance = self.upload(png_bytes((800, 600)), 'photo.png')
+        self.process()
+        derivative = Derivative.objects.get(blob=file_instance.blob, kind='thumb')
+
+        response = self.thumbnail(file_instance)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertIn('immutable', response['Cache-Control'])
+        with Image.open(io.BytesIO(b''.join(response.streaming_content))) as image:
+            self.assertEqual(image.size, (256, 192))
+        self.assertEqual(derivative.size, get_storage().stat(derivative.name).st_size)
+
+    def test_stored_preview_served_without_rendering(self):
+        file_instance = self.upload(png_bytes((800, 600)), 'photo.png')
+        first = self.thumbnail(file_instance, size='preview')
+        self.assertEqual(first.status_code, 200)
+        with mock.patch.object(thumbnails, 'render') as render:
+            second = self.thumbnail(file_instance, size='preview')
+            cached = self.thumbnail(file_instance, size='preview', HTTP_IF_NONE_MATCH=first['ETag'])
+        render.assert_not_called()
+        self.assertEqual(b''.join(second.streaming_content), b''.join(first.streaming_content))
+        self.assertEqual(cached.status_code, 304)
+
+    def test_first_frame_of_animation(self):
+        buffer = io.BytesIO()
+        frames = [Image.new('RGB', (40, 40), color) for color in ('blue', 'red')]
+        frames[0].save(buffer, 'GIF', save_all=True, append_images=frames[1:])
+        file_instance = self.upload(buffer.getvalue(), 'anim.gif')
+        response = self.thumbnail(file_instance)
+        with Image.open(io.BytesIO(b''.join(response.streaming_content))) as image:
+            red, green, blue = image.convert('RGB').getpixel((20, 20))
+        self.assertGreater(blue, red)
+
+    def test_thumbnail_removed_with_last_file(self):
+        file_instance = self.upload(png_bytes(), 'photo.png')
+        self.assertEqual(self.thumbnail(file_instance).status_code, 200)
+        name = Derivative.objects.get().name
+
+        self.client.delete(f'/api/files/{file_instance.pk}/')
+        self.process()
+        self.assertFalse(Derivative.objects.exists())
+        self.assertFalse(get_storage().exists(name))
+
+    @override_settings(DERIVATIVE_STORE_BUDGET_MB=0)
+    def test_eviction_over_budget(self):
+        file_instance = self.upload(png_bytes(), 'photo.png')
+        self.assertEqual(self.thumbnail(file_instance).status_code, 200)
+        name = Derivative.objects.get().name
+        self.assertEqual(thumbnails.evict(), 1)
+        self.assertFalse(get_storage().exists(name))
+        # Вытесненная миниатюра строится заново
+        self.assertEqual(self.thumbnail(file_instance).status_code, 200)
+
+    def test_unsupported_types_not_found(self):
+        for content, name in ((b'%PDF-1.4 document', 'doc.pdf'), (b'\x00\x00\x00\x18ftypmp42' + b'\x00' * 100,
+                                                                    'clip.mp4'), (b'plain text', 'notes.txt')):
+            response = self.thumbnail(self.upload(content, name))
+            self.assertEqual(response.status_code, 404, name)
+        self.assertEqual(self.thumbnail(self.upload(png_bytes(), 'a.png'), size='huge').status_code, 400)
+
+
+class FileListTests(StorageTestCase):
+    def add_files(self, *specs):
+        """specs - (имя, размер, сколько дней назад загружен)"""
+        files = File.objects.bulk_create(
+            [File(user=self.user, original_name=name, unique_name=f'user_{self.user.pk}/{name}', size=size)
+             for name, size, _ in specs]
+        )
+        for file_instance, (_, _, days) in zip(files, specs):
+            File.objects.filter(pk=file_instance.pk).update(uploaded_at=timezone.now() - timedelta(days=days))
+        return files
+
+    def names(self, url='/api/files/', **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [item['original_name'] for item in response.data['results']], response.data['next']
+
+    def walk(self, page_size, between_pages=None, **params):
+        """Имена со всех страниц; between_pages() вызывается после каждой страницы"""
+        names, url = self.names(page_size=page_size, **params)
+        while url:
+            if between_pages:
+                between_pages()
+            page, url = self.names(url)
+            names += page
+        return names
+
+    def test_pages_stable_under_inserts_and_deletes(self):
+        files = self.add_files(*((f'f{i:02}', 1, 30 - i) for i in range(30)))
+        expected = [f'f{i:02}' for i in reversed(range(30))]
+        self.assertEqual(self.walk(7), expected)
+
+        removed = iter(files[::-1])
+        added = iter(range(100))
+
+        def change():
+            # Новый файл попадает в начало списка, удаляется последний уже показанный
+            self.add_files((f'new{next(added)}', 1, 0))
+            File.objects.filter(pk=next(removed).pk).delete()
+
+        self.assertEqual(self.walk(7, change), expected)
+
+    def test_ordering_ties_broken_by_id(self):
+        files = self.add_files(*((f'same{i}', 10, 1) for i in range(5)), ('big', 20, 1))
+        ids = [file_instance.pk for file_instance in files[:5]]
+        response = self.client.get('/api/files/', {'ordering': 'size', 'page_size': 2})
+        first = [item['id'] for item in response.data['results']]
+        rest = self.walk(2, ordering='size')
+        self.assertEqual(first, ids[:2])
+        self.assertEqual(rest, [f'same{i}' for i in range(5)] + ['big'])
+        self.assertEqual(self.walk(2, ordering='-size'), ['big'] + [f'same{i}' for i in reversed(range(5))])
+        self.assertEqual(self.walk(100, ordering='original_name')[:2], ['big', 'same0'])
+
+    def test_filters(self):
+        self.add_files(('Report.pdf', 100, 10), ('report-2.pdf', 5000, 2), ('photo.jpg', 300, 0))
+        self.assertEqual(sorted(self.walk(100, name='rep')), ['Report.pdf', 'report-2.pdf'])
+        self.assertEqual(sorted(self.walk(100, size_min='200', size_max='5000')), ['photo.jpg', 'report-2.pdf'])
+        day = timezone.localdate(timezone.now() - timedelta(days=2)).isoformat()
+        self.assertEqual(sorted(self.walk(100, uploaded_after=day)), ['photo.jpg', 'report-2.pdf'])
+        self.assertEqual(sorted(self.walk(100, uploaded_before=day)), ['Report.pdf', 'report-2.pdf'])
+
+    def test_invalid_filter_values_rejected(self):
+        for params in ({'size_min': 'big'}, {'size_max': '-1'}, {'uploaded_after': 'yesterday'},
+                       {'uploaded_before': '2024-13-01'}):
+            response = self.client.get('/api/files/', params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn(next(iter(params)), response.data)
+
+    def test_only_own_files_listed(self):
+        other = CustomUser.objects.create_user(username='other', email='other@example.com', password='secret')
+        File.objects.create(user=other, original_name='foreign', unique_name='user_x/foreign', size=1)
+        self.add_files(('mine', 1, 0))
+        self.assertEqual(self.walk(100), ['mine'])
+
+    def test_users_paginated_by_id(self):
+        for i in range(4):
+            CustomUser.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='secret')
+        names, url = [], '/api/users/?page_size=2'
+        while url:
+            response = self.client.get(url)
+            names += [item['username'] for item in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(names, ['owner', 'user0', 'user1', 'user2', 'user3'])
+        filtered = self.client.get('/api/users/', {'username': 'USER1'}).data['results']
+        self.assertEqual([item['username'] for item in filtered], ['user1'])
+
+
+class BulkOperationTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.other = CustomUser.objects.create_user(username='other', email='other@example.com', password='secret')
+        other_client = APIClient()
+        other_client.force_authenticate(self.other)
+        response = other_client.post('/api/files/', {'file': SimpleUploadedFile('foreign.txt', b'same bytes')},
+                                     format='multipart')
+        self.foreign = File.objects.get(pk=response.data['id'])
+
+    def bulk_delete(self, ids):
+        return self.client.post('/api/files/bulk-delete/', {'ids': ids}, format='json')
+
+    def bulk_update(self, files):
+        return self.client.patch('/api/files/bulk-update/', {'files': files}, format='json')
+
+    def test_delete_skips_foreign_files_and_counts_once(self):
+        first = self.upload(b'same bytes', 'a.txt')
+        second = self.upload(b'same bytes', 'b.txt')
+        kept = self.upload(b'other bytes', 'c.txt')
+        self.assertEqual(Blob.objects.get(pk=first.blob_id).ref_count, 3)
+
+        response = self.bulk_delete([first.pk, second.pk, first.pk, self.foreign.pk, 999999])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['deleted'], 2)
+        self.assertEqual(list(File.objects.filter(user=self.user).values_list('pk', flat=True)), [kept.pk])
+        self.assertTrue(File.objects.filter(pk=self.foreign.pk).exists())
+        self.assertEqual(Blob.objects.get(pk=first.blob_id).ref_count, 1)
+        self.assertEqual(self.counters(), (1, len(b'other bytes')))
+        self.assertFalse(Job.objects.filter(kind='blob.collect').exists())
+
+    def test_delete_last_references_schedules_collect(self):
+        files = [self.upload(b'unique %d' % i, f'{i}.txt') for i in range(3)]
+        self.bulk_delete([file_instance.pk for file_instance in files])
+        self.assertEqual(Job.objects.filter(kind='blob.collect').count(), 3)
+        self.assertEqual(self.counters(), (0, 0))
+
+    def test_delete_rejects_empty_oversized_and_invalid_lists(self):
+        file_instance = self.upload(b'data')
+        for ids in ([], list(range(1, 10002)), [0], ['x'], None):
+            response = self.bulk_delete(ids)
+            self.assertEqual(response.status_code, 400, ids)
+        self.assertTrue(File.objects.filter(pk=file_instance.pk).exists())
+
+    def test_update_renames_and_comments(self):
+        first = self.upload(b'one', 'a.txt')
+        second = self.upload(b'two', 'b.txt')
+        response = self.bulk_update([{'id': first.pk, 'original_name': 'renamed.txt'},
+                                     {'id': second.pk, 'comment': 'заметка'}])
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.data['updated'], 2)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.original_name, first.comment), ('renamed.txt', ''))
+        self.assertEqual((second.original_name, second.comment), ('b.txt', 'заметка'))
+
+    def test_update_with_foreign_file_changes_nothing(self):
+        mine = self.upload(b'one', 'a.txt')
+        response = self.bulk_update([{'id': mine.pk, 'original_name': 'x.txt'},
+                                     {'id': self.foreign.pk, 'original_name': 'stolen.txt'}])
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.data['ids'], [self.foreign.pk])
+        self.assertEqual(File.objects.get(pk=mine.pk).original_name, 'a.txt')
+        self.assertEqual(File.objects.get(pk=self.foreign.pk).original_name, 'foreign.txt')
+
+    def test_invalid_rename_rejects_whole_batch(self):
+        mine = self.upload(b'one', 'a.txt')
+        for change in ({'original_name': ''}, {'original_name': 'x' * 351}, {}):
+            response = self.bulk_update([{'id': mine.pk, 'original_name': 'ok.txt'}, {'id': mine.pk, **change}])
+            self.assertEqual(response.status_code, 400, change)
+        self.assertEqual(self.bulk_update([]).status_code, 400)
+        self.assertEqual(File.objects.get(pk=mine.pk).original_name, 'a.txt')
+
+
+class StoreFilesTests(StorageTestCase):
+    def stored_files(self):
+        """Все файлы в MEDIA_ROOT, блобы и временные (каталог общий для тестов класса)"""
+        return sorted(path for path in Path(self.media_root).rglob('*') if path.is_file())
+
+    def test_failed_write_stores_nothing(self):
+        def broken():
+            yield b'partial'
+            raise OSError("обрыв соединения")
+
+        before = self.stored_files()
+        with self.assertRaises(OSError):
+            uploads.store_files(self.user, [([b'first'], 'a.txt', ''), (broken(), 'b.txt', ''),
+                                            ([b'third'], 'c.txt', '')])
+        self.assertFalse(File.objects.exists())
+        self.assertFalse(Blob.objects.exists())
+        self.assertEqual(self.stored_files(), before)
+        self.assertEqual(self.counters(), (0, 0))
+
+    def test_rollback_after_acquire_discards_placed_files(self):
+        self.upload(b'existing', 'old.txt')
+        before = self.stored_files()
+        with mock.patch.object(uploads.tasks, 'enqueue_processing_many', side_effect=RuntimeError), \
+                mock.patch.object(uploads.blobs, 'discard_placed', wraps=blobs.discard_placed) as discard:
+            with self.assertRaises(RuntimeError):
+                uploads.store_files(self.user, [([b'new one'], 'a.txt', ''), ([b'existing'], 'b.txt', '')])
+        # Убирается только новый блоб; уже хранившийся остаётся
+        discard.assert_called_once()
+        self.assertEqual(len(discard.call_args.args[0]), 1)
+        self.assertEqual(self.stored_files(), before)
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+        self.assertEqual(self.counters(), (1, len(b'existing')))
+
+    def test_duplicates_in_batch_share_blob(self):
+        before = self.stored_files()
+        files = uploads.store_files(self.user, [([b'same'], 'a.txt', ''), ([b'same'], 'b.txt', 'копия'),
+                                                ([b'other'], 'c.txt', '')])
+        self.assertEqual(files[0].blob_id, files[1].blob_id)
+        self.assertEqual(files[1].comment, 'копия')
+        self.assertEqual(sorted(Blob.objects.values_list('ref_count', flat=True)), [1, 2])
+        # Два блоба и ни одного оставшегося временного файла
+        self.assertEqual(len(set(self.stored_files()) - set(before)), 2)
+        self.assertEqual(len(self.stored_files()), len(before) + 2)
+        self.assertEqual(self.counters(), (3, 13))
+
+
+class ArchiveTests(StorageTestCase):
+    def archive(self, ids=None, **params):
+        if ids is None:
+            response = self.client.get('/api/files/download-archive/', params)
+        else:
+            response = self.client.post('/api/files/download-archive/', {'ids': ids}, format='json')
+        self.assertEqual(response.status_code, 200, getattr(response, 'data', None))
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertIsNone(archive.testzip())
+        return archive
+
+    def test_names_and_contents(self):
+        files = [self.upload(b'first', 'report.txt'), self.upload(b'second', 'report.txt'),
+                 self.upload(b'third', 'report.txt'), self.upload(b'nested', 'a.txt')]
+        File.objects.filter(pk=files[3].pk).update(original_name='dir/a.txt')
+        archive = self.archive([file_instance.pk for file_instance in files])
+        self.assertEqual(
+            {info.filename: archive.read(info) for info in archive.infolist()},
+            {'report.txt': b'first', 'report (1).txt': b'second', 'report (2).txt': b'third',
+             'dir_a.txt': b'nested'},
+        )
+
+    def test_duplicate_names_ignore_case(self):
+        files = [File(original_name=name) for name in ('Отчёт.pdf', 'отчёт.PDF', 'отчёт (1).pdf', '.env', '')]
+        self.assertEqual(
+            [name for _, name in archives.archive_names(files)],
+            ['Отчёт.pdf', 'отчёт (1).PDF', 'отчёт (1) (1).pdf', '.env', 'file'],
+        )
+
+    def test_only_own_and_filtered_files(self):
+        other = CustomUser.objects.create_user(username='other', email='other@example.com', password='secret')
+        foreign = File.objects.create(user=other, original_name='foreign.txt', unique_name='user_x/f', size=1)
+        mine = self.upload(b'mine', 'mine.txt')
+        self.upload(b'skip', 'photo.txt')
+        self.assertEqual(self.archive([mine.pk, foreign.pk]).namelist(), ['mine.txt'])
+        self.assertEqual(self.archive(name='mi').namelist(), ['mine.txt'])
+
+    def test_compressed_types_stored_as_is(self):
+        picture = self.upload(png_bytes(), 'photo.png')
+        text = self.upload(b'line of text\n' * 1000, 'notes.txt')
+        archive = self.archive([picture.pk, text.pk])
+        self.assertEqual(archive.getinfo('photo.png').compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(archive.getinfo('notes.txt').compress_type, zipfile.ZIP_DEFLATED)
+        self.assertEqual(archive.read('photo.png'), png_bytes())
+
+    @override_settings(STORAGE_COMPRESSION='gzip')
+    def test_compressed_blob_archived_decompressed(self):
+        text = b'line of text\n' * 1000
+        file_instance = self.upload(text, 'notes.txt')
+        self.assertTrue(blobs.compress(file_instance.blob_id))
+        self.assertEqual(self.archive([file_instance.pk]).read('notes.txt'), text)
+
+    def test_invalid_ids_rejected(self):
+        for ids in ([], ['1'], 5):
+            response = self.client.post('/api/files/download-archive/', {'ids': ids}, format='json')
+            self.assertEqual(response.status_code, 400, ids)
+
+
+class FileTokenTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def link(self, file_instance):
+        response = self.client.post(f'/api/files/{file_instance.pk}/generate-token/')
+        self.assertEqual(response.status_code, 201, response.content)
+        return f"/api/files/download-temp/{response.data['token']}/"
+
+    def download(self, url):
+        response = APIClient().get(url)
+        if response.status_code == 200:
+            response.content_body = b''.join(response.streaming_content)
+        return response
+
+    def test_purge_expired_deletes_in_batches(self):
+        file_instance = self.upload(b'hello')
+        expired = [FileToken.objects.create(file=file_instance, user=self.user,
+                                            expires_at=timezone.now() - timedelta(seconds=1)) for _ in range(5)]
+        alive = tokens.create(file_instance, self.user)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(tokens.purge_expired(batch_size=2), 5)
+        deletes = [query for query in queries.captured_queries if query['sql'].startswith('DELETE')]
+        self.assertEqual(len(deletes), 3)
+        self.assertEqual(list(FileToken.objects.values_list('pk', flat=True)), [alive.pk])
+        self.assertFalse(FileToken.objects.filter(pk__in=[token.pk for token in expired]).exists())
+
+    def test_cached_link_stops_after_delete_commits(self):
+        file_instance = self.upload(b'hello')
+        url = self.link(file_instance)
+        self.assertEqual(self.download(url).content_body, b'hello')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.download(url).status_code, 200)
+        self.assertFalse([query for query in queries.captured_queries if '"FileToken"' in query['sql']])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.delete(f'/api/files/{file_instance.pk}/').status_code, 204)
+        self.assertEqual(self.download(url).status_code, 404)
+
+    def test_cached_link_follows_rename(self):
+        file_instance = self.upload(b'hello', 'old.txt')
+        url = self.link(file_instance)
+        self.assertIn('old.txt', self.download(url)['Content-Disposition'])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/api/files/{file_instance.pk}/rename/', {'original_name': 'new.txt'},
+                                         format='json')
+            self.assertEqual(response.status_code, 200, response.content)
+        self.assertIn('new.txt', self.download(url)['Content-Disposition'])
+
+    @override_settings(TEMP_LINK_MODE='signed')
+    def test_cached_signed_link_stops_after_delete_commits(self):
+        file_instance = self.upload(b'hello')
+        url = self.link(file_instance)
+        self.assertEqual(self.download(url).status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.delete(f'/api/files/{file_instance.pk}/').status_code, 204)
+        self.assertEqual(self.download(url).status_code, 404)
+
+    def test_touch_writes_once_per_interval(self):
+        file_instance = self.upload(b'hello')
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(3):
+                tokens.touch(file_instance)
+        updates = [query for query in queries.captured_queries if query['sql'].startswith('UPDATE "File"')]
+        self.assertEqual(len(updates), 1)
+        file_instance.refresh_from_db()
+        self.assertIsNotNone(file_instance.last_downloaded)
+
+        # Интервал истёк - ключ пропал из кэша, следующая отдача снова пишет дату
+        cache.delete(f'filetoken-touch:{file_instance.pk}')
+        with CaptureQueriesContext(connection) as queries:
+            tokens.touch(file_instance)
+        self.assertEqual(len([query for query in queries.captured_queries
+                              if query['sql'].startswith('UPDATE "File"')]), 1)
+
+
+class LegacyMigrationTests(StorageTestCase):
+    def legacy_file(self, content, name='old.txt'):
+        unique_name = f'user_{self.user.pk}/{uuid4().hex}_{name}'
+        path = Path(self.media_root, unique_name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+        return File.objects.create(user=self.user, original_name=name, unique_name=unique_name, size=len(content))
+
+    def blob_files(self):
+        return sorted(str(path) for path in Path(self.media_root, 'blobs').rglob('*') if path.is_file())
+
+    def migrate(self, **options):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('migrate_legacy_files', stdout=stdout, stderr=stderr, **options)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_adopt_rewrites_row_and_schedules_removal(self):
+        file_instance = self.legacy_file(b'legacy bytes')
+        old_name = file_instance.unique_name
+        started = timezone.now()
+        self.assertTrue(uploads.adopt_legacy_file(file_instance.pk, old_name, timedelta(minutes=30)))
+
+        file_instance.refresh_from_db()
+        self.assertTrue(file_instance.unique_name.startswith('blobs/'))
+        self.assertEqual(file_instance.unique_name, file_instance.blob.name)
+        self.assertEqual(file_instance.blob.ref_count, 1)
+        with get_storage().open(file_instance.unique_name) as content:
+            self.assertEqual(content.read(), b'legacy bytes')
+
+        job = Job.objects.get(kind='legacy.remove')
+        self.assertEqual(job.payload, {'name': old_name})
+        self.assertGreaterEqual(job.run_at, started + timedelta(minutes=30))
+        # До конца отсрочки старый файл ещё отдаётся по старому пути
+        while (ready := jobs.claim()) is not None:
+            jobs.run(ready)
+        self.assertTrue(Path(self.media_root, old_name).exists())
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        while (ready := jobs.claim()) is not None:
+            jobs.run(ready)
+        self.assertFalse(Path(self.media_root, old_name).exists())
+
+    def test_adopt_shares_existing_blob(self):
+        uploaded = self.upload(b'same bytes')
+        file_instance = self.legacy_file(b'same bytes')
+        self.assertTrue(uploads.adopt_legacy_file(file_instance.pk, file_instance.unique_name, timedelta()))
+        file_instance.refresh_from_db()
+        self.assertEqual(file_instance.blob_id, uploaded.blob_id)
+        self.assertEqual(Blob.objects.get(pk=uploaded.blob_id).ref_count, 2)
+
+    def test_row_changed_during_copy_is_left_alone(self):
+        def delete_row(file_instance):
+            File.objects.filter(pk=file_instance.pk).delete()
+
+        def move_row(file_instance):
+            File.objects.filter(pk=file_instance.pk).update(unique_name=f'user_{self.user.pk}/moved')
+
+        for change in (delete_row, move_row):
+            with self.subTest(change.__name__):
+                file_instance = self.legacy_file(b'changed bytes')
+                blob_files, blob_count = self.blob_files(), Blob.objects.count()
+
+                def write_temp(chunks, write=blobs.write_temp):
+                    written = write(chunks)
+                    change(file_instance)
+                    return written
+
+                with mock.patch.object(uploads.blobs, 'write_temp', side_effect=write_temp):
+                    self.assertFalse(uploads.adopt_legacy_file(file_instance.pk, file_instance.unique_name,
+                                                               timedelta()))
+                self.assertEqual(Blob.objects.count(), blob_count)
+                self.assertEqual(self.blob_files(), blob_files)
+                self.assertFalse(Job.objects.filter(kind='legacy.remove').exists())
+
+    def test_command_counts_missing_and_continues(self):
+        first = self.legacy_file(b'first')
+        missing = self.legacy_file(b'missing')
+        Path(self.media_root, missing.unique_name).unlink()
+        last = self.legacy_file(b'last')
+
+        stdout, stderr = self.migrate(batch_size=2)
+        self.assertIn("Перенесено файлов: 2, без содержимого: 1", stdout)
+        self.assertIn(f"Файл {missing.pk}", stderr)
+        for file_instance in (first, last):
+            file_instance.refresh_from_db()
+            self.assertIsNotNone(file_instance.blob_id)
+        missing.refresh_from_db()
+        self.assertIsNone(missing.blob_id)
+
+    def test_command_rerun_is_idempotent(self):
+        files = [self.legacy_file(content) for content in (b'one', b'two', b'three')]
+        stdout, _ = self.migrate(limit=2)
+        self.assertIn("Перенесено файлов: 2", stdout)
+        stdout, _ = self.migrate()
+        self.assertIn("Перенесено файлов: 1", stdout)
+        state = list(File.objects.order_by('pk').values_list('pk', 'unique_name', 'blob_id'))
+        blob_state = list(Blob.objects.order_by('pk').values_list('pk', 'ref_count'))
+
+        stdout, _ = self.migrate()
+        self.assertIn("Перенесено файлов: 0", stdout)
+        self.assertEqual(list(File.objects.order_by('pk').values_list('pk', 'unique_name', 'blob_id')), state)
+        self.assertEqual(list(Blob.objects.order_by('pk').values_list('pk', 'ref_count')), blob_state)
+        self.assertEqual(Job.objects.filter(kind='legacy.remove').count(), len(files))
+        self.assertEqual(self.counters(), (3, len(b'one') + len(b'two') + len(b'three')))
+
+
+class ScrubBlobsTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.files = [self.upload(content) for content in (b'first blob', b'second blob', b'third blob')]
+        self.blobs = [file_instance.blob for file_instance in self.files]
+
+    def scrub(self, **options):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        options.setdefault('rate_mb', 0)
+        call_command('scrub_blobs', stdout=stdout, stderr=stderr, **options)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def blob_state(self):
+        return {pk: (verified_at is not None, corrupt) for pk, verified_at, corrupt in
+                Blob.objects.filter(pk__in=[blob.pk for blob in self.blobs]).values_list('pk', 'verified_at', 'corrupt')}
+
+    def test_healthy_blobs_marked_verified(self):
+        stdout, _ = self.scrub()
+        self.assertIn("Проверено блобов: 3, повреждений нет", stdout)
+        self.assertEqual(self.blob_state(), {blob.pk: (True, False) for blob in self.blobs})
+
+    def test_corrupted_and_missing_blobs_fail_the_run(self):
+        healthy, corrupted, missing = self.blobs
+        Path(self.media_root, corrupted.name).write_bytes(b'bit rot')
+        Path(self.media_root, missing.name).unlink()
+        with self.assertRaisesMessage(CommandError, "повреждённых или потерянных: 2"):
+            self.scrub()
+        self.assertEqual(self.blob_state(), {healthy.pk: (True, False), corrupted.pk: (True, True),
+                                             missing.pk: (True, True)})
+
+    def test_recently_verified_blobs_are_skipped(self):
+        fresh, stale, _ = self.blobs
+        Blob.objects.filter(pk=fresh.pk).update(verified_at=timezone.now() - timedelta(days=1))
+        Blob.objects.filter(pk=stale.pk).update(verified_at=timezone.now() - timedelta(days=40))
+        # Испорченное, но недавно проверенное содержимое повторно не читается
+        Path(self.media_root, fresh.name).write_bytes(b'bit rot')
+        stdout, _ = self.scrub(interval_days=30)
+        self.assertIn("Проверено блобов: 2, повреждений нет", stdout)
+        self.assertFalse(Blob.objects.get(pk=fresh.pk).corrupt)
+
+    def test_max_minutes_stops_and_next_run_resumes(self):
+        clock = itertools.chain([0, 0], itertools.repeat(3600))
+        with mock.patch.object(scrub_blobs.time, 'monotonic', side_effect=lambda: next(clock)):
+            stdout, _ = self.scrub(batch_size=1, max_minutes=1)
+        self.assertIn("Проверено блобов: 1,", stdout)
+        self.assertEqual(sorted(self.blob_state().values()), [(False, False), (False, False), (True, False)])
+
+        stdout, _ = self.scrub(batch_size=1)
+        self.assertIn("Проверено блобов: 2,", stdout)
+        self.assertEqual(set(self.blob_state().values()), {(True, False)})
+
+    def test_throttle_spreads_reads_across_threads(self):
+        clock = iter([0, 0, 0, 2])
+        with mock.patch.object(scrub_blobs.time, 'monotonic', side_effect=lambda: next(clock)), \
+                mock.patch.object(scrub_blobs.time, 'sleep') as sleep:
+            throttle = scrub_blobs.Throttle(100)
+            throttle(50)
+            throttle(50)
+            throttle(100)
+        self.assertEqual(sleep.call_args_list, [mock.call(0.5), mock.call(1.0), mock.call(1.0)])
+
+    def test_rate_limit_applied_while_reading(self):
+        with mock.patch.object(scrub_blobs.Throttle, '__call__', autospec=True) as throttle:
+            self.scrub(rate_mb=1)
+        self.assertEqual(sum(call.args[1] for call in throttle.call_args_list),
+                         sum(blob.size for blob in self.blobs))
+
+
+class ExplainQueriesTests(TestCase):
+    def test_small_dataset(self):
+        stdout = io.StringIO()
+        call_command('explain_queries', users=2, files=50, stdout=stdout)
+        output = stdout.getvalue()
+        for name in ('files: список', 'files: следующая страница', 'files: временная ссылка',
+                     'admin: файлы пользователя', 'воркер: выборка задачи'):
+            self.assertIn(name, output)
+        # Синтетические данные откатываются
+        self.assertFalse(CustomUser.objects.exists())
+        self.assertFalse(File.objects.exists())
+        self.assertFalse(Job.objects.exists())
+
+    def test_single_file_per_user(self):
+        stdout = io.StringIO()
+        call_command('explain_queries', users=1, files=1, stdout=stdout)
+        self.assertIn('files: список', stdout.getvalue())
+
+
+class DatabaseSettingsTests(SimpleTestCase):
+    def database(self, **env):
+        """DATABASES['default'], каким его соберёт config/settings.py при таких переменных окружения"""
+        with mock.patch.dict(os.environ, env):
+            for name in ('DATABASE_POOL', 'DATABASE_CONN_MAX_AGE', 'DATABASE_POOL_MIN_SIZE',
+                         'DATABASE_POOL_MAX_SIZE', 'DATABASE_POOL_TIMEOUT'):
+                if name not in env:
+                    os.environ.pop(name, None)
+            namespace = runpy.run_path(str(Path(settings.BASE_DIR, 'config', 'settings.py')))
+        return namespace['DATABASES']['default']
+
+    def test_persistent_connections_without_pool(self):
+        database = self.database()
+        self.assertEqual(database['CONN_MAX_AGE'], 60)
+        self.assertNotIn('pool', database['OPTIONS'])
+        self.assertEqual(self.database(DATABASE_CONN_MAX_AGE='0')['CONN_MAX_AGE'], 0)
+
+    def test_pool_replaces_persistent_connections(self):
+        database = self.database(DATABASE_POOL='True', DATABASE_CONN_MAX_AGE='300',
+                                 DATABASE_POOL_MIN_SIZE='1', DATABASE_POOL_MAX_SIZE='4')
+        self.assertEqual(database['CONN_MAX_AGE'], 0)
+        self.assertEqual(database['OPTIONS']['pool'], {'min_size': 1, 'max_size': 4, 'timeout': 10.0})
+
+    def test_django_rejects_pool_with_persistent_connections(self):
+        database = self.database(DATABASE_POOL='True')
+        wrapper = ConnectionHandler({'default': {**database, 'CONN_MAX_AGE': 60}})['default']
+        with self.assertRaisesMessage(ImproperlyConfigured, "persistent connections"):
+            wrapper.pool
+
+    @skipUnless(psycopg_pool is None, "psycopg[pool] установлен")
+    def test_pool_requires_psycopg_pool(self):
+        wrapper = ConnectionHandler({'default': self.database(DATABASE_POOL='True')})['default']
+        with self.assertRaisesMessage(ImproperlyConfigured, "psycopg[pool]"):
+            wrapper.pool
+
+    @skipUnless(psycopg_pool, "нужен psycopg[pool]")
+    def test_pool_created_from_settings(self):
+        database = self.database(DATABASE_POOL='True', DATABASE_POOL_MAX_SIZE='4')
+        wrapper = ConnectionHandler({'default': database})['default']
+        try:
+            self.assertEqual((wrapper.pool.min_size, wrapper.pool.max_size), (2, 4))
+        finally:
+            wrapper.close_pool()
+
+
+class SeedBenchmarkTests(StorageTestCase):
+    def seed(self, **options):
+        manifest = Path(self.media_root, 'dataset.json')
+        call_command('seed_benchmark', users=2, files=7, size=100, distinct=3, prefix='seed',
+                     manifest=str(manifest), stdout=io.StringIO(), **options)
+        return json.loads(manifest.read_text())
+
+    def test_counters_match_created_files(self):
+        manifest = self.seed()
+        self.assertEqual(manifest['users'], ['seed_0', 'seed_1'])
+        self.assertEqual(manifest['files_per_user'], 7)
+
+        users = CustomUser.objects.filter(username__startswith='seed_')
+        actual = actual_usage(users.values_list('pk', flat=True))
+        for user in users:
+            self.assertEqual((user.file_count, user.total_bytes), actual.get(user.pk, (0, 0)), user.username)
+        self.assertEqual(users.get(username='seed_0').file_count, 7)
+        self.assertTrue(users.get(username=manifest['admin']).is_admin)
+
+        seeded = Blob.objects.filter(files__user__in=users).distinct()
+        self.assertEqual(seeded.count(), 3)
+        self.assertEqual(sum(blob.ref_count for blob in seeded), 14)
+        for blob in seeded:
+            self.assertEqual(blob.ref_count, File.objects.filter(blob=blob).count())
+            self.assertTrue(blobs.verify(blob))
+
+    def test_existing_prefix_rejected(self):
+        self.seed()
+        with self.assertRaisesMessage(CommandError, "seed_*"):
+            self.seed()
+        self.assertEqual(CustomUser.objects.filter(username__startswith='seed_').count(), 3)
@@ -0,0 +1,150 @@
+"""
+Миниатюры и превью изображений.
+
+Строятся средствами Pillow для растровых форматов из SUPPORTED_TYPES;
+у анимированных и многостраничных берётся первый кадр или страница.
+Для PDF, видео и остальных типов превью нет (PreviewUnavailable, 404):
+для них понадобились бы внешние программы (poppler, ffmpeg).
+
+Производные файлы строятся по содержимому, а не по записи File, поэтому
+у одинаковых файлов (один блоб) миниатюра общая и строится один раз.
+Они лежат рядом с файлом блоба и учитываются в таблице Derivative; когда
+их суммарный объём превышает DERIVATIVE_STORE_BUDGET_MB, фоновая задача
+удаляет те, что дольше всего не запрашивались (их можно построить заново).
+"""
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Sum
+from django.http import FileResponse
+from django.utils.cache import get_conditional_response
+from django.utils.timezone import now, timedelta
+from PIL import Image, ImageOps, UnidentifiedImageError
+from pathlib import Path
+import mimetypes
+import os
+import tempfile
+from . import jobs
+from .backends import get_storage
+from .compression import CorruptContent, open_content
+from .models import Derivative, Job
+
+
+# Вид производного файла -> наибольшая сторона в пикселях
+PRESETS = {
+    'thumb': 256,
+    'preview': 1024,
+}
+# Типы, для которых строится миниатюра; у анимированных и многостраничных
+# (GIF, WebP, TIFF) берётся первый кадр
+SUPPORTED_TYPES = {
+    'image/jpeg', 'image/png', 'image/gif', 'image/webp', 'image/bmp', 'image/tiff',
+}
+CONTENT_TYPE = 'image/webp'
+QUALITY = 80
+# Время последнего обращения обновляется не чаще, чем раз в этот интервал
+TOUCH_INTERVAL = timedelta(hours=1)
+# Содержимое по id файла не меняется, поэтому миниатюру можно кэшировать навсегда
+CACHE_CONTROL = 'private, max-age=31536000, immutable'
+
+
+class PreviewUnavailable(Exception):
+    """Для файла нельзя построить миниатюру"""
+
+
+def content_type_of(file_instance):
+    return file_instance.content_type or mimetypes.guess_type(file_instance.original_name)[0]
+
+
+def can_preview(file_instance):
+    return file_instance.blob_id is not None and content_type_of(file_instance) in SUPPORTED_TYPES
+
+
+def render(source_name, target_name, size):
+    """
+    Уменьшает изображение source_name до size пикселей по большей стороне,
+    сохраняет в хранилище под именем target_name в WebP и возвращает размер результата
+    """
+    storage = get_storage()
+    try:
+        with open_content(source_name) as source, Image.open(source) as image:
+            # JPEG можно декодировать сразу в уменьшенном масштабе - это в разы быстрее
+            image.draft('RGB', (size, size))
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((size, size))
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if image.has_transparency_data else 'RGB')
+            fd, temp_name = tempfile.mkstemp(dir=storage.temp_dir(), suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as target:
+                    image.save(target, 'WEBP', quality=QUALITY)
+                    written = target.tell()
+                storage.save(target_name, temp_name)
+            except BaseException:
+                Path(temp_name).unlink(missing_ok=True)
+                raise
+            return written
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError, CorruptContent) as exc:
+        raise PreviewUnavailable(
+            "Не удалось построить миниатюру: изображение повреждено или его формат не поддерживается."
+        ) from exc
+
+
+def get_or_create(file_instance, kind):
+    """Готовый производный файл (Derivative) вида kind, построенный при необходимости"""
+    if not can_preview(file_instance):
+        raise PreviewUnavailable("Превью для этого типа файлов недоступно.")
+
+    blob = file_instance.blob
+    derivative = Derivative.objects.filter(blob=blob, kind=kind).first()
+    if derivative is not None and get_storage().exists(derivative.name):
+        touch(derivative)
+        return derivative
+
+    derivative = derivative or Derivative(blob=blob, kind=kind)
+    derivative.size = render(blob.name, derivative.name, PRESETS[kind])
+    derivative.last_accessed = now()
+    try:
+        with transaction.atomic():
+            derivative.save()
+    except IntegrityError:
+        # Ту же миниатюру одновременно построил другой запрос - файл на диске одинаковый
+        derivative = Derivative.objects.get(blob=blob, kind=kind)
+    schedule_eviction()
+    return derivative
+
+
+def touch(derivative):
+    if derivative.last_accessed < now() - TOUCH_INTERVAL:
+        Derivative.objects.filter(pk=derivative.pk).update(last_accessed=now())
+
+
+def schedule_eviction():
+    """Ставит в очередь проверку бюджета, если она ещё не запланирована"""
+    if not Job.objects.filter(kind='derivatives.evict', status=Job.PENDING).exists():
+        jobs.enqueue('derivatives.evict')
+
+
+def evict():
+    """Удаляет давно не запрашивавшиеся производные файлы сверх бюджета; возвращает их число"""
+    budget = settings.DERIVATIVE_STORE_BUDGET_MB * 1024 * 1024
+    excess = (Derivative.objects.aggregate(total=Sum('size'))['total'] or 0) - budget
+    removed = 0
+    for derivative in Derivative.objects.select_related('blob').order_by('last_accessed').iterator():
+        if excess <= 0:
+            break
+        get_storage().delete(derivative.name)
+        derivative.delete()
+        excess -= derivative.size
+        removed += 1
+    return removed
+
+
+def derivative_response(request, derivative):
+    """Ответ с миниатюрой: ETag по содержимому и долгое кэширование в браузере"""
+    etag = f'"{derivative.blob.digest[:32]}-{derivative.kind}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = FileResponse(get_storage().open(derivative.name), content_type=CONTENT_TYPE)
+    response['ETag'] = etag
+    response['Cache-Control'] = CACHE_CONTROL
+    return response
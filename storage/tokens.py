@@ -0,0 +1,243 @@
+"""
+Временные ссылки на файлы.
+
+Популярную ссылку скачивают много раз, поэтому токен вместе с нужными для
+отдачи полями файла (имя на диске, имя для пользователя, тип) кладётся в кэш
+Django до истечения срока ссылки, но не дольше FILE_TOKEN_CACHE_SECONDS:
+повторное скачивание не обращается к базе. Записи удаляются из кэша после
+коммита удаления или переименования файла. Кэш по умолчанию свой у каждого
+процесса, поэтому при нескольких воркерах удаление файла до остальных
+процессов доходит не позже чем через FILE_TOKEN_CACHE_SECONDS.
+
+Просроченные токены удаляет purge_expired (python manage.py purge_file_tokens
+и воркер фоновых задач).
+
+При TEMP_LINK_MODE = 'signed' строки FileToken не создаются: токен ссылки -
+подписанные SECRET_KEY id файла, срок действия и необязательные ограничения
+(IP-адрес, диапазон байтов). Подпись и срок проверяются без обращения к базе,
+а имя и путь файла берутся из того же кэша, поэтому такие ссылки можно
+выпускать пачками, а отдачу по ним - масштабировать добавлением серверов.
+Ссылки обоих видов принимаются в любом режиме.
+"""
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.timezone import now, timedelta
+from datetime import datetime, timezone
+import uuid
+from . import caching
+from .models import File, FileToken
+from .network import client_ip
+
+
+# Срок действия временной ссылки
+TOKEN_LIFETIME = timedelta(minutes=10)
+# Сколько просроченных токенов удаляется одним запросом
+PURGE_BATCH_SIZE = 1000
+# Дата последнего скачивания по ссылке обновляется не чаще, чем раз в этот интервал (в секундах)
+TOUCH_INTERVAL = 60
+# Соль подписи: подписанный здесь токен не подойдёт другим подписям проекта и наоборот
+SIGNED_LINK_SALT = 'storage.tokens.signed-link'
+
+
+class ScopeError(ValueError):
+    """Неверно заданы ограничения ссылки"""
+
+
+class SignedLink:
+    """Подписанная временная ссылка; поля те же, что нужны от FileToken при выдаче и скачивании"""
+
+    def __init__(self, file_id, expires_at, ip=None, byte_range=None, token=None):
+        self.file_id = file_id
+        self.expires_at = expires_at
+        self.ip = ip
+        self.byte_range = byte_range
+        self.file = None
+        if token is None:
+            payload = {'f': file_id, 'e': int(expires_at.timestamp())}
+            if ip:
+                payload['ip'] = ip
+            if byte_range:
+                payload['r'] = list(byte_range)
+            token = signing.dumps(payload, salt=SIGNED_LINK_SALT)
+        self.token = token
+
+    @classmethod
+    def load(cls, token):
+        """Ссылка из токена или None, если подпись не сходится"""
+        try:
+            payload = signing.loads(token, salt=SIGNED_LINK_SALT)
+        except signing.BadSignature:
+            return None
+        expires_at = datetime.fromtimestamp(payload['e'], tz=timezone.utc)
+        return cls(payload['f'], expires_at, payload.get('ip'), payload.get('r'), token=token)
+
+    def is_valid(self):
+        return now() < self.expires_at
+
+
+def cache_key(token):
+    return f'filetoken:v2:{token}'
+
+
+def file_cache_key(file_id):
+    return f'filetoken-file:v2:{file_id}'
+
+
+def parse_scope(data, remote_addr):
+    """
+    Ограничения ссылки из запроса на её выпуск: bind_ip - скачивать можно
+    только с IP-адреса, с которого ссылку выпустили; range - только
+    диапазон байтов "начало-конец" (включительно). Доступны для подписанных ссылок.
+    """
+    scope = {}
+    if data.get('bind_ip'):
+        scope['ip'] = remote_addr
+    if data.get('range'):
+        start, dash, end = str(data['range']).partition('-')
+        if not (dash and start.isdigit() and end.isdigit() and int(start) <= int(end)):
+            raise ScopeError("Диапазон указывается как \"начало-конец\" в байтах, например \"0-1023\".")
+        scope['byte_range'] = (int(start), int(end))
+    if scope and settings.TEMP_LINK_MODE != 'signed':
+        raise ScopeError("Ограничения по IP и диапазону доступны только для подписанных ссылок.")
+    return scope
+
+
+def create(file_instance, user, **scope):
+    return create_many([file_instance], user, **scope)[0]
+
+
+def create_many(files, user, **scope):
+    """Временные ссылки на файлы, по одной на каждый, в порядке files"""
+    expires_at = now() + TOKEN_LIFETIME
+    if settings.TEMP_LINK_MODE == 'signed':
+        return [SignedLink(file_instance.pk, expires_at, **scope) for file_instance in files]
+    return FileToken.objects.bulk_create(
+        [FileToken(file=file_instance, user=user, expires_at=expires_at) for file_instance in files]
+    )
+
+
+def resolve(token):
+    """
+    Ссылка по токену из URL: FileToken для UUID, иначе SignedLink.
+    None - ссылки нет, подпись неверна или файл уже удалён.
+    """
+    try:
+        token = uuid.UUID(token)
+    except ValueError:
+        pass
+    else:
+        return get(token)
+
+    link = SignedLink.load(token)
+    if link is None:
+        return None
+    # У просроченной ссылки файл не нужен: в ответ уйдёт ошибка
+    if link.is_valid():
+        link.file = get_file(link.file_id)
+        if link.file is None:
+            return None
+    return link
+
+
+def get_file(file_id):
+    """Файл только с полями, нужными для скачивания, или None, если его нет"""
+    key = file_cache_key(file_id)
+    entry = cache.get(key)
+    if entry is None:
+        file_instance = File.objects.only(
+            'id', 'user', 'unique_name', 'original_name', 'content_type', 'size'
+        ).filter(pk=file_id).first()
+        if file_instance is None:
+            return None
+        entry = (file_instance.user_id, file_instance.unique_name, file_instance.original_name,
+                 file_instance.content_type, file_instance.size)
+        cache.set(key, entry, settings.FILE_TOKEN_CACHE_SECONDS)
+        return file_instance
+
+    user_id, unique_name, original_name, content_type, size = entry
+    return File(pk=file_id, user_id=user_id, unique_name=unique_name, original_name=original_name,
+                content_type=content_type, size=size)
+
+
+def apply_scope(link, request):
+    """
+    Проверяет ограничения подписанной ссылки и подставляет в запрос её
+    диапазон байтов; False - запрос пришёл не с того IP-адреса.
+    """
+    if not isinstance(link, SignedLink):
+        return True
+    if link.ip and client_ip(request) != link.ip:
+        return False
+    if link.byte_range:
+        request.META['HTTP_RANGE'] = 'bytes=%d-%d' % tuple(link.byte_range)
+        request.META.pop('HTTP_IF_RANGE', None)
+    return True
+
+
+def offloadable(link):
+    """Можно ли отдать файл через фронтовой сервер: диапазон ссылки он бы не учёл"""
+    return not (isinstance(link, SignedLink) and link.byte_range)
+
+
+def get(token):
+    """
+    Токен с файлом или None, если его нет.
+
+    Из кэша возвращаются несохранённые объекты только с полями, нужными
+    для скачивания: id, unique_name, original_name, content_type и size файла.
+    """
+    key = cache_key(token)
+    entry = cache.get(key)
+    if entry is None:
+        token_instance = (
+            FileToken.objects.select_related('file')
+            .only('token', 'expires_at', 'file__id', 'file__user', 'file__unique_name', 'file__original_name',
+                  'file__content_type', 'file__size')
+            .filter(token=token)
+            .first()
+        )
+        if token_instance is None:
+            return None
+        file_instance = token_instance.file
+        entry = (token_instance.expires_at, file_instance.pk, file_instance.user_id, file_instance.unique_name,
+                 file_instance.original_name, file_instance.content_type, file_instance.size)
+        timeout = min((token_instance.expires_at - now()).total_seconds(), settings.FILE_TOKEN_CACHE_SECONDS)
+        if timeout > 0:
+            cache.set(key, entry, timeout)
+        return token_instance
+
+    expires_at, file_id, user_id, unique_name, original_name, content_type, size = entry
+    file_instance = File(pk=file_id, user_id=user_id, unique_name=unique_name, original_name=original_name,
+                         content_type=content_type, size=size)
+    return FileToken(token=token, expires_at=expires_at, file=file_instance)
+
+
+def forget(file_ids):
+    """
+    Удаляет из кэша действующие ссылки на файлы; вызывается до удаления
+    или переименования, а кэш чистится после коммита, чтобы параллельный
+    запрос не положил в него старые данные снова.
+    """
+    tokens = FileToken.objects.filter(file_id__in=file_ids, expires_at__gt=now()).values_list('token', flat=True)
+    keys = [cache_key(token) for token in tokens] + [file_cache_key(file_id) for file_id in file_ids]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def touch(file_instance):
+    """Обновляет дату последнего скачивания, но не чаще раза в TOUCH_INTERVAL на файл"""
+    if cache.add(f'filetoken-touch:{file_instance.pk}', True, TOUCH_INTERVAL):
+        File.objects.filter(pk=file_instance.pk).update(last_downloaded=now())
+        caching.invalidate_files([file_instance.user_id])
+
+
+def purge_expired(batch_size=PURGE_BATCH_SIZE):
+    """Удаляет просроченные токены порциями по batch_size; возвращает их число"""
+    deleted = 0
+    while True:
+        ids = list(FileToken.objects.filter(expires_at__lte=now()).values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += FileToken.objects.filter(pk__in=ids).delete()[0]
@@ -0,0 +1,258 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import transaction
+from django.utils.timezone import now, timedelta
+from pathlib import Path
+from . import blobs, jobs, quotas, tasks
+from .backends import get_storage
+from .models import File, UploadSession
+from .usage import add_usage
+
+
+# Размер блока, которым читаем тело запроса при приёме части файла
+CHUNK_READ_SIZE = 64 * 1024
+# Сколько может длиться запись одной части, прежде чем сессию можно снова занять
+CHUNK_LOCK_TIMEOUT = timedelta(minutes=5)
+
+
+class ChunkConflict(Exception):
+    """Смещение части не совпадает с уже принятым или сессия занята другим запросом"""
+
+
+class SessionGone(Exception):
+    """Сессию отменили или удалили как просроченную, пока принималась часть"""
+
+
+def create_file(user, temp_path, digest, size, original_name, comment=''):
+    """
+    Создаёт запись File для содержимого из временного файла.
+
+    Временный файл забирается хранилищем блобов (переносится или удаляется,
+    если такие байты уже есть). Если ошибка случилась до этого, он остаётся
+    на месте, а если после - файл нового блоба убирается из хранилища вместе
+    с откатом его строки. Дальнейшая обработка файла ставится в очередь
+    фоновых задач в той же транзакции.
+    """
+    with transaction.atomic():
+        blob, placed = blobs.acquire(temp_path, digest, size)
+        try:
+            file_instance = File.objects.create(
+                user=user,
+                original_name=original_name,
+                unique_name=blob.name,
+                blob=blob,
+                size=size,
+                comment=comment
+            )
+            tasks.enqueue_processing(file_instance)
+        except BaseException:
+            blobs.discard_placed(placed)
+            raise
+        return file_instance
+
+
+def store_file(user, chunks, original_name, comment=''):
+    """Сохраняет загружаемый поток частей (например, UploadedFile.chunks()) и создаёт File"""
+    temp_path, digest, size = blobs.write_temp(chunks)
+    try:
+        return create_file(user, temp_path, digest, size, original_name, comment)
+    finally:
+        temp_path.unlink(missing_ok=True)
+
+
+def adopt_legacy_file(file_id, name, grace):
+    """
+    Переносит в хранилище блобов файл, загруженный до его появления
+    (unique_name вида user_<id>/..., без blob), и возвращает True. False -
+    строку за это время удалили или уже перенесли; FileNotFoundError - файла нет.
+
+    Файл читается и хэшируется вне транзакции, строка блокируется только на
+    замену имени. Старый файл удаляет фоновая задача через grace: запросы,
+    успевшие прочитать старое имя из базы или кэша, ещё могут его отдать.
+    """
+    with get_storage().open(name) as source:
+        temp_path, digest, size = blobs.write_temp(iter(lambda: source.read(blobs.HASH_READ_SIZE), b''))
+    try:
+        with transaction.atomic():
+            file_instance = File.objects.select_for_update().filter(pk=file_id, blob=None, unique_name=name).first()
+            if file_instance is None:
+                return False
+            file_instance.blob, placed = blobs.acquire(temp_path, digest, size)
+            try:
+                file_instance.unique_name = file_instance.blob.name
+                file_instance.save(update_fields=['blob', 'unique_name'])
+                jobs.enqueue('legacy.remove', delay=grace, name=name)
+                # Тип и миниатюры старых файлов не определялись
+                tasks.enqueue_processing(file_instance)
+            except BaseException:
+                blobs.discard_placed(placed)
+                raise
+        return True
+    finally:
+        temp_path.unlink(missing_ok=True)
+
+
+def store_files(user, items):
+    """
+    Сохраняет сразу несколько загруженных файлов: items - список (chunks, original_name, comment).
+
+    Файлы пишутся на диск параллельно в пуле из BULK_UPLOAD_WORKERS потоков,
+    а записи File создаются одним bulk_create в одной транзакции. Если не удалось
+    записать хотя бы один файл или транзакция откатилась, не сохраняется ничего:
+    ни строк, ни файлов на диске.
+    """
+    with ThreadPoolExecutor(max_workers=settings.BULK_UPLOAD_WORKERS) as pool:
+        futures = [pool.submit(blobs.write_temp, chunks) for chunks, _, _ in items]
+    written, errors = [], []
+    for future in futures:
+        try:
+            written.append(future.result())
+        except Exception as exc:
+            errors.append(exc)
+
+    try:
+        if errors:
+            raise errors[0]
+        with transaction.atomic():
+            stored, placed = blobs.acquire_many(written)
+            try:
+                files = File.objects.bulk_create([
+                    File(
+                        user=user,
+                        original_name=original_name,
+                        unique_name=stored[digest].name,
+                        blob=stored[digest],
+                        size=size,
+                        comment=comment
+                    )
+                    for (_, original_name, comment), (_, digest, size) in zip(items, written)
+                ])
+                # bulk_create не отправляет post_save - счётчики и задачи обработки обновляем сами
+                add_usage(user.pk, len(files), sum(file_instance.size for file_instance in files))
+                tasks.enqueue_processing_many(files)
+            except BaseException:
+                blobs.discard_placed(placed)
+                raise
+        return files
+    finally:
+        for temp_path, _, _ in written:
+            temp_path.unlink(missing_ok=True)
+
+
+def staging_path(session):
+    """Путь к временному файлу сессии загрузки"""
+    return Path(settings.UPLOAD_STAGING_ROOT) / f"{session.id}.part"
+
+
+def session_expiry():
+    return now() + timedelta(hours=settings.UPLOAD_SESSION_TTL_HOURS)
+
+
+def start_session(user, original_name, size, comment=''):
+    """
+    Создаёт сессию загрузки и пустой временный файл.
+
+    Заявленный размер сразу занимает место в квоте (QuotaExceeded, если
+    не помещается) и освобождается вместе с сессией.
+    """
+    with transaction.atomic():
+        quotas.lock_and_check(user, size)
+        session = UploadSession.objects.create(
+            user=user,
+            original_name=original_name,
+            size=size,
+            comment=comment,
+            expires_at=session_expiry()
+        )
+    path = staging_path(session)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.touch()
+    return session
+
+
+def claim_session(session, offset):
+    """Занимает сессию, если она жива, свободна и уже приняла ровно offset байт"""
+    return UploadSession.objects.filter(
+        pk=session.pk, offset=offset, expires_at__gt=now()
+    ).exclude(locked_until__gt=now()).update(locked_until=now() + CHUNK_LOCK_TIMEOUT)
+
+
+def append_chunk(session, stream, offset, length):
+    """
+    Дописывает часть файла из потока запроса прямо во временный файл.
+
+    Сессия занимается на время записи, чтобы две части с одним смещением
+    не писали в файл одновременно. Принятые байты фиксируются даже при обрыве
+    соединения, так что клиент может продолжить с того места, где остановился.
+    """
+    if not claim_session(session, offset):
+        raise ChunkConflict()
+
+    written = 0
+    try:
+        try:
+            destination = open(staging_path(session), 'r+b')
+        except FileNotFoundError:
+            # Временный файл удалён вместе с сессией (discard_session, purge_uploads)
+            raise SessionGone() from None
+        with destination:
+            destination.seek(offset)
+            destination.truncate()
+            while written < length:
+                data = stream.read(min(CHUNK_READ_SIZE, length - written))
+                if not data:
+                    break
+                destination.write(data)
+                written += len(data)
+    finally:
+        # update, а не save: сессию могли удалить, пока шла запись, и save упал бы с DatabaseError
+        expires_at = session_expiry()
+        updated = UploadSession.objects.filter(pk=session.pk).update(
+            offset=offset + written, expires_at=expires_at, locked_until=None
+        )
+    if not updated:
+        raise SessionGone()
+    session.offset = offset + written
+    session.expires_at = expires_at
+    session.locked_until = None
+    return written
+
+
+def finish_session(session):
+    """
+    Переносит собранный файл в хранилище блобов и создаёт запись File.
+
+    При ошибке сессия освобождается, чтобы повтор не получал ChunkConflict
+    до истечения CHUNK_LOCK_TIMEOUT. Если временного файла нет, сессия
+    удаляется и бросается SessionGone. Ошибка после переноса временного файла
+    в хранилище (откат create_file) его не возвращает: повтор получит SessionGone.
+    """
+    if not claim_session(session, session.size):
+        raise ChunkConflict()
+
+    session_id = session.pk
+    path = staging_path(session)
+    try:
+        digest, size = blobs.hash_file(path)
+        # Сессия удаляется в той же транзакции, в которой файл попадает в счётчики,
+        # так что её место в квоте не считается дважды. create_file - последним:
+        # после него в транзакции нечему падать, а его откат он убирает сам
+        with transaction.atomic():
+            session.delete()
+            file_instance = create_file(session.user, path, digest, size, session.original_name, session.comment)
+    except FileNotFoundError as exc:
+        # Временный файл удалён (discard_session, purge_uploads) - завершить сессию уже нельзя,
+        # и её место в квоте освобождается сразу
+        UploadSession.objects.filter(pk=session_id).delete()
+        raise SessionGone() from exc
+    except BaseException:
+        # Откат вернул строку сессии - освобождаем её для повтора
+        UploadSession.objects.filter(pk=session_id).update(locked_until=None)
+        raise
+    return file_instance
+
+
+def discard_session(session):
+    """Удаляет сессию вместе с временным файлом"""
+    staging_path(session).unlink(missing_ok=True)
+    session.delete()
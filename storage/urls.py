@@ -12,6 +12,7 @@ from .views import (
 from rest_framework_simplejwt.views import (
     TokenRefreshView,
 )
+from . import async_views
 
 
 router = DefaultRouter()
@@ -30,4 +31,9 @@ urlpatterns = [
     path("api/auth/reset-password/", ResetPasswordView.as_view(), name="reset_password"),
 
     path('api/auth/me/', get_current_user, name='auth-me'),
+
+    # Асинхронные версии передачи файлов для запуска под ASGI
+    path('api/async/files/', async_views.upload_file, name='async-file-upload'),
+    path('api/async/files/<int:pk>/download/', async_views.download_file, name='async-file-download'),
+    path('api/async/files/download-temp/<str:token>/', async_views.download_temp, name='async-file-download-temp'),
 ]
\ No newline at end of file
@@ -0,0 +1,48 @@
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Greatest
+from . import caching
+from .models import CustomUser, File
+
+
+def add_usage(user_id, files, size):
+    """
+    Атомарно меняет счётчики пользователя (отрицательные значения - удаление).
+
+    Счётчики не уходят ниже нуля: если они разошлись с таблицей File,
+    удаление не должно падать на ограничении положительного поля
+    (расхождение исправит reconcile_usage).
+    """
+    CustomUser.objects.filter(pk=user_id).update(
+        file_count=Greatest(F('file_count') + files, 0),
+        total_bytes=Greatest(F('total_bytes') + size, 0)
+    )
+    caching.invalidate_user(user_id)
+
+
+def actual_usage(user_ids=None):
+    """Реальные количество и объём файлов по таблице File: {user_id: (count, bytes)}"""
+    files = File.objects.all()
+    if user_ids is not None:
+        files = files.filter(user_id__in=user_ids)
+    rows = files.values('user_id').annotate(count=Count('id'), total=Sum('size')).order_by()
+    return {row['user_id']: (row['count'], row['total'] or 0) for row in rows}
+
+
+def reconcile_user(user_id):
+    """
+    Пересчитывает счётчики одного пользователя по таблице File.
+
+    Строка пользователя блокируется, поэтому параллельная загрузка
+    дождётся пересчёта и прибавит свой файл уже к исправленному значению.
+    Возвращает (было, стало) или None, если расхождения нет.
+    """
+    with transaction.atomic():
+        user = CustomUser.objects.select_for_update().only('file_count', 'total_bytes').get(pk=user_id)
+        actual = actual_usage([user_id]).get(user_id, (0, 0))
+        stored = (user.file_count, user.total_bytes)
+        if stored == actual:
+            return None
+        user.file_count, user.total_bytes = actual
+        user.save(update_fields=['file_count', 'total_bytes'])
+        return stored, actual
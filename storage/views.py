@@ -1,27 +1,41 @@
 from django.shortcuts import render
+from django.http import StreamingHttpResponse
 from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
 from rest_framework import status
-from .models import CustomUser, File, FileToken
+from .models import CustomUser, File, UploadSession
 from .serializers import (
     UserSerializer,
+    CurrentUserSerializer,
     RegisterSerializer,
     FileSerializer,
     CustomTokenObtainPairSerializer,
-    FileTokenSerializer
+    FileTokenSerializer,
+    UploadSessionSerializer,
+    BulkFileIdsSerializer,
+    BulkFileUpdateSerializer
 )
+from . import archives, bulk, caching, quotas, search, thumbnails, tokens, uploads
+from .downloads import file_download_response
+from .filters import FileFilter, FileOrderingFilter, UserFilter
+from .network import client_ip
+from .pagination import FileCursorPagination, SearchPagination, UserCursorPagination
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework_simplejwt.views import TokenObtainPairView
-from django.utils.timezone import now, timedelta
+from django.utils.timezone import now
 from django.contrib.auth.hashers import make_password
-from django.conf import settings
-from django.http import FileResponse
-from pathlib import Path
-from urllib.parse import quote
-import os
+from django.db import transaction
+from django.db.models import prefetch_related_objects
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# id сессии загрузки в URL (UUID)
+UPLOAD_ID_PATTERN = r'(?P<upload_id>[0-9a-f]{8}-(?:[0-9a-f]{4}-){3}[0-9a-f]{12})'
 
 
 class CustomTokenObtainPairView(TokenObtainPairView):
@@ -32,6 +46,8 @@ class UserViewSet(ModelViewSet):
     queryset = CustomUser.objects.all()
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = UserCursorPagination
+    filter_backends = [UserFilter]
 
 
 class RegisterView(APIView):
@@ -59,19 +75,64 @@ class RegisterView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class FileViewSet(ModelViewSet):
+class FileViewSet(caching.CachedListMixin, ModelViewSet):
     queryset = File.objects.all()
     serializer_class = FileSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = FileCursorPagination
+    filter_backends = [FileFilter, FileOrderingFilter]
+    # Список файлов кэшируется для каждого пользователя (см. caching)
+    cache_kind = 'files'
+
+    def cache_scope(self):
+        return self.request.user.pk
 
     def get_queryset(self):
         # Фильтруем файлы только для текущего пользователя
-        return File.objects.filter(user=self.request.user)
+        return File.objects.filter(user=self.request.user).prefetch_related('jobs')
 
     def get_serializer_context(self):
         # Передаем текущий запрос в контекст сериализотора
         return {'request': self.request}
 
+    # Действия, принимающие файлы в multipart-теле запроса
+    MULTIPART_UPLOAD_ACTIONS = ('create', 'bulk_upload')
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # Место в квоте резервируется до разбора тела, то есть до записи файлов на диск
+        self.quota_handler = None
+        if self.action in self.MULTIPART_UPLOAD_ACTIONS and request.user.quota is not None:
+            self.quota_handler = quotas.QuotaUploadHandler(request.user)
+            request.upload_handlers.insert(0, self.quota_handler)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        # Загруженные файлы уже учтены в счётчиках пользователя, резерв больше не нужен
+        if getattr(self, 'quota_handler', None) is not None:
+            self.quota_handler.release()
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, quotas.QuotaExceeded):
+            return Response({"error": exc.detail}, status=exc.status_code)
+        return super().handle_exception(exc)
+
+    @action(detail=False, methods=['get'], url_path='search', pagination_class=SearchPagination)
+    def search(self, request):
+        """
+        Поиск по имени и комментарию: q - слова запроса (можно начала слов,
+        имена находятся и с опечатками). Результаты отсортированы по релевантности,
+        доступны те же фильтры, что и у списка (name, size_min и др.).
+        """
+        text = request.query_params.get('q', '')
+        if not text.strip():
+            return Response({"error": "Не указан поисковый запрос (параметр q)."}, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = search.search_files(FileFilter().filter_queryset(request, self.get_queryset(), self), text)
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
     @action(detail=False, methods=['post'], url_path='bulk-upload')
     def bulk_upload(self, request):
         """Обработка массовой загрузки файлов"""
@@ -86,35 +147,105 @@ class FileViewSet(ModelViewSet):
                 index = int(key[9:-1])  # Извлекаем индекс из 'comments[0]'
                 comments[index] = value
 
-        # Создание папки пользователя
-        user_folder = os.path.join(settings.MEDIA_ROOT, f"user_{request.user.id}")
-        os.makedirs(user_folder, exist_ok=True)
-
-        # Обработка каждого файла
-        created_files = []
-        for index, uploaded_file in enumerate(files):
-            unique_name = f"{now().timestamp()}_{uploaded_file.name}"
-            file_path = os.path.join(user_folder, unique_name)
-
-            # Сохраняем файл на диск
-            with open(file_path, 'wb') as destination:
-                for chunk in uploaded_file.chunks():
-                    destination.write(chunk)
-
-            # Создаем запись в базе данных
-            file_instance = File.objects.create(
-                user=request.user,
-                original_name=uploaded_file.name,
-                unique_name=os.path.join(f"user_{request.user.id}", unique_name),
-                size=uploaded_file.size,
-                comment=comments.get(index, '')  # Добавляем комментарий, если он есть
-            )
-            created_files.append(file_instance)
+        # Файлы пишутся параллельно, записи создаются одной транзакцией: либо все, либо ни одного
+        try:
+            created_files = uploads.store_files(request.user, [
+                (uploaded_file.chunks(), uploaded_file.name, comments.get(index, ''))  # Комментарий, если он есть
+                for index, uploaded_file in enumerate(files)
+            ])
+        except OSError:
+            return Response({"error": "Не удалось сохранить файлы, ни один файл не загружен."},
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
         # Возвращаем информацию о загруженных файлах
+        prefetch_related_objects(created_files, 'jobs')
         serializer = self.get_serializer(created_files, many=True)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    def get_upload_session(self, upload_id):
+        """Сессия загрузки текущего пользователя или None"""
+        return UploadSession.objects.filter(pk=upload_id, user=self.request.user).first()
+
+    @action(detail=False, methods=['post'], url_path='uploads')
+    def create_upload(self, request):
+        """Начало возобновляемой загрузки: возвращает id сессии для отправки частей"""
+        serializer = UploadSessionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        session = uploads.start_session(request.user, **serializer.validated_data)
+        return Response(UploadSessionSerializer(session).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['get'], url_path='uploads/' + UPLOAD_ID_PATTERN)
+    def upload_status(self, request, upload_id=None):
+        """Состояние сессии: сколько байт уже принято"""
+        session = self.get_upload_session(upload_id)
+        if session is None or not session.is_valid():
+            return Response({"error": "Сессия загрузки не найдена."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(UploadSessionSerializer(session).data)
+
+    @upload_status.mapping.put
+    def upload_chunk(self, request, upload_id=None):
+        """
+        Приём очередной части файла.
+
+        Тело запроса - сырые байты части, заголовок Upload-Offset - позиция,
+        с которой она начинается. Байты пишутся во временный файл по мере чтения,
+        без буферизации всего тела в памяти или во временных файлах Django.
+        """
+        session = self.get_upload_session(upload_id)
+        if session is None or not session.is_valid():
+            return Response({"error": "Сессия загрузки не найдена."}, status=status.HTTP_404_NOT_FOUND)
+
+        offset = request.headers.get('Upload-Offset', '')
+        if not offset.isdigit():
+            return Response({"error": "Не указан заголовок Upload-Offset."}, status=status.HTTP_400_BAD_REQUEST)
+        offset = int(offset)
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+        if offset + length > session.size:
+            return Response({"error": "Часть выходит за пределы заявленного размера файла."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            uploads.append_chunk(session, request.stream, offset, length)
+        except uploads.ChunkConflict:
+            accepted = UploadSession.objects.filter(pk=session.pk).values_list('offset', flat=True).first()
+            if accepted is not None:
+                return Response({"error": "Смещение не совпадает с принятым или часть уже загружается.",
+                                 "offset": accepted}, status=status.HTTP_409_CONFLICT)
+            return Response({"error": "Сессия загрузки не найдена."}, status=status.HTTP_404_NOT_FOUND)
+        except uploads.SessionGone:
+            return Response({"error": "Сессия загрузки не найдена."}, status=status.HTTP_404_NOT_FOUND)
+
+        return Response(UploadSessionSerializer(session).data)
+
+    @upload_status.mapping.delete
+    def abort_upload(self, request, upload_id=None):
+        """Отмена загрузки и удаление принятых частей"""
+        session = self.get_upload_session(upload_id)
+        if session is None:
+            return Response({"error": "Сессия загрузки не найдена."}, status=status.HTTP_404_NOT_FOUND)
+        uploads.discard_session(session)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=False, methods=['post'], url_path='uploads/' + UPLOAD_ID_PATTERN + '/complete')
+    def complete_upload(self, request, upload_id=None):
+        """Завершение загрузки: создаёт файл из принятых частей"""
+        session = self.get_upload_session(upload_id)
+        if session is None or not session.is_valid():
+            return Response({"error": "Сессия загрузки не найдена."}, status=status.HTTP_404_NOT_FOUND)
+        if session.offset != session.size:
+            return Response({"error": "Файл загружен не полностью.", "offset": session.offset},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            file_instance = uploads.finish_session(session)
+        except uploads.ChunkConflict:
+            return Response({"error": "Загрузка ещё не завершена."}, status=status.HTTP_409_CONFLICT)
+        except uploads.SessionGone:
+            return Response({"error": "Сессия загрузки не найдена."}, status=status.HTTP_404_NOT_FOUND)
+
+        serializer = self.get_serializer(file_instance)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
     @action(detail=True, methods=['patch'], url_path='rename')
     def rename_file(self, request, pk=None):
         """Переименование файла"""
@@ -125,7 +256,7 @@ class FileViewSet(ModelViewSet):
             return Response({"error": "Новое имя файла не указано."}, status=status.HTTP_400_BAD_REQUEST)
 
         file_instance.original_name = new_name
-        file_instance.save()
+        file_instance.save(update_fields=['original_name'])
         return Response({"message": "Имя файла обновлено", "original_name": file_instance.original_name})
 
     @action(detail=True, methods=['patch'], url_path='comment')
@@ -135,76 +266,176 @@ class FileViewSet(ModelViewSet):
         new_comment = request.data.get('comment', '')
 
         file_instance.comment = new_comment
-        file_instance.save()
+        file_instance.save(update_fields=['comment'])
         return Response({"message": "Комментарий обновлен", "comment": file_instance.comment})
 
+    @action(detail=False, methods=['post'], url_path='bulk-delete')
+    def bulk_delete(self, request):
+        """Удаление многих файлов: {"ids": [1, 2, 3]}; чужие и несуществующие id пропускаются"""
+        serializer = BulkFileIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        deleted = bulk.delete_files(File.objects.filter(user=request.user, pk__in=serializer.validated_data['ids']))
+        return Response({"message": "Файлы удалены", "deleted": deleted})
+
+    @action(detail=False, methods=['patch'], url_path='bulk-update')
+    def bulk_update(self, request):
+        """
+        Переименование и изменение комментариев многих файлов одной транзакцией:
+        {"files": [{"id": 1, "original_name": "...", "comment": "..."}, ...]}.
+        Если хотя бы один файл не найден, ничего не меняется.
+        """
+        serializer = BulkFileUpdateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        changes = {item.pop('id'): item for item in serializer.validated_data['files']}
+
+        with transaction.atomic():
+            files = list(
+                File.objects.select_for_update().filter(user=request.user, pk__in=changes)
+                .only('id', 'user', 'original_name', 'comment')
+            )
+            missing = set(changes) - {file_instance.pk for file_instance in files}
+            if missing:
+                return Response({"error": "Файлы не найдены.", "ids": sorted(missing)},
+                                status=status.HTTP_404_NOT_FOUND)
+            bulk.update_files(files, changes)
+        return Response({"message": "Файлы обновлены", "updated": len(files)})
+
     @action(detail=True, methods=['get'], url_path='download')
     def download_file(self, request, pk=None):
         """Скачивание файла"""
         file_instance = self.get_object()
-        file_path = Path(settings.MEDIA_ROOT) / file_instance.unique_name
 
-        # Логируем путь для проверки
-        print(f"Пытаемся найти файл по пути: {file_path}")
+        logger.debug("Скачивание файла %s: %s", file_instance.pk, file_instance.unique_name)
 
-        if not file_path.exists():
+        # Отдельная проверка существования стоила бы лишнего stat на каждое скачивание
+        try:
+            response = file_download_response(
+                request, file_instance.unique_name, file_instance.original_name,
+                content_type=file_instance.content_type, digest=file_instance.digest, size=file_instance.size
+            )
+        except FileNotFoundError:
             return Response({"error": "Файл не найден"}, status=status.HTTP_404_NOT_FOUND)
 
-        # Обновляем дату последнего скачивания
-        file_instance.last_downloaded = now()
-        file_instance.save()
-
-        # Кодируем имя файла для корректного отображения в браузере
-        encoded_filename = quote(file_instance.original_name)
+        # Обновляем дату последнего скачивания, если файл действительно отдаётся
+        if response.status_code in (200, 206):
+            file_instance.last_downloaded = now()
+            file_instance.save(update_fields=['last_downloaded'])
+        return response
 
-        # Устанавливаем корректный заголовок Content-Disposition
-        response = FileResponse(file_path.open('rb'), as_attachment=True)
-        response['Content-Disposition'] = f"attachment; filename*=UTF-8''{encoded_filename}"
+    @action(detail=False, methods=['get', 'post'], url_path='download-archive')
+    def download_archive(self, request):
+        """
+        Скачивание нескольких файлов одним ZIP-архивом.
+
+        POST - id файлов в теле ({"ids": [1, 2, 3]}), GET - файлы, подходящие
+        под те же фильтры, что и список (name, size_min, uploaded_after и др.).
+        """
+        queryset = self.get_queryset().prefetch_related(None).order_by('original_name', 'id')
+        if request.method == 'POST':
+            ids = request.data.get('ids')
+            if not isinstance(ids, list) or not ids or not all(isinstance(pk, int) for pk in ids):
+                return Response({"error": "Передайте список id файлов в поле ids."},
+                                status=status.HTTP_400_BAD_REQUEST)
+            queryset = queryset.filter(pk__in=ids)
+        else:
+            queryset = FileFilter().filter_queryset(request, queryset, self)
+
+        files = list(queryset.only(
+            'id', 'original_name', 'unique_name', 'size', 'uploaded_at', 'content_type'
+        )[:archives.MAX_ARCHIVE_FILES + 1])
+        if not files:
+            return Response({"error": "Файлы не найдены."}, status=status.HTTP_404_NOT_FOUND)
+        if len(files) > archives.MAX_ARCHIVE_FILES:
+            return Response({"error": f"В архив можно добавить не больше {archives.MAX_ARCHIVE_FILES} файлов."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # Дата скачивания обновляется одним запросом для всех файлов архива
+        File.objects.filter(pk__in=[f.pk for f in files]).update(last_downloaded=now())
+        caching.invalidate_files([request.user.pk])
+
+        response = StreamingHttpResponse(archives.iter_archive(files), content_type='application/zip')
+        response['Content-Disposition'] = 'attachment; filename="files.zip"'
+        response['Cache-Control'] = 'private, no-cache'
+        # Чтобы nginx передавал архив клиенту по мере сборки, а не копил его у себя
+        response['X-Accel-Buffering'] = 'no'
         return response
 
+    @action(detail=True, methods=['get'], url_path='thumbnail')
+    def thumbnail(self, request, pk=None):
+        """Миниатюра (size=thumb) или превью (size=preview) изображения в формате WebP"""
+        file_instance = self.get_object()
+        kind = request.query_params.get('size', 'thumb')
+        if kind not in thumbnails.PRESETS:
+            return Response({"error": f"Размер должен быть одним из: {', '.join(thumbnails.PRESETS)}."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            derivative = thumbnails.get_or_create(file_instance, kind)
+        except thumbnails.PreviewUnavailable as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_404_NOT_FOUND)
+        return thumbnails.derivative_response(request, derivative)
+
     @action(detail=True, methods=['post'], url_path='generate-token')
     def generate_token(self, request, pk=None):
-        """Генерация временной ссылки"""
+        """
+        Генерация временной ссылки. Подписанную ссылку (TEMP_LINK_MODE=signed)
+        можно ограничить: {"bind_ip": true, "range": "0-1023"}.
+        """
         file_instance = self.get_object()
-        user = request.user
-        expires_at = now() + timedelta(minutes=10)  # Срок действия токена 10 минут
-
-        token = FileToken.objects.create(
-            file=file_instance,
-            user=user,
-            expires_at=expires_at
-        )
+        try:
+            scope = tokens.parse_scope(request.data, client_ip(request))
+        except tokens.ScopeError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        token = tokens.create(file_instance, request.user, **scope)
 
         serializer = FileTokenSerializer(token, context={'request': request})  # Передаем request в контекст
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @action(detail=False, methods=['post'], url_path='generate-tokens')
+    def generate_tokens(self, request):
+        """Временные ссылки на многие файлы: {"ids": [1, 2, 3]}; чужие и несуществующие id пропускаются"""
+        serializer = BulkFileIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            scope = tokens.parse_scope(request.data, client_ip(request))
+        except tokens.ScopeError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        files = list(File.objects.filter(user=request.user, pk__in=serializer.validated_data['ids']).only('id'))
+        links = tokens.create_many(files, request.user, **scope)
+        data = [
+            {'file': file_instance.pk, **FileTokenSerializer(link, context={'request': request}).data}
+            for file_instance, link in zip(files, links)
+        ]
+        return Response(data, status=status.HTTP_201_CREATED)
+
     @action(detail=False, methods=['get'], url_path='download-temp/(?P<token>[^/]+)', permission_classes=[AllowAny])
     def download_temp(self, request, token=None):
         """Скачивание файла по временной ссылке без авторизации"""
         try:
-            token_instance = FileToken.objects.get(token=token)
+            token_instance = tokens.resolve(token)
+            if token_instance is None:
+                return Response({"error": "Токен недействителен или не существует."}, status=status.HTTP_404_NOT_FOUND)
             if not token_instance.is_valid():
                 return Response({"error": "Срок действия ссылки истек."}, status=status.HTTP_400_BAD_REQUEST)
+            if not tokens.apply_scope(token_instance, request):
+                return Response({"error": "Ссылка выдана для другого адреса."}, status=status.HTTP_403_FORBIDDEN)
 
             file_instance = token_instance.file
-            file_path = Path(settings.MEDIA_ROOT) / file_instance.unique_name
 
-            if not file_path.exists():
+            try:
+                response = file_download_response(
+                    request, file_instance.unique_name, file_instance.original_name,
+                    content_type=file_instance.content_type, offload=tokens.offloadable(token_instance),
+                    digest=file_instance.digest, size=file_instance.size
+                )
+            except FileNotFoundError:
                 return Response({"error": "Файл не найден"}, status=status.HTTP_404_NOT_FOUND)
 
-            # Обновляем дату последнего скачивания
-            file_instance.last_downloaded = now()
-            file_instance.save()
-
-            # Кодируем имя файла для корректного отображения в браузере
-            encoded_filename = quote(file_instance.original_name)
-
-            # Формируем ответ с файлом
-            response = FileResponse(file_path.open('rb'), as_attachment=True)
-            response['Content-Disposition'] = f"attachment; filename*=UTF-8''{encoded_filename}"
+            # Обновляем дату последнего скачивания, если файл действительно отдаётся
+            if response.status_code in (200, 206):
+                tokens.touch(file_instance)
             return response
-        except FileToken.DoesNotExist:
-            return Response({"error": "Токен недействителен или не существует."}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -258,5 +489,5 @@ class ResetPasswordView(APIView):
 @permission_classes([IsAuthenticated])
 def get_current_user(request):
     """Возвращает информацию о текущем пользователе"""
-    serializer = UserSerializer(request.user)
+    serializer = CurrentUserSerializer(request.user)
     return Response(serializer.data)